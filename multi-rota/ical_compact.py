@@ -0,0 +1,145 @@
+"""Write calendars in a compact form to shrink the feeds.
+
+
+This file provides compact_calendar which removes what is repeated from the
+events of a calendar: a DESCRIPTION the same as the SUMMARY is dropped - or
+the text is split between the two - a LOCATION the same in every event is
+dropped and the DTEND of a timed shift becomes a shorter DURATION. The
+calendar gets a VTIMEZONE for each TZID its times refer to, covering just
+the dates of its events, so that clients do not have to know the zone.
+
+A short usage example::
+
+>>> import ical_compact
+>>> cal = ical_compact.compact_calendar(create_calendar_for(...))
+>>> print(cal.to_ical().decode())
+...
+BEGIN:VEVENT
+SUMMARY:SHO: James
+DTSTART;TZID=Europe/London:20180129T080000
+DURATION:PT12H30M
+DTSTAMP:20171217T213559Z
+UID:61cd37ab-b2a5-57f6-9ad8-ed0df74b60db
+DESCRIPTION:SpR: Martin\\, Consultant: Positano
+END:VEVENT
+...
+"""
+from datetime import date, datetime, timedelta, timezone
+from icalendar import Timezone
+
+# These properties are dropped if they are the same in every event
+CONSTANT_PROPERTIES = ('LOCATION',)
+
+
+def _length(event, start):
+    if 'DTEND' in event:
+        return event.decoded('DTEND') - start
+    return event.decoded('DURATION', timedelta(0))
+
+
+def _instant(value):
+    """Returns the aware datetime *value* as a UTC instant. A pytz zone
+        attached with replace() only has its first offset, so the wall clock
+        time is localized in the zone to get the offset of that day."""
+    if hasattr(value.tzinfo, 'localize'):
+        value = value.tzinfo.localize(value.replace(tzinfo=None))
+    return value.astimezone(timezone.utc)
+
+
+def exact_length(start, end):
+    """Returns the exact time from the datetime *start* to *end* - a
+        DURATION is exact time, so a shift across a change to or from
+        summer time is an hour shorter or longer than its wall clock
+        times suggest"""
+    if start.tzinfo is None or end.tzinfo is None:
+        return end - start
+    return _instant(end) - _instant(start)
+
+
+def _dates(prop):
+    """Returns the dates or datetimes of an RDATE or EXDATE property"""
+    props = prop if isinstance(prop, list) else [prop]
+    return [value.dt for p in props for value in p.dts]
+
+
+def _day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _last_day(event, start):
+    """Returns the day the last occurrence of *event* starts on"""
+    days = [_day(start)]
+    if 'RRULE' in event:
+        from dateutil.rrule import rrulestr
+        rule = event['RRULE'].to_ical().decode()
+        if 'COUNT' in rule or 'UNTIL' in rule:
+            days.append(_day(list(rrulestr(rule, dtstart=start))[-1]))
+    if 'RDATE' in event:
+        days.extend(_day(value) for value in _dates(event['RDATE']))
+    return max(days)
+
+
+def add_timezones(cal):
+    """Add a VTIMEZONE to calendar *cal* for each TZID its event times refer
+        to that it does not have, covering the dates of its events"""
+    zones = {}
+    days = []
+    for event in cal.walk('VEVENT'):
+        start = event.decoded('DTSTART')
+        days.append(_day(start))
+        days.append(_last_day(event, start) + _length(event, start))
+        for name in ('DTSTART', 'DTEND'):
+            if name in event and 'TZID' in event[name].params:
+                zones.setdefault(event[name].params['TZID'],
+                                 event.decoded(name).tzinfo)
+    for timezone in cal.walk('VTIMEZONE'):
+        zones.pop(str(timezone['TZID']), None)
+
+    # An overnight shift ends the day after it starts
+    timezones = [Timezone.from_tzinfo(tzinfo, tzid=tzid,
+                                      first_date=min(days),
+                                      last_date=max(days) +
+                                      timedelta(days=1))
+                 for tzid, tzinfo in zones.items() if tzinfo is not None]
+    cal.subcomponents = timezones + cal.subcomponents
+    return cal
+
+
+def compact_event(event, split=None):
+    """Drop the DESCRIPTION of *event* if it is the same as its SUMMARY - or,
+        given the function *split*, make them the (summary, description) it
+        returns for the event - and replace the DTEND of a timed event
+        shorter than a day with the DURATION of its exact length"""
+    if 'DESCRIPTION' in event and \
+            str(event['DESCRIPTION']) == str(event.get('SUMMARY')):
+        del event['DESCRIPTION']
+        if split is not None:
+            summary, description = split(event)
+            del event['SUMMARY']
+            event.add('summary', summary)
+            if description:
+                event.add('description', description)
+
+    start = event.decoded('DTSTART')
+    if 'DTEND' in event and type(start) is not date:
+        length = exact_length(start, event.decoded('DTEND'))
+        if timedelta(0) <= length < timedelta(days=1):
+            del event['DTEND']
+            event.add('duration', length)
+    return event
+
+
+def compact_calendar(cal, split=None):
+    """Compact the events of calendar *cal* with compact_event, drop the
+        CONSTANT_PROPERTIES that are the same in every event and add the
+        VTIMEZONEs it needs, in place, and return it"""
+    events = cal.walk('VEVENT')
+    for name in CONSTANT_PROPERTIES:
+        values = set(str(event.get(name)) for event in events)
+        if events and len(values) == 1 and all(name in event
+                                               for event in events):
+            for event in events:
+                del event[name]
+    for event in events:
+        compact_event(event, split)
+    return add_timezones(cal)
@@ -4,12 +4,12 @@
 # _________________________________ IMPORTS _________________________________
 
 from icalendar import Calendar, Event
-import uuid
 from datetime import datetime, time, timedelta
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import pytz
 import dateutil.parser
 import re
+from ical_helper import event_uid
 
 # ________________________________ CONSTANTS ________________________________
 
@@ -17,6 +17,9 @@ import re
 # into BST/GMT
 TZ = pytz.timezone('Europe/London')
 
+# The name of this rota - used to give each event a stable identity
+ROTA = 'multi-rota'
+
 # Let's define the hours of work
 HOURS = {
     'SHO': {
@@ -59,6 +62,10 @@ HOURS = {
 
 }
 
+# The minimum rest between the end of one shift and the start of the next -
+# shorter rests and overlapping shifts are reported
+MIN_REST = timedelta(hours=11)
+
 # ________________________________ FUNCTIONS ________________________________
 # Spelling corrections
 SPELLING_CORRECTIONS = {'wiliam': 'William'}
@@ -97,6 +104,9 @@ def role_split(role_string):
 
 
 def munge_role(name, role, row):
+    if role not in row:
+        # The role has already been munged
+        return (name, role)
     canonical = row[role].lower().strip()
     if AM_PM_SPLIT_RE.match(canonical):
         groups = AM_PM_SPLIT_RE.match(canonical).groups()
@@ -119,7 +129,7 @@ def convert_to_date(date_str):
 
 
 # Calendar functions
-def create_calendar_for(name, job, role_rows_list):
+def create_calendar_for(name, job, role_rows_list, dtstamp=None):
     """Create a calendar for name in job using the provided rows"""
     # Create a basic iCalendar object
     cal = Calendar()
@@ -137,114 +147,197 @@ def create_calendar_for(name, job, role_rows_list):
             for row in rows:
                 for key in row:
                     if key != 'Date':
-                        event = create_event_for(row[key], key, row)
+                        event = create_event_for(row[key], key, row,
+                                                 dtstamp)
                         cal.add_component(event)
     else:
         for role, rows in role_rows_list:
             for row in rows:
-                event = create_event_for(name, role, row)
+                event = create_event_for(name, role, row, dtstamp)
                 cal.add_component(event)
 
     return cal
 
 
-def create_event_for(name, role, row):
-    """Create an icalendar event for this row for name and role"""
-    event = Event()
+def others_on(row, role):
+    """Returns the others in the department in this row, for role"""
+    return ', '.join(['{0}: {1}'.format(key, row[key])
+                      for key in row
+                      if key not in ['Date', role]])
 
+
+def create_event_for(name, role, row, dtstamp=None):
+    """Create an icalendar event for this row for name and role, stamped
+        with *dtstamp* or the current time"""
     # Munge the role
     (name, role) = munge_role(name, role, row)
+    day = convert_to_date(row['Date'])
+
+    if 'start' in HOURS[role]:
+        # If we have a start time in the HOURS dictionary for this role
+        # - combine it with date
+        start = datetime.combine(day, HOURS[role]['start'])
+    else:
+        # Otherwise just use the date
+        start = day
+
+    if 'duration' in HOURS[role]:
+        end = start + HOURS[role]['duration']
+    elif (HOURS[role]['end'] > HOURS[role]['start']):
+        end = datetime.combine(day, HOURS[role]['end'])
+    else:
+        # OK so the end is before the start?
+        # simply add a day on to the date and then combine
+        end = datetime.combine(day + timedelta(days=1), HOURS[role]['end'])
+
+    return create_shift_event(name, role, start, end, others_on(row, role),
+                              dtstamp)
+
+
+def create_shift_event(name, role, start, end, others, dtstamp=None):
+    """Create an icalendar event for name in role from *start* to *end*,
+        local wall clock datetimes, with the *others* in the department"""
+    event = Event()
 
     # Description should say who else is in department.
     description = '{0}: {1} with '.format(role, name)
-    others_d = ', '.join(['{0}: {1}'.format(key, row[key])
-                          for key in row
-                          if key not in ['Date', role]])
-    event.add('description', description + others_d)
+    event.add('description', description + others)
 
     # Make the summary the same as the description
-    event.add('summary', description + others_d)
+    event.add('summary', description + others)
 
     if 'start' in HOURS[role]:
-        # If we have a start time in the HOURS dictionary for this role
-        # - combine it with date
-        event.add('dtstart',
-                  datetime.combine(
-                      convert_to_date(row['Date']),
-                      HOURS[role]['start']))
+        event.add('dtstart', start.replace(tzinfo=TZ))
     else:
-        # Otherwise just use the date
-        event.add('dtstart', convert_to_date(row['Date']).date())
+        # A whole day shift just has the date
+        event.add('dtstart', start.date())
 
     if 'duration' in HOURS[role]:
-        event.add('duration', HOURS[role]['duration'])
+        event.add('duration', end - start)
     else:
-        if (HOURS[role]['end'] > HOURS[role]['start']):
-            event.add('dtend',
-                      datetime.combine(
-                          convert_to_date(row['Date']),
-                          HOURS[role]['end']))
-        else:
-            # OK so the end is before the start?
-            # simply add a day on to the date and then combine
-            event.add('dtend',
-                      datetime.combine(
-                          convert_to_date(row['Date']) + timedelta(days=1),
-                          HOURS[role]['end']))
-
-    event.add('dtstamp', datetime.now())
+        event.add('dtend', end.replace(tzinfo=TZ))
+
+    event.add('dtstamp', dtstamp or datetime.now())
     event.add('location', 'At work')  # Set this to something useful
-    event.add('uid', uuid.uuid4())
+    event.add('uid', event_uid(ROTA, name, role, start))
     return event
 
 
 # File reading functions
-def read_csv(fname, handler, sheet, *args, **kwds):
+def read_csv(fname, handler, sheet, *args, where=None, parallel=True,
+             **kwds):
     """Reads the given csv file *fname* as DictReader and calls handler with
-        the first argument as the reader. Optional and named parameters are
-        passed to the provided handler"""
-    from csv import DictReader
-    with open(fname) as f:
-        r = DictReader(f)
-        return handler(r, *args, **kwds)
+        the first argument as the reader, keeping only the rows *where* the
+        predicate of a (fieldname, predicate) pair is true - filtered in
+        parallel for a big file unless *parallel* is False. Optional and
+        named parameters are passed to the provided handler"""
+    from csv_helper import DictReader
+    r = DictReader(fname, where=where, parallel=parallel)
+    return handler(r, *args, **kwds)
 
 
-def read_excel(fname, handler, sheet=0, *args, **kwds):
+def read_excel(fname, handler, sheet=0, *args, where=None, **kwds):
     """Reads the given excel file *fname* as DictReader and calls handler with
-        the first argument as the reader. Optional and named parameters are
-        passed to the provided handler"""
+        the first argument as the reader, keeping only the rows *where* the
+        predicate of a (fieldname, predicate) pair is true. Optional and
+        named parameters are passed to the provided handler"""
     from xlrd_helper import DictReader
+    if not isinstance(fname, str):
+        # bytes, a memoryview or a file-like object
+        r = DictReader(fname, sheet_index=sheet, where=where)
+        return handler(r, *args, **kwds)
     with open(fname, 'rb') as f:
-        r = DictReader(f, sheet_index=sheet)
+        r = DictReader(f, sheet_index=sheet, where=where)
         return handler(r, *args, **kwds)
 
 
-def read(fname, handler, sheet=0, *args, **kwds):
+def read(fname, handler, sheet=0, *args, where=None, parallel=True,
+         **kwds):
     """Attempt to read given file *fname* as a DictReader and calls handler
-        with the first argument as the reader. Optional and named parameters
-        are passed to the provided handler"""
+        with the first argument as the reader, keeping only the rows *where*
+        the predicate of a (fieldname, predicate) pair is true. A csv file
+        is read in parallel as read_csv unless *parallel* is False. Optional
+        and named parameters are passed to the provided handler.
+        *fname* may also be the rota as bytes, a memoryview or a seekable
+        binary file-like object, in which case its format is found from its
+        first bytes"""
+    if not isinstance(fname, str):
+        from xlrd_helper import sniff_format
+        if sniff_format(fname) == 'csv':
+            return read_csv(fname, handler, sheet, *args, where=where,
+                            parallel=parallel, **kwds)
+        return read_excel(fname, handler, sheet, *args, where=where, **kwds)
     if fname.lower().endswith('.csv'):
-        return read_csv(fname, handler, sheet, *args, **kwds)
+        return read_csv(fname, handler, sheet, *args, where=where,
+                        parallel=parallel, **kwds)
     elif fname.lower().endswith('.xls') or fname.lower().endswith('.xlsx'):
-        return read_excel(fname, handler, sheet, *args, **kwds)
+        return read_excel(fname, handler, sheet, *args, where=where, **kwds)
     else:
         raise ValueError('Unknown filetype: %s' % fname)
 
 
+def date_where(window):
+    """Returns the *where* option of the readers which skips the rows outside
+        the dates in *window*, or None"""
+    from rota_window import window_where
+    return window_where(window, 'Date', convert_to_date)
+
+
+def merge_sheets(results):
+    """Merge the rota information read from each sheet of a workbook"""
+    from itertools import chain
+    from rota_model import RotaModel
+    if results and isinstance(results[0], RotaModel):
+        return RotaModel.concatenate(results)
+    if results and isinstance(results[0], list):
+        return list(chain.from_iterable(results))
+    merged = defaultdict(list)
+    for result in results:
+        for key in result:
+            merged[key].extend(result[key])
+    return merged
+
+
+def read_sheets(fname, handler, sheets, *args, **kwds):
+    """Reads each of the *sheets* of the excel file *fname* in a separate
+        process with handler, merging the results. Optional and named
+        parameters are passed to the provided handler"""
+    from xlrd_helper import map_sheets, sheet_indices
+    return merge_sheets(map_sheets(read, fname, handler,
+                                   sheet_indices(fname, sheets),
+                                   *args, **kwds))
+
+
 # Reading functions
-def handle_rows(rows):
-    """Store the rota information by name and job"""
+def row_names(row):
+    """Yields the (name, role) of everyone on in a row of the rota"""
+    for key in row:
+        if key != 'Date':
+            names = role_split(row[key])
+            for uncorrected in names:
+                yield (autocorrect(uncorrected), key)
+
+
+def handle_rows(rows, kept=()):
+    """Store the rota information by name and job. The (name, job) pairs in
+        *kept* are kept even if they have no rows."""
     # nr_to_rows: name_to_list_of_rows_dict
     nr_to_rows = defaultdict(list)
+    nr_to_rows[('All', 'All')] = []
+
     for row in rows:
         nr_to_rows[('All', 'All')].append(row)
-        for key in row:
-            if key != 'Date':
-                names = role_split(row[key])
-                for uncorrected in names:
-                    name = autocorrect(uncorrected)
-                    nr_to_rows[(name, key)].append(row)
+        for name_role in row_names(row):
+            nr_to_rows[name_role].append(row)
+
+    for name_job in kept:
+        nr_to_rows.setdefault(name_job, [])
+
+    return group_by_job(nr_to_rows)
+
 
+def group_by_job(nr_to_rows):
+    """Group the rows of each name, role pair by name and job"""
     # nj_to_rrows: name_job_to_list_role_rows_dict
     nj_to_rrows = defaultdict(list)
 
@@ -258,66 +351,587 @@ def handle_rows(rows):
     return nj_to_rrows
 
 
+def handle_rows_spilled(rows, spilled=None, kept=()):
+    """Store the rota information like handle_rows but in temporary files,
+        partitioned by name, rather than in memory. The rows are appended to
+        the SpilledRota *spilled* if given."""
+    from rota_spill import SpilledRota
+    if spilled is None:
+        spilled = SpilledRota()
+    for row in rows:
+        spilled.everything.append(row)
+        for name, role in row_names(row):
+            spilled.groups.append((name, role), row, name)
+    for name, job in kept:
+        spilled.groups.touch((name, job), name)
+    return spilled
+
+
+def read_spilled(fname, sheet, kept=(), where=None):
+    """Reads the rota *fname* into a SpilledRota, a sheet at a time, keeping
+        the (name, job) pairs in *kept* and only the rows *where* the
+        predicate of a (fieldname, predicate) pair is true. A csv file is
+        read in a single process so that only a few of its rows are in
+        memory at once."""
+    from rota_spill import SpilledRota
+    spilled = SpilledRota()
+    try:
+        if isinstance(sheet, int):
+            return read(fname, handle_rows_spilled, sheet, spilled, kept,
+                        where=where, parallel=False)
+        from xlrd_helper import sheet_indices
+        for index in sheet_indices(fname, sheet):
+            read(fname, handle_rows_spilled, index, spilled, kept,
+                 where=where, parallel=False)
+        return spilled
+    except BaseException:
+        spilled.close()
+        raise
+
+
+def spilled_partitions(spilled):
+    """Yields the rota information of each partition of the SpilledRota
+        *spilled* as returned by handle_rows, without the rows of everyone"""
+    for nr_to_rows in spilled.groups.partitions():
+        yield group_by_job(nr_to_rows)
+
+
+def shift_records(nj_to_r_rows):
+    """Yields a (name, job, role, day, row) tuple for every shift in the rota
+        information returned by handle_rows"""
+    for name, job in nj_to_r_rows:
+        if (name, job) == ('All', 'All'):
+            continue
+        for role, rows in nj_to_r_rows[(name, job)]:
+            for row in rows:
+                _, munged = munge_role(name, role, row)
+                yield (name, job, munged,
+                       convert_to_date(row['Date']).date(), row)
+
+
+def handle_rows_columnar(rows, kept=()):
+    """Store the rota information as a columnar rota model, built from the
+        rows a column of the rota at a time, with the shifts in the order of
+        their rows. The (name, job) pairs in *kept* are kept even if they
+        have no shifts."""
+    import numpy as np
+    from rota_model import RotaModel
+    rows = list(rows)
+    days = np.array([convert_to_date(row['Date']).date() for row in rows],
+                    dtype='datetime64[D]')
+    roles = [key for key in dict.fromkeys(key for row in rows for key in row)
+             if key != 'Date']
+    numbers, columns, names, jobs, munged = [], [], [], [], []
+    for column, role in enumerate(roles):
+        job = HOURS[role]['job'] \
+            if role in HOURS and 'job' in HOURS[role] else role
+        for number, row in enumerate(rows):
+            if role not in row:
+                continue
+            for uncorrected in role_split(row[role]):
+                name, shift_role = munge_role(autocorrect(uncorrected), role,
+                                              row)
+                numbers.append(number)
+                columns.append(column)
+                names.append(name)
+                jobs.append(job)
+                munged.append(shift_role)
+    numbers = np.array(numbers, dtype=np.int64)
+    columns = np.array(columns, dtype=np.int64)
+    cells = np.lexsort((columns, numbers))
+
+    def first_seen(*fields):
+        """Returns the position in the rows at which the combination of the
+            *fields* of each shift is first seen"""
+        key = np.zeros(len(numbers), dtype=np.int64)
+        for field in fields:
+            values, codes = np.unique(np.array(field, dtype=object),
+                                      return_inverse=True)
+            key = key * len(values) + codes.reshape(-1)
+        _, first, inverse = np.unique(key[cells], return_index=True,
+                                      return_inverse=True)
+        seen = np.empty(len(key), dtype=np.int64)
+        seen[cells] = first[inverse.reshape(-1)]
+        return seen
+
+    # The shifts are put in the order of their rows and, within a row, of
+    # when each person in each job and then in each role is first seen -
+    # the order handle_rows groups them in
+    order = np.lexsort((np.argsort(cells), first_seen(names, columns),
+                        first_seen(names, jobs), numbers))
+    sources = np.empty(len(rows), dtype=object)
+    sources[:] = rows
+    return RotaModel.from_columns(np.array(names, dtype=object)[order],
+                                  np.array(jobs, dtype=object)[order],
+                                  np.array(munged, dtype=object)[order],
+                                  days[numbers[order]],
+                                  sources[numbers[order]],
+                                  HOURS, kept)
+
+
+def load_index(fname, sheet=0, window=None):
+    """Returns a RotaIndex of the shifts in *window* of the rota *fname* to
+        query who works when without creating the calendars"""
+    from rota_index import RotaIndex
+    reader = read if isinstance(sheet, int) else read_sheets
+    return RotaIndex(reader(fname, handle_rows_columnar, sheet,
+                            where=date_where(window)))
+
+
 # Check last names functions
-def check_last_names(nj_to_r_rows, directory):
-    """Check from the previous run of this parser if there are new names,
-        returns a dictionary of names to number of rows"""
+def count_rows(nj_to_r_rows):
+    """Returns a dictionary of name, job pairs to number of rows"""
+    # number is the sum of rows for each role for this name, job pair
+    return {(name, job): sum((len(rows)
+                              for _, rows in nj_to_r_rows[(name, job)]))
+            for name, job in nj_to_r_rows}
+
+
+def count_rows_columnar(model):
+    """Returns a dictionary of name, job pairs to number of rows"""
+    name_to_number_of_rows = {('All', 'All'): len(distinct_rows(model))}
+    name_to_number_of_rows.update(model.counts('name', 'job'))
+    name_to_number_of_rows.update((pair, 0) for pair in model.empty)
+    return name_to_number_of_rows
+
+
+def digest_rows(nj_to_r_rows):
+    """Returns a dictionary of name, job pairs to a digest of their shifts"""
+    from rota_state import digest_shifts
+    return digest_shifts(shift_records(nj_to_r_rows),
+                         lambda record: record[:2],
+                         ('All', 'All'))
+
+
+def digest_rows_columnar(model):
+    """Returns a dictionary of name, job pairs to a digest of their shifts"""
+    from rota_state import digest_shifts
+    return digest_shifts(model.shifts(),
+                         lambda record: record[:2],
+                         ('All', 'All'))
+
+
+def published_names(directory):
+    """Returns the (name, job) pairs of the last run, whose calendars are
+        kept even if they have no shifts in a window"""
     from os.path import exists, join
-    from csv import DictReader, DictWriter
-
-    last_names = {}
-    # Read the last names
-    if exists(join(directory, 'last_names.csv')):
-        with open(join(directory, 'last_names.csv')) as f:
-            r = DictReader(f)
-            for row in r:
-                last_names[(row['name'], row['job'])] = int(row['number'])
-
-    name_to_number_of_rows = {}
-    with open(join(directory, 'last_names.csv'), 'w') as f:
-        w = DictWriter(f, ['name', 'job', 'number'])
-        w.writeheader()
-        for name, job in nj_to_r_rows:
-            # number is the sum of rows for each role for this name, job pair
-            number = sum((len(rows)
-                          for _, rows in nj_to_r_rows[(name, job)]))
-            if not (name, job) in last_names:
-                # We have a new name
-                print('New name in rota: %s (%s) with %d rows' %
-                      (name, job, number))
-            w.writerow({'name': name,
-                        'job': job,
-                        'number': number})
-            name_to_number_of_rows[(name, job)] = number
+    from rota_state import StateStore, STATE_FILENAME
+    if not exists(join(directory, STATE_FILENAME)):
+        return []
+    with StateStore(directory) as store:
+        return [(name, job) for name, job in store.names() if job != 'All']
+
+
+def check_last_names(name_to_number_of_rows, directory, name_to_digest=None,
+                     source=''):
+    """Check from the previous runs of this parser if there are new names,
+        recording this run in the state store. Returns a dictionary of names
+        to number of rows"""
+    from rota_state import StateStore
+    if name_to_digest is None:
+        name_to_digest = {}
+
+    with StateStore(directory) as store:
+        run = store.record_run(source,
+                               [(name, job, number,
+                                 name_to_digest.get((name, job)))
+                                for (name, job), number
+                                in name_to_number_of_rows.items()])
+        for name, job, number in store.new_names(run):
+            # We have a new name
+            print('New name in rota: %s (%s) with %d rows' %
+                  (name, job, number))
 
     return name_to_number_of_rows
 
 
-# Writing functions
-def create_calendars(nj_to_r_rows, directory):
+# Conflict functions
+def check_conflicts(nj_to_r_rows, min_rest=MIN_REST):
+    """Print any overlapping shifts, or shifts with less than *min_rest*
+        between them, in the rota information returned by handle_rows"""
+    from rota_model import RotaModel
+    check_conflicts_columnar(
+        RotaModel.from_records(shift_records(nj_to_r_rows), HOURS),
+        min_rest)
+
+
+def check_conflicts_columnar(model, min_rest=MIN_REST):
+    """Print any overlapping shifts, or shifts with less than *min_rest*
+        between them, in the columnar rota model"""
+    from rota_conflicts import find_conflicts, report_conflicts
+    report_conflicts(find_conflicts(model, min_rest))
+
+
+def check_spilled(spilled, directory, source='', min_rest=MIN_REST):
+    """Check the SpilledRota *spilled* a partition at a time for new names
+        and, unless *min_rest* is None, conflicts"""
+    from rota_conflicts import find_conflicts, report_conflicts
+    from rota_model import RotaModel
+    from rota_state import PartitionDigests
+    counts = {('All', 'All'): len(spilled.everything)}
+    digests = PartitionDigests(lambda record: record[:2], ('All', 'All'))
+    conflicts = []
+    try:
+        for nj_to_r_rows in spilled_partitions(spilled):
+            counts.update(count_rows(nj_to_r_rows))
+            records = list(shift_records(nj_to_r_rows))
+            digests.update(records)
+            if min_rest is not None:
+                model = RotaModel.from_records(records, HOURS)
+                conflicts.extend(find_conflicts(model, min_rest))
+        if min_rest is not None:
+            report_conflicts(sorted(conflicts,
+                                    key=lambda conflict: conflict.name))
+        check_last_names(counts, directory, digests.digests(), source)
+    finally:
+        digests.close()
+
+
+# Coverage functions
+def check_coverage(nj_to_r_rows):
+    """Print the days each role is not covered, or covered twice, in the
+        rota information returned by handle_rows"""
+    from rota_model import RotaModel
+    check_coverage_columnar(
+        RotaModel.from_records(shift_records(nj_to_r_rows), HOURS))
+
+
+def check_coverage_columnar(model):
+    """Print the days each role is not covered, or covered twice, in the
+        columnar rota model"""
+    from rota_coverage import coverage_of, report_coverage
+    report_coverage(coverage_of(model))
+
+
+# Working hours functions
+def report_hours(nj_to_r_rows, directory):
+    """Print a summary of the hours worked by each person in the rota
+        information returned by handle_rows and write their hours in each
+        week to working_hours.csv"""
+    from rota_model import RotaModel
+    model = RotaModel.from_records(shift_records(nj_to_r_rows), HOURS)
+    report_hours_columnar(model, directory)
+
+
+def report_hours_columnar(model, directory):
+    """Print a summary of the hours worked by each person in the columnar
+        rota model and write their hours in each week to working_hours.csv"""
     from os.path import join
+    from rota_hours import (working_hours, report_working_hours,
+                            write_working_hours)
+    working = working_hours(model)
+    report_working_hours(working)
+    write_working_hours(working, join(directory, 'working_hours.csv'))
+
+
+# Duplicate name functions
+def load_learned_corrections(directory):
+    """Add the spelling corrections learned in previous runs to
+        SPELLING_CORRECTIONS"""
+    from os.path import exists, join
+    from rota_state import StateStore, STATE_FILENAME
+    if exists(join(directory, STATE_FILENAME)):
+        with StateStore(directory) as store:
+            for misspelling, correction in store.corrections().items():
+                SPELLING_CORRECTIONS.setdefault(misspelling, correction)
+
+
+def check_duplicate_names(name_to_number_of_rows, directory, apply=False):
+    """Look for names in the same job that are probably misspellings of each
+        other and print them. If *apply* is True the suggested corrections
+        are added to SPELLING_CORRECTIONS and saved for later runs. Returns
+        the list of (misspelling, correction) suggestions"""
+    from name_helper import suggest_corrections
+    job_to_names = defaultdict(dict)
+    for (name, job), number in name_to_number_of_rows.items():
+        if job != 'All':
+            job_to_names[job][name] = number
+
+    suggestions = []
+    for job in job_to_names:
+        for misspelling, correction, similarity in \
+                suggest_corrections(job_to_names[job]):
+            print('Possible misspelling in rota: %s (%s) of %s (%.2f)' %
+                  (misspelling, job, correction, similarity))
+            suggestions.append((strip_unnecessary_information(misspelling),
+                                correction))
+
+    if apply and suggestions:
+        from rota_state import StateStore
+        with StateStore(directory) as store:
+            store.add_corrections(suggestions)
+        SPELLING_CORRECTIONS.update(suggestions)
+    return suggestions
+
+
+def report_changes_since(run, directory):
+    """Print what has changed in the rota since the given previous *run*"""
+    from rota_state import StateStore, report_changes
+    with StateStore(directory) as store:
+        report_changes(store.changes_since(run))
+
+
+# Writing functions
+def coalesce_key(event):
+    """Returns the role and name of *event* without the others on with them,
+        so that consecutive days of a role are merged by coalesce_calendar"""
+    return str(event['SUMMARY']).split(' with ')[0]
+
+
+def compact_text(event):
+    """Returns the summary and description of *event* in a compact calendar:
+        its role and name, and the others on with them"""
+    role_name, _, others = str(event['SUMMARY']).partition(' with ')
+    return role_name, others
+
+
+def write_calendar(name, job, cal, writer, rrule=False, coalesce=False,
+                   compact=False):
+    """Write the calendar *cal* of name in job with *writer*, with the whole
+        day shifts on consecutive days merged if *coalesce*, the repeating
+        events as recurring events if *rrule* and in the compact form if
+        *compact*, and return it. The events of a person are sorted by start
+        so that the calendar is the same however the rota was stored, while
+        the calendar of everyone keeps the order of the rota."""
+    from ical_coalesce import coalesce_calendar
+    from ical_compact import compact_calendar
+    from ical_helper import sort_events
+    from ical_rrule import compress_calendar
+    if job != 'All':
+        cal = sort_events(cal)
+    if coalesce:
+        cal = coalesce_calendar(cal, coalesce_key)
+    if rrule:
+        cal = compress_calendar(cal)
+    if compact:
+        cal = compact_calendar(cal, compact_text)
+    writer.write('rota_%s_%s.ics' % (job, name), cal.to_ical())
+    return cal
+
+
+def write_calendars(nj_to_r_rows, writer, deltas=None, dtstamp=None,
+                    rrule=False, coalesce=False, compact=False):
+    """Write the calendar of each name, job pair with *writer* using
+        write_calendar, and its delta calendars with the DeltaWriter
+        *deltas* if given"""
     for name, job in nj_to_r_rows:
         role_rows_pairs = nj_to_r_rows[(name, job)]
-        cal = create_calendar_for(name, job, role_rows_pairs)
-        with open(join(directory, 'rota_%s_%s.ics' % (job, name)), 'wb') as f:
-            f.write(cal.to_ical())
+        cal = create_calendar_for(name, job, role_rows_pairs, dtstamp)
+        cal = write_calendar(name, job, cal, writer, rrule, coalesce,
+                             compact)
+        if deltas is not None:
+            deltas.write('rota_%s_%s' % (job, name), cal)
+
+
+def create_calendars(nj_to_r_rows, directory, delta=False, dtstamp=None,
+                     output=None, rrule=False, coalesce=False,
+                     compact=False):
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        write_calendars(nj_to_r_rows, writer, deltas, dtstamp, rrule,
+                        coalesce, compact)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+def create_calendars_spilled(spilled, directory, delta=False, dtstamp=None,
+                             output=None, rrule=False, coalesce=False,
+                             compact=False):
+    """Write the calendars of the SpilledRota *spilled* a partition at a
+        time. The calendar of everyone is streamed from disk, unless a delta,
+        recurring, merged or compact events are wanted as they need all of
+        its events."""
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter, stream_calendar
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        everyone = [('All', spilled.everything)]
+        if delta or rrule or coalesce or compact:
+            write_calendars({('All', 'All'): everyone}, writer, deltas,
+                            dtstamp, rrule, coalesce, compact)
+        else:
+            events = (create_event_for(row[key], key, row, dtstamp)
+                      for row in spilled.everything
+                      for key in row if key != 'Date')
+            cal = create_calendar_for('All', 'All', [], dtstamp)
+            writer.write('rota_All_All.ics',
+                         b''.join(stream_calendar(cal, events)))
+        for nj_to_r_rows in spilled_partitions(spilled):
+            write_calendars(nj_to_r_rows, writer, deltas, dtstamp, rrule,
+                            coalesce, compact)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+def distinct_rows(model, indices=None):
+    """Returns the distinct rows of the shifts at *indices* in the model"""
+    rows = OrderedDict()
+    for shift in model.shifts(indices):
+        rows[id(shift.source)] = shift.source
+    return list(rows.values())
+
+
+def columnar_calendars(model, dtstamp=None):
+    """Yields the (name, job, calendar) of everyone in the columnar rota
+        model, creating the events of each person from its arrays"""
+    # The calendar of everyone shows the cells of the rota as they are
+    # written, which only the rows have
+    yield ('All', 'All',
+           create_calendar_for('All', 'All', [('All', distinct_rows(model))],
+                               dtstamp))
+    starts = model.starts.tolist()
+    ends = model.ends.tolist()
+    role_codes = model.role_codes.tolist()
+    for (name, job), indices in model.group_by('name', 'job'):
+        cal = create_calendar_for(name, job, [], dtstamp)
+        for i in indices.tolist():
+            role = model.roles[role_codes[i]]
+            cal.add_component(
+                create_shift_event(name, role, starts[i], ends[i],
+                                   others_on(model.sources[i], role),
+                                   dtstamp))
+        yield name, job, cal
+    for name, job in model.empty:
+        yield name, job, create_calendar_for(name, job, [], dtstamp)
+
+
+def create_calendars_columnar(model, directory, delta=False, dtstamp=None,
+                              output=None, rrule=False, coalesce=False,
+                              compact=False):
+    """Write the calendars using slices of the columnar rota model"""
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        for name, job, cal in columnar_calendars(model, dtstamp):
+            cal = write_calendar(name, job, cal, writer, rrule, coalesce,
+                                 compact)
+            if deltas is not None:
+                deltas.write('rota_%s_%s' % (job, name), cal)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+# Export functions
+def export_rows(nj_to_r_rows, fname):
+    """Export the shifts in the rota information returned by handle_rows
+        to the SQLite database or JSON Lines file *fname*"""
+    from rota_model import RotaModel
+    export_rows_columnar(
+        RotaModel.from_records(shift_records(nj_to_r_rows), HOURS), fname)
+
+
+def export_rows_columnar(model, fname):
+    """Export the shifts in the columnar rota model to the SQLite database or
+        JSON Lines file *fname*"""
+    from rota_export import export_shifts
+    number = export_shifts(model, fname, ROTA, TZ)
+    print('Exported %d shifts to %s' % (number, fname))
 
 
 # Main function
-def parse_file_and_create_calendars(fname, sheet, directory):
+def parse_file_and_create_calendars(fname, sheet, directory, columnar=False,
+                                    changes_since=None, delta=False,
+                                    output=None, cache=False,
+                                    fuzzy_names=None, min_rest=MIN_REST,
+                                    hours=False, coverage=False,
+                                    export=None, spill=False, rrule=False,
+                                    coalesce=False, window=None,
+                                    compact=False):
     from os.path import exists
-    rows_data = read(fname, handle_rows, sheet)
-
+    from ical_helper import source_timestamp
+    if spill and (columnar or cache or fuzzy_names or hours or coverage or
+                  export):
+        raise ValueError('Spilling only supports the calendars and the new '
+                         'name and conflict checks')
+    dtstamp = source_timestamp(fname)
     if not exists(directory):
         from os import makedirs
         makedirs(directory)
-    check_last_names(rows_data, directory)
-    create_calendars(rows_data, directory)
+    load_learned_corrections(directory)
+    # The rows outside the window are skipped as they are read, so everyone
+    # with a calendar from the last run keeps it
+    where = date_where(window)
+    kept = published_names(directory) if window is not None else []
+    if spill:
+        with read_spilled(fname, sheet, kept, where) as spilled:
+            check_spilled(spilled, directory, fname, min_rest)
+            create_calendars_spilled(spilled, directory, delta, dtstamp,
+                                     output, rrule, coalesce, compact)
+        if changes_since is not None:
+            report_changes_since(changes_since, directory)
+        return
+    reader = read if isinstance(sheet, int) else read_sheets
+    if cache:
+        from rota_cache import RotaCache, source_fingerprint
+        rota_cache = RotaCache(directory, fname, sheet, reader,
+                               (source_fingerprint(__file__),
+                                sorted(SPELLING_CORRECTIONS.items()),
+                                columnar, changes_since, delta, output,
+                                fuzzy_names, min_rest, hours, coverage,
+                                export, rrule, coalesce, window,
+                                compact))
+        if rota_cache.unchanged():
+            print('Rota, configuration and calendars unchanged')
+            return
+        read_rows = rota_cache.read
+    else:
+        read_rows = reader
+    handler = handle_rows_columnar if columnar else handle_rows
+    count = count_rows_columnar if columnar else count_rows
+    rows_data = read_rows(fname, handler, sheet, kept, where=where)
+
+    if fuzzy_names is not None:
+        apply = fuzzy_names == 'apply'
+        if check_duplicate_names(count(rows_data), directory, apply) and \
+                apply:
+            # Read the rows again with the new spelling corrections
+            rows_data = read_rows(fname, handler, sheet, kept,
+                                  where=where)
+
+    if min_rest is not None:
+        check = check_conflicts_columnar if columnar else check_conflicts
+        check(rows_data, min_rest)
+
+    if coverage:
+        check = check_coverage_columnar if columnar else check_coverage
+        check(rows_data)
+
+    if columnar:
+        check_last_names(count_rows_columnar(rows_data), directory,
+                         digest_rows_columnar(rows_data), fname)
+        create_calendars_columnar(rows_data, directory, delta, dtstamp,
+                                  output, rrule, coalesce, compact)
+    else:
+        check_last_names(count_rows(rows_data), directory,
+                         digest_rows(rows_data), fname)
+        create_calendars(rows_data, directory, delta, dtstamp, output,
+                         rrule, coalesce, compact)
+    if hours:
+        report = report_hours_columnar if columnar else report_hours
+        report(rows_data, directory)
+    if export is not None:
+        export_to = export_rows_columnar if columnar else export_rows
+        export_to(rows_data, export)
+    if changes_since is not None:
+        report_changes_since(changes_since, directory)
+    if cache:
+        rota_cache.save()
 
 
 # ___________________________________ MAIN ___________________________________
 if __name__ == '__main__':
     from argparse import ArgumentParser
+    from xlrd_helper import sheet_spec
+    from rota_window import window_spec
     parser = ArgumentParser(description='Multi Rota reader')
 
     parser.add_argument('filename',
@@ -332,10 +946,118 @@ if __name__ == '__main__':
 
     parser.add_argument('--sheet',
                         nargs='?',
-                        type=int,
-                        help='excel spreadsheet id',
+                        type=sheet_spec,
+                        help='excel spreadsheet id, a list or range of ids '
+                             'such as 0,2-4 or all',
                         default=0)
 
+    parser.add_argument('--columnar',
+                        action='store_true',
+                        help='use the columnar rota model')
+
+    parser.add_argument('--changes-since',
+                        type=int,
+                        help='report the changes since this previous run',
+                        default=None)
+
+    parser.add_argument('--delta',
+                        action='store_true',
+                        help='also write calendars of the changed events')
+
+    parser.add_argument('--archive',
+                        help='write the calendars into this zip or tar file',
+                        default=None)
+
+    parser.add_argument('--gzip',
+                        choices=['also', 'only'],
+                        help='also or only write gzip compressed calendars',
+                        default=None)
+
+    parser.add_argument('--gzip-level',
+                        type=int,
+                        help='gzip compression level',
+                        default=9)
+
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='cache the parsed rota and skip unchanged runs')
+
+    parser.add_argument('--fuzzy-names',
+                        choices=['suggest', 'apply'],
+                        help='suggest or apply corrections for similar names',
+                        default=None)
+
+    parser.add_argument('--min-rest',
+                        type=float,
+                        help='report rests between shifts shorter than this '
+                             'many hours',
+                        default=11)
+
+    parser.add_argument('--no-conflicts',
+                        action='store_true',
+                        help='do not check for overlapping shifts')
+
+    parser.add_argument('--hours',
+                        action='store_true',
+                        help='report the hours worked by each person')
+
+    parser.add_argument('--coverage',
+                        action='store_true',
+                        help='report the days a role is not covered or '
+                             'covered twice')
+
+    parser.add_argument('--export',
+                        help='export the shifts to this SQLite database or '
+                             '.jsonl file',
+                        default=None)
+
+    parser.add_argument('--spill',
+                        action='store_true',
+                        help='group the rows in temporary files rather than '
+                             'in memory')
+
+    parser.add_argument('--rrule',
+                        action='store_true',
+                        help='write repeating shifts as recurring events')
+
+    parser.add_argument('--coalesce',
+                        action='store_true',
+                        help='merge whole day shifts on consecutive days '
+                             'into one event')
+
+    parser.add_argument('--window',
+                        type=window_spec,
+                        help='only the shifts from START up to END - dates, '
+                             'today or offsets from today such as '
+                             '--window=-30d:+12m',
+                        metavar='START:END',
+                        default=None)
+
+    parser.add_argument('--compact',
+                        action='store_true',
+                        help='write smaller calendars without the repeated '
+                             'text and properties')
+
     args = parser.parse_args()
 
-    parse_file_and_create_calendars(args.filename, args.sheet, args.directory)
+    parse_file_and_create_calendars(args.filename,
+                                    args.sheet,
+                                    args.directory,
+                                    args.columnar,
+                                    args.changes_since,
+                                    args.delta,
+                                    {'archive': args.archive,
+                                     'gzip': args.gzip,
+                                     'compresslevel': args.gzip_level},
+                                    args.cache,
+                                    args.fuzzy_names,
+                                    None if args.no_conflicts
+                                    else timedelta(hours=args.min_rest),
+                                    args.hours,
+                                    args.coverage,
+                                    args.export,
+                                    args.spill,
+                                    args.rrule,
+                                    args.coalesce,
+                                    args.window,
+                                    args.compact)
@@ -0,0 +1,142 @@
+"""Functions to help find names in a rota that are probably the same person.
+
+
+This file provides the TrigramIndex class, an inverted index of the three
+letter substrings of names, which finds the candidate names similar to a
+given name without comparing it to every other name. The candidates are then
+checked with an edit distance that counts swapped letters as one edit.
+suggest_corrections uses these to suggest spelling corrections for
+near-duplicate names - the name with fewer rows being taken as the
+misspelling.
+
+A short usage example::
+
+>>> import name_helper
+>>> name_helper.suggest_corrections({'William': 7, 'Wiliam': 1, 'Tim': 7})
+[('Wiliam', 'William', 0.86)]
+"""
+import re
+from collections import defaultdict
+
+THRESHOLD = 0.75
+CANDIDATE_THRESHOLD = 0.3
+
+DIGITS_RE = re.compile(r'\d+')
+SPACES_RE = re.compile(r'\s+')
+
+
+def trigrams(name):
+    """Returns the set of three letter substrings of the padded name"""
+    padded = '  %s ' % SPACES_RE.sub(' ', name.lower().strip())
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b):
+    """Returns the number of insertions, deletions, substitutions and swaps
+        of adjacent letters needed to turn *a* into *b*"""
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1,
+                             current[j - 1] + 1,
+                             previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and \
+                    a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+
+def name_similarity(a, b):
+    """Returns the similarity of two names between 0 and 1 from their edit
+        distance, ignoring case and repeated spaces"""
+    a = SPACES_RE.sub(' ', a.lower().strip())
+    b = SPACES_RE.sub(' ', b.lower().strip())
+    longest = max(len(a), len(b))
+    if longest == 0:
+        return 1.0
+    return 1.0 - edit_distance(a, b) / longest
+
+
+class TrigramIndex:
+    """Provides an index of names by their trigrams. The similarity of two
+        names is the Dice coefficient of their sets of trigrams, between 0
+        (nothing in common) and 1 (the same)."""
+
+    def __init__(self, names=()):
+        self.index = defaultdict(set)
+        self.grams = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """Add *name* to the index"""
+        grams = trigrams(name)
+        self.grams[name] = grams
+        for gram in grams:
+            self.index[gram].add(name)
+
+    def similar(self, name, threshold=CANDIDATE_THRESHOLD):
+        """Returns a list of (other name, similarity) for the names in the
+            index at least *threshold* similar to *name*, most similar
+            first"""
+        grams = self.grams.get(name) or trigrams(name)
+        shared = defaultdict(int)
+        for gram in grams:
+            for other in self.index.get(gram, ()):
+                shared[other] += 1
+
+        results = []
+        for other, number in shared.items():
+            if other == name:
+                continue
+            score = 2.0 * number / (len(grams) + len(self.grams[other]))
+            if score >= threshold:
+                results.append((other, score))
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results
+
+
+def find_duplicates(names, threshold=THRESHOLD):
+    """Returns a list of (name, other, similarity) for each pair of names at
+        least *threshold* similar. Names which differ in their numbers, such
+        as SPR1 and SPR2, are not considered duplicates."""
+    index = TrigramIndex(names)
+    pairs = []
+    for name in index.grams:
+        for other, _ in index.similar(name):
+            if name < other and \
+                    DIGITS_RE.findall(name) == DIGITS_RE.findall(other):
+                score = name_similarity(name, other)
+                if score >= threshold:
+                    pairs.append((name, other, score))
+    return pairs
+
+
+def suggest_corrections(name_to_number, threshold=THRESHOLD):
+    """Given a dictionary of names to number of rows returns a list of
+        (misspelling, correction, similarity) for each near-duplicate name.
+        The name with more rows (or first alphabetically) is the
+        correction."""
+    corrections = {}
+    for name, other, score in find_duplicates(name_to_number, threshold):
+        if (name_to_number[other], name) > (name_to_number[name], other):
+            name, other = other, name
+        # name is now the correction for other
+        if other not in corrections or corrections[other][1] < score:
+            corrections[other] = (name, score)
+
+    # Follow chains so that every misspelling maps to a final correction
+    suggestions = []
+    for misspelling in sorted(corrections):
+        correction, score = corrections[misspelling]
+        seen = {misspelling}
+        while correction in corrections and correction not in seen:
+            seen.add(correction)
+            correction = corrections[correction][0]
+        if correction != misspelling:
+            suggestions.append((misspelling, correction, round(score, 2)))
+    return suggestions
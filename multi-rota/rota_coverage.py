@@ -0,0 +1,143 @@
+"""Functions to find the gaps in the cover of each role in a rota.
+
+
+This file provides the Coverage class which keeps, for every role, a bitset
+of the half days (two bits per day - morning and afternoon) that somebody is
+rostered for and a bitset of those that more than one person is rostered
+for. Whole day roles set both bits of a day and AM/PM split roles, such as
+'SHO (AM)', set one bit of their role. The uncovered half days of a role are
+then its bitset inverted, which stays fast however many years of rota there
+are.
+
+A short usage example::
+
+>>> import rota_coverage
+>>> coverage = rota_coverage.coverage_of(model)
+>>> rota_coverage.report_coverage(coverage)
+Uncovered: SHO on 2018-02-11 (PM)
+Double covered: SpR on 2018-02-14 by Jane, Peter
+"""
+import re
+from collections import defaultdict
+import numpy as np
+
+AM = 1
+PM = 2
+BOTH = AM | PM
+
+HALVES = {AM: 'AM', PM: 'PM'}
+HALF_DAY_RE = re.compile(r'^(.*) \((AM|PM)\)$')
+DAY = np.timedelta64(1, 'D')
+
+
+def base_role(role):
+    """Returns the role without any (AM) or (PM) and the halves of the day it
+        covers"""
+    match = HALF_DAY_RE.match(role)
+    if match is None:
+        return role, BOTH
+    return match.group(1), AM if match.group(2) == 'AM' else PM
+
+
+def _bitset(slots):
+    """Returns the boolean array *slots* as an int with bit i set for each
+        True slot i"""
+    packed = np.packbits(slots, bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+
+def _slots(bitset, length):
+    """Returns the indices of the set bits of *bitset* below *length*"""
+    packed = np.frombuffer(bitset.to_bytes((length + 7) // 8, 'little'),
+                           dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder='little')[:length])
+
+
+class Coverage:
+    """Provides the cover of each of the *roles* in the half days from
+        *first* to *last* (datetime64[D]) as the bitsets *covered* and
+        *double* keyed by role, with bit 2 * i for the morning and bit
+        2 * i + 1 for the afternoon of day i. *who* maps a (role, day index)
+        to the names rostered."""
+
+    def __init__(self, first, last, covered, double, who):
+        self.first = first
+        self.last = last
+        self.length = 2 * int((last - first) // DAY + 1)
+        self.covered = covered
+        self.double = double
+        self.who = who
+
+    @property
+    def everything(self):
+        """The bitset with every half day set"""
+        return (1 << self.length) - 1
+
+    def uncovered(self, role):
+        """Returns the bitset of half days nobody is rostered for *role*"""
+        return self.everything & ~self.covered[role]
+
+    def half_days(self, bitset):
+        """Returns a list of (day, halves) for the days with a bit set in
+            *bitset*, with halves AM, PM or BOTH"""
+        days = defaultdict(int)
+        for slot in _slots(bitset, self.length):
+            days[int(slot) // 2] |= AM if slot % 2 == 0 else PM
+        return [(i, halves) for i, halves in sorted(days.items())]
+
+    def day(self, i):
+        """Returns day *i* of the coverage as a date"""
+        return (self.first + i * DAY).astype(object)
+
+
+def coverage_of(model, roles=None):
+    """Returns the Coverage of the shifts in the RotaModel *model* for its
+        roles (or the given base *roles*) between its first and last day.
+        Shifts with no name, from blank cells, cover nothing."""
+    if roles is None:
+        roles = sorted({base_role(role)[0] for role in model.roles})
+    if len(model) == 0:
+        first = last = np.datetime64('today', 'D')
+    else:
+        first, last = model.days.min(), model.days.max()
+    number_of_days = int((last - first) // DAY + 1)
+
+    counts = {role: np.zeros(2 * number_of_days, dtype=np.int32)
+              for role in roles}
+    who = defaultdict(list)
+    named = np.array([name != '' for name in model.names], dtype=bool)
+    day_index = ((model.days - first) // DAY).astype(np.int64)
+    for code, role in enumerate(model.roles):
+        role, halves = base_role(role)
+        if role not in counts:
+            continue
+        selected = np.flatnonzero((model.role_codes == code) &
+                                  named[model.name_codes])
+        for half, offset in ((AM, 0), (PM, 1)):
+            if halves & half:
+                np.add.at(counts[role], 2 * day_index[selected] + offset, 1)
+        for i in selected:
+            who[(role, int(day_index[i]))].append(
+                model.names[model.name_codes[i]])
+
+    covered = {role: _bitset(counts[role] > 0) for role in roles}
+    double = {role: _bitset(counts[role] > 1) for role in roles}
+    return Coverage(first, last, covered, double, who)
+
+
+def _describe(coverage, role, i, halves):
+    day = coverage.day(i).isoformat()
+    if halves == BOTH:
+        return '%s on %s' % (role, day)
+    return '%s on %s (%s)' % (role, day, HALVES[halves])
+
+
+def report_coverage(coverage):
+    """Print the uncovered and double covered half days of each role"""
+    for role in sorted(coverage.covered):
+        for i, halves in coverage.half_days(coverage.uncovered(role)):
+            print('Uncovered: %s' % _describe(coverage, role, i, halves))
+        for i, halves in coverage.half_days(coverage.double[role]):
+            print('Double covered: %s by %s' %
+                  (_describe(coverage, role, i, halves),
+                   ', '.join(sorted(set(coverage.who[(role, i)])))))
@@ -0,0 +1,240 @@
+"""Merge the shifts of people who appear in more than one rota.
+
+
+This file provides merge_shifts which combines several streams of shifts,
+each already sorted by start, into one sorted stream with heapq.merge -
+dropping identical shifts that appear in more than one rota - and
+create_merged_calendars which writes one calendar per person containing
+their shifts from every rota. Only one person's shifts are held at a time.
+
+It can also be run as a script, given pairs of converter and rota file::
+
+    python3 rota_merge.py generated/merged \\
+        ../multi-rota/multi_rota3.py:../multi-rota/multi_rota3.xls \\
+        ../unusual-rotas/unusual1.py:../unusual-rotas/unusual1.xlsx
+
+A short usage example::
+
+>>> import rota_merge
+>>> rotas = [rota_merge.Rota.load('multi_rota3.py', 'multi_rota3.xls')]
+>>> with CalendarWriter('generated/merged') as writer:
+...     rota_merge.create_merged_calendars(rotas, writer)
+"""
+import csv
+import heapq
+import importlib.util
+import itertools
+import os
+import sys
+from contextlib import contextmanager
+from datetime import timedelta
+from os.path import abspath, basename, dirname, join, splitext
+import numpy as np
+from icalendar import Event
+
+from ical_helper import event_uid, new_calendar
+
+
+def canonical_name(name, aliases=None):
+    """Returns the name used to match a person across rotas - ignoring case
+        and spacing, after looking up any *aliases*"""
+    canonical = ' '.join(name.split()).casefold()
+    if aliases and canonical in aliases:
+        return aliases[canonical]
+    return canonical
+
+
+def read_aliases(fname):
+    """Reads a csv file of alias, name pairs, e.g. SPR1, James, into a
+        dictionary of canonical names"""
+    with open(fname, newline='') as f:
+        return {canonical_name(alias): canonical_name(name)
+                for alias, name in csv.reader(f)}
+
+
+# Numbers the converters loaded, to give each module a unique name
+_LOADED = itertools.count()
+
+
+class _HelperFinder:
+    """Finds the helper modules *names*, imported by their bare names such
+        as ical_helper, in the converter's *directory*"""
+
+    def __init__(self, directory, names):
+        self.directory = directory
+        self.names = names
+
+    def find_spec(self, fullname, path=None, target=None):
+        if path is not None or fullname not in self.names:
+            return None
+        return importlib.util.spec_from_file_location(
+            fullname, join(self.directory, fullname + '.py'))
+
+
+@contextmanager
+def _helpers_of(directory, helpers):
+    """Within the block the helper modules imported by bare name - which
+        every converter directory has its own copies of - are those in
+        *directory*, kept in the dictionary *helpers* between blocks. The
+        modules imported before are put back afterwards."""
+    names = {splitext(name)[0] for name in os.listdir(directory)
+             if name.endswith('.py')}
+    saved = {name: sys.modules.pop(name) for name in names
+             if name in sys.modules}
+    sys.modules.update(helpers)
+    finder = _HelperFinder(directory, names)
+    sys.meta_path.insert(0, finder)
+    try:
+        yield
+    finally:
+        sys.meta_path.remove(finder)
+        for name in names:
+            if name in sys.modules:
+                helpers[name] = sys.modules.pop(name)
+        sys.modules.update(saved)
+
+
+class Rota:
+    """Provides the shifts of one rota - the RotaModel *model* read by a
+        converter with its *name*, used in event UIDs, and timezone *tz*"""
+
+    def __init__(self, name, model, tz):
+        self.name = name
+        self.model = model
+        self.tz = tz
+
+    @classmethod
+    def load(cls, converter, fname, sheet=0):
+        """Load the rota *fname* with the converter script *converter*, for
+            example multi_rota3.py. The converter is loaded under a unique
+            name and imports the helper modules of its own directory."""
+        directory = dirname(abspath(converter))
+        module_name = '_rota_merge_%d_%s' % (
+            next(_LOADED), splitext(basename(converter))[0])
+        spec = importlib.util.spec_from_file_location(module_name, converter)
+        module = importlib.util.module_from_spec(spec)
+        # Registered so that its functions can be pickled for the readers
+        sys.modules[module_name] = module
+        helpers = {}
+        with _helpers_of(directory, helpers):
+            spec.loader.exec_module(module)
+            index = module.load_index(fname, sheet)
+        return cls(module.ROTA, index.model, module.TZ)
+
+    def people(self, aliases=None):
+        """Returns a dictionary of canonical name to the indices of their
+            shifts, sorted by start"""
+        people = {}
+        for (name,), indices in self.model.group_by('name'):
+            person = canonical_name(name, aliases)
+            if person in people:
+                # Two spellings of the same person in this rota
+                indices = np.concatenate((people[person], indices))
+                indices = indices[np.argsort(self.model.starts[indices],
+                                             kind='stable')]
+            people[person] = indices
+        return people
+
+    def stream(self, indices):
+        """Yields a (start, end, role, rota, shift) tuple for each of the
+            shifts at *indices*, which are sorted by start"""
+        for shift in self.model.shifts(indices):
+            yield (shift.start, shift.end, shift.role, self, shift)
+
+
+def merge_shifts(streams):
+    """Merge the *streams* of (start, end, role, rota, shift) tuples, each
+        sorted by start, into one sorted stream. A shift with the same start,
+        end and role as one already seen is dropped."""
+    seen_start = None
+    seen = set()
+    merged = heapq.merge(*streams, key=lambda item: item[:3])
+    for start, end, role, rota, shift in merged:
+        if start != seen_start:
+            # Earlier starts cannot appear again so forget them
+            seen_start = start
+            seen.clear()
+        if (end, role) in seen:
+            continue
+        seen.add((end, role))
+        yield rota, shift
+
+
+def create_merged_event_for(rota, shift, dtstamp):
+    """Create an icalendar event for the *shift* from *rota*. The UID is the
+        one the rota's converter gives the same shift."""
+    event = Event()
+    description = '%s: %s (%s)' % (shift.role, shift.name, rota.name)
+    event.add('description', description)
+    event.add('summary', description)
+    if shift.allday:
+        event.add('dtstart', shift.day)
+        event.add('dtend', shift.day +
+                  timedelta(days=max(1, (shift.end - shift.start).days)))
+    else:
+        event.add('dtstart', rota.tz.localize(shift.start))
+        event.add('dtend', rota.tz.localize(shift.end))
+    event.add('dtstamp', dtstamp)
+    event.add('location', 'At work')
+    event.add('uid', event_uid(rota.name, shift.name, shift.role, shift.day))
+    return event
+
+
+def create_merged_calendars(rotas, writer, aliases=None, dtstamp=None):
+    """Write a calendar for each person in any of the *rotas* with their
+        shifts from all of them, using the CalendarWriter *writer*. People
+        are matched by their canonical_name."""
+    from datetime import datetime
+    dtstamp = dtstamp or datetime.now()
+    people = [rota.people(aliases) for rota in rotas]
+    for person in sorted(set().union(*people)):
+        streams = [rota.stream(people_in_rota[person])
+                   for rota, people_in_rota in zip(rotas, people)
+                   if person in people_in_rota]
+        names = {}
+        events = []
+        for rota, shift in merge_shifts(streams):
+            names.setdefault(shift.name)
+            events.append(create_merged_event_for(rota, shift, dtstamp))
+        cal = new_calendar('Merged rota for %s' % ' / '.join(names))
+        for event in events:
+            cal.add_component(event)
+        writer.write('person_%s.ics' % person.replace(' ', '_'),
+                     cal.to_ical())
+
+
+# __________________________________ MAIN ____________________________________
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    from os import makedirs
+    from ical_helper import source_timestamp
+    from output_helper import CalendarWriter
+    parser = ArgumentParser(description='Merge the shifts of several rotas')
+
+    parser.add_argument('directory',
+                        help='output directory')
+
+    parser.add_argument('rotas',
+                        nargs='+',
+                        metavar='converter:filename',
+                        help='a converter script and its rota filename')
+
+    parser.add_argument('--aliases',
+                        help='csv file of alias, name pairs',
+                        default=None)
+
+    args = parser.parse_args()
+
+    aliases = read_aliases(args.aliases) if args.aliases else None
+    rotas = []
+    dtstamp = None
+    for spec in args.rotas:
+        converter, fname = spec.split(':', 1)
+        rotas.append(Rota.load(converter, fname))
+        dtstamp = max(dtstamp or source_timestamp(fname),
+                      source_timestamp(fname))
+
+    makedirs(args.directory, exist_ok=True)
+    with CalendarWriter(args.directory) as writer:
+        create_merged_calendars(rotas, writer, aliases, dtstamp)
+    print(writer.report())
@@ -0,0 +1,237 @@
+"""A columnar in-memory model of a rota.
+
+
+This file provides the RotaModel class which stores every shift of a rota as
+one entry in a set of numpy arrays, rather than as lists of rows grouped in
+dictionaries. Names, jobs and roles are stored as integer codes into a list
+of categories, days as datetime64[D] and the start and end of each shift are
+computed for all shifts at once from a compiled HOURS table.
+
+A short usage example::
+
+>>> import rota_model
+>>> records = [('James', 'SHO', 'SHO', date(2018, 1, 1), row), ...]
+>>> model = rota_model.RotaModel.from_records(records, HOURS)
+>>> for (name, job), indices in model.group_by('name', 'job'):
+...     print(name, job, len(indices))
+James SHO 12
+"""
+import numpy as np
+from collections import namedtuple
+
+MINUTE = np.timedelta64(1, 'm')
+DAY = np.timedelta64(1, 'D')
+
+FIELDS = ('name', 'job', 'role')
+
+Shift = namedtuple('Shift',
+                   ['name', 'job', 'role', 'day', 'start', 'end', 'allday',
+                    'source'])
+
+
+def _minutes(value):
+    """Returns the number of minutes in a time or timedelta"""
+    if hasattr(value, 'total_seconds'):
+        return int(value.total_seconds() // 60)
+    return value.hour * 60 + value.minute
+
+
+def compile_hours(hours, roles):
+    """Compiles the *hours* dictionary into arrays indexed by role code for
+        the given list of *roles*. Returns a tuple of the offset of the start
+        from midnight, the length of the shift and whether it is a whole day
+        shift.
+
+        Each role in *hours* must have either a 'start' and 'end', a 'start'
+        and 'duration' or simply a 'duration' for whole day shifts. If the end
+        is not after the start the shift finishes on the following day."""
+    offsets = np.zeros(len(roles), dtype='timedelta64[m]')
+    lengths = np.zeros(len(roles), dtype='timedelta64[m]')
+    allday = np.zeros(len(roles), dtype=bool)
+    for code, role in enumerate(roles):
+        spec = hours[role]
+        if 'start' not in spec:
+            allday[code] = True
+            lengths[code] = _minutes(spec['duration'])
+            continue
+        start = _minutes(spec['start'])
+        if 'duration' in spec:
+            length = _minutes(spec['duration'])
+        else:
+            length = _minutes(spec['end']) - start
+            if length <= 0:
+                # OK so the end is before the start? It's the next day
+                length += 24 * 60
+        offsets[code] = start
+        lengths[code] = length
+    return offsets, lengths, allday
+
+
+def _categorise(values):
+    """Returns the sorted list of distinct values and the integer codes of
+        the values into that list"""
+    categories, codes = np.unique(np.array(values, dtype=object),
+                                  return_inverse=True)
+    return list(categories), codes.reshape(-1).astype(np.int32)
+
+
+class RotaModel:
+    """Provides a columnar model of the shifts in a rota. Each shift *i* has
+        a name, job and role code, a day, a start and end (local wall clock
+        times as datetime64[m]), a whole day flag and the source it was
+        created from - normally the row of the rota. The (name, job) pairs
+        of anyone in the rota with no shifts, who still have a calendar, are
+        kept in *empty*.
+
+        Use :meth:`from_records` to build a model from (name, job, role, day,
+        source) tuples, :meth:`from_columns` to build it from a sequence of
+        each and :meth:`group_by` to get the shifts for each person
+        as slices of the arrays."""
+
+    def __init__(self, names, jobs, roles, name_codes, job_codes, role_codes,
+                 days, starts, ends, allday, sources, empty=()):
+        self.names = names
+        self.jobs = jobs
+        self.roles = roles
+        self.name_codes = name_codes
+        self.job_codes = job_codes
+        self.role_codes = role_codes
+        self.days = days
+        self.starts = starts
+        self.ends = ends
+        self.allday = allday
+        self.sources = sources
+        self.empty = list(empty)
+
+    @classmethod
+    def from_records(cls, records, hours, empty=()):
+        """Build a model from an iterable of (name, job, role, day, source)
+            tuples, computing the start and end of each shift from *hours*.
+            The (name, job) pairs in *empty* with no shifts are kept."""
+        columns = list(zip(*records)) or [(), (), (), (), ()]
+        return cls.from_columns(*columns, hours, empty=empty)
+
+    @classmethod
+    def from_columns(cls, names, jobs, roles, days, sources, hours,
+                     empty=()):
+        """Build a model from the sequences of the *names*, *jobs*, *roles*,
+            *days* and *sources* of the shifts, computing the start and end
+            of each shift from *hours*. The (name, job) pairs in *empty* with
+            no shifts are kept."""
+        names, name_codes = _categorise(names)
+        jobs, job_codes = _categorise(jobs)
+        roles, role_codes = _categorise(roles)
+        days = np.asarray(days, dtype='datetime64[D]')
+        sources, values = np.empty(len(days), dtype=object), sources
+        sources[:] = values
+
+        offsets, lengths, allday = compile_hours(hours, roles)
+        starts = days.astype('datetime64[m]') + offsets[role_codes]
+        ends = starts + lengths[role_codes]
+        model = cls(names, jobs, roles, name_codes, job_codes, role_codes,
+                    days, starts, ends, allday[role_codes], sources)
+        model.empty = model._without_shifts(empty)
+        return model
+
+    def __len__(self):
+        return len(self.days)
+
+    def _codes(self, field):
+        return getattr(self, field + '_codes')
+
+    def _categories(self, field):
+        return getattr(self, field + 's')
+
+    def _without_shifts(self, pairs):
+        """Returns the distinct (name, job) *pairs* with no shifts"""
+        names = np.array(self.names, dtype=object)[self.name_codes]
+        jobs = np.array(self.jobs, dtype=object)[self.job_codes]
+        working = set(zip(names.tolist(), jobs.tolist()))
+        return [pair for pair in dict.fromkeys(pairs) if pair not in working]
+
+    def take(self, indices):
+        """Returns a new model of the shifts at *indices* (or a boolean mask)
+            sharing the categories of this model"""
+        return RotaModel(self.names, self.jobs, self.roles,
+                         self.name_codes[indices],
+                         self.job_codes[indices],
+                         self.role_codes[indices],
+                         self.days[indices],
+                         self.starts[indices],
+                         self.ends[indices],
+                         self.allday[indices],
+                         self.sources[indices],
+                         self.empty)
+
+    @classmethod
+    def concatenate(cls, models):
+        """Returns a model of the shifts of each of *models* in turn - e.g.
+            those read from each sheet of a workbook - combining their
+            categories"""
+        categories = []
+        codes = []
+        for field in FIELDS:
+            values = [np.array(model._categories(field),
+                               dtype=object)[model._codes(field)]
+                      for model in models]
+            values = np.concatenate(values) if values else []
+            field_categories, field_codes = _categorise(values)
+            categories.append(field_categories)
+            codes.append(field_codes)
+
+        def column(name, dtype):
+            if not models:
+                return np.array([], dtype=dtype)
+            return np.concatenate([getattr(model, name) for model in models])
+
+        model = cls(*categories, *codes,
+                    column('days', 'datetime64[D]'),
+                    column('starts', 'datetime64[m]'),
+                    column('ends', 'datetime64[m]'),
+                    column('allday', bool),
+                    column('sources', object))
+        model.empty = model._without_shifts(
+            pair for part in models for pair in part.empty)
+        return model
+
+    def group_by(self, *fields):
+        """Yields a (key, indices) pair for each distinct combination of the
+            given *fields* ('name', 'job' or 'role'). The key is a tuple of
+            the field values and the indices are sorted by start time. With no
+            fields a single group of every shift is returned."""
+        key = np.zeros(len(self), dtype=np.int64)
+        for field in fields:
+            key = key * len(self._categories(field)) + self._codes(field)
+        order = np.lexsort((self.starts, key))
+        _, first, counts = np.unique(key[order],
+                                     return_index=True,
+                                     return_counts=True)
+        for f, c in zip(first, counts):
+            indices = order[f:f + c]
+            i = indices[0]
+            yield (tuple(self._categories(field)[self._codes(field)[i]]
+                         for field in fields),
+                   indices)
+
+    def counts(self, *fields):
+        """Returns a dictionary of the key for *fields* to number of shifts"""
+        return {key: len(indices)
+                for key, indices in self.group_by(*fields)}
+
+    def shift(self, i):
+        """Returns shift *i* as a Shift of plain python values"""
+        return Shift(self.names[self.name_codes[i]],
+                     self.jobs[self.job_codes[i]],
+                     self.roles[self.role_codes[i]],
+                     self.days[i].astype(object),
+                     self.starts[i].astype(object),
+                     self.ends[i].astype(object),
+                     bool(self.allday[i]),
+                     self.sources[i])
+
+    def shifts(self, indices=None):
+        """Iterates through the shifts at *indices* (default all) as Shifts"""
+        if indices is None:
+            indices = range(len(self))
+        for i in indices:
+            yield self.shift(i)
@@ -0,0 +1,127 @@
+"""Group the rows of a rota on disk rather than in memory.
+
+
+This file provides the SpilledRota class which a converter's handler fills as
+it reads the rows of a rota: every row is appended to a temporary file, for
+the calendar of everyone, and each (key, row) pair is appended to one of a
+number of temporary files chosen by a hash of the person, for their own
+calendars. Each partition is then loaded and turned into calendars in turn,
+so only one partition is ever held in memory however long the rota's
+history is.
+
+A short usage example::
+
+>>> import rota_spill
+>>> with rota_spill.SpilledRota() as spilled:
+...     for row in rows:
+...         spilled.everything.append(row)
+...         spilled.groups.append((row['On-Call'], 'On-Call'), row,
+...                               row['On-Call'])
+...     for groups in spilled.groups.partitions():
+...         print(list(groups))
+[('James', 'On-Call')]
+"""
+import pickle
+import tempfile
+import zlib
+
+# The number of temporary files the groups are spread across
+PARTITIONS = 64
+
+
+class SpillFile:
+    """Provides a sequence of values pickled to a temporary file in
+        *directory* as they are appended and read back one at a time"""
+
+    def __init__(self, directory=None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, value):
+        """Append *value* to the end of the file"""
+        self.file.write(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        self.length += 1
+
+    def __iter__(self):
+        """Yields the values in the order they were appended"""
+        self.file.flush()
+        self.file.seek(0)
+        try:
+            for _ in range(self.length):
+                yield pickle.load(self.file)
+        finally:
+            self.file.seek(0, 2)
+
+    def close(self):
+        self.file.close()
+
+
+def partition_of(key, partitions=PARTITIONS):
+    """Returns the partition of *key*, the same in every process"""
+    return zlib.crc32(repr(key).encode('utf-8')) % partitions
+
+
+class SpillGroups:
+    """Provides groups of values, like a defaultdict(list), spread across
+        *partitions* SpillFiles in *directory* by a hash of a partition key
+        so that the groups can be loaded a partition at a time"""
+
+    def __init__(self, partitions=PARTITIONS, directory=None):
+        self.files = [SpillFile(directory) for _ in range(partitions)]
+
+    def append(self, key, value, partition_key=None):
+        """Append *value* to the group *key*, kept in the partition of
+            *partition_key* (default *key*) - groups that must be read
+            together, such as all the shifts of a person, need the same
+            partition key"""
+        if partition_key is None:
+            partition_key = key
+        self.files[partition_of(partition_key, len(self.files))].append(
+            (key, value))
+
+    def touch(self, key, partition_key=None):
+        """Make sure the group *key* exists, even if it has no values"""
+        if partition_key is None:
+            partition_key = key
+        self.files[partition_of(partition_key, len(self.files))].append(
+            (key,))
+
+    def partitions(self):
+        """Yields a dictionary of key to the list of its values for each
+            partition that has any, with the keys in the order they were
+            first appended"""
+        for spill_file in self.files:
+            if not len(spill_file):
+                continue
+            groups = {}
+            for entry in spill_file:
+                groups.setdefault(entry[0], []).extend(entry[1:])
+            yield groups
+
+    def close(self):
+        for spill_file in self.files:
+            spill_file.close()
+
+
+class SpilledRota:
+    """Provides the rows of a rota spilled to temporary files in *directory*
+        - *everything*, a SpillFile of every row in order, and *groups*, the
+        SpillGroups of each person's rows. Use it as a context manager so
+        the files are removed."""
+
+    def __init__(self, partitions=PARTITIONS, directory=None):
+        self.everything = SpillFile(directory)
+        self.groups = SpillGroups(partitions, directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.everything.close()
+        self.groups.close()
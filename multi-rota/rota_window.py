@@ -0,0 +1,98 @@
+"""Restrict a rota to a window of dates.
+
+
+This file provides window_spec which parses a --window option into a (start,
+end) pair of dates - the shifts from start up to but not including end - and
+window_where which turns the window into the *where* option of the readers,
+so that the rows of a rota outside the window are skipped as they are read
+and the rest of their cells are never converted. Each end of the window is
+a date, 'today' or a number of days, weeks, months or years before or after
+today, and either end may be left open: '-30d:+12m' is the past 30 days
+through the next 12 months and '2018-01-01:' is every shift from 2018 on.
+
+A short usage example::
+
+>>> import rota_window
+>>> window = rota_window.window_spec('-30d:+12m')
+>>> where = rota_window.window_where(window, 'Date', convert_to_date)
+>>> for row in xlrd_helper.DictReader(f, where=where):
+...     print(row['Date'], row['On-Call'])
+2018/01/01 James
+"""
+import re
+from datetime import date, datetime
+from functools import partial
+from dateutil.relativedelta import relativedelta
+
+RELATIVE_RE = re.compile(r'^([+-]?\d+)([dwmy])$')
+
+UNITS = {'d': 'days', 'w': 'weeks', 'm': 'months', 'y': 'years'}
+
+
+def parse_bound(text, today=None):
+    """Returns the date of one end of a --window option, relative to *today*
+        (default the current date), or None if it is left open"""
+    text = text.strip().lower()
+    if text == '':
+        return None
+    if today is None:
+        today = date.today()
+    if text == 'today':
+        return today
+    match = RELATIVE_RE.match(text)
+    if match:
+        number, unit = match.groups()
+        return today + relativedelta(**{UNITS[unit]: int(number)})
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def window_spec(text, today=None):
+    """Parses a --window option such as '-30d:+12m' or
+        '2018-01-01:2018-07-01'. Returns the (start, end) dates, either of
+        which may be None."""
+    start, colon, end = text.partition(':')
+    if not colon:
+        raise ValueError('A window is start:end - %r' % text)
+    return parse_bound(start, today), parse_bound(end, today)
+
+
+def in_window(day, window):
+    """Returns True if the date or datetime *day* is in *window* - always if
+        *window* is None"""
+    if window is None:
+        return True
+    if isinstance(day, datetime):
+        day = day.date()
+    start, end = window
+    return (start is None or day >= start) and (end is None or day < end)
+
+
+def _value_in_window(window, day_of, value):
+    # A row with no date, such as a note under the rota, is in no window
+    if value is None or value == '':
+        return False
+    return in_window(day_of(value), window)
+
+
+def window_where(window, field, day_of):
+    """Returns the (field, predicate) *where* option of the readers which
+        keeps the rows whose *field*, made a date by the function *day_of*,
+        is in *window* - or None if *window* is None. Rows with an empty
+        *field* are skipped. The predicate can be pickled, if *day_of* can,
+        to read sheets in other processes."""
+    if window is None:
+        return None
+    return field, partial(_value_in_window, window, day_of)
+
+
+def where_rows(rows, where):
+    """Yields the *rows* whose *field* the predicate of the (field,
+        predicate) pair *where* is true for - all of them if *where* is None.
+        This is the *where* option for readers that cannot skip rows."""
+    if where is None:
+        yield from rows
+        return
+    field, predicate = where
+    for row in rows:
+        if predicate(row[field]):
+            yield row
@@ -0,0 +1,58 @@
+"""Tests of ical_compact: a shift across a change to or from summer time
+must get the DURATION of its exact length."""
+from datetime import datetime, timedelta
+
+import pytz
+from icalendar import Calendar, Event
+
+from ical_compact import compact_calendar, exact_length
+
+TZ = pytz.timezone('Europe/London')
+
+
+def night_shift(start, end):
+    """Returns a calendar of a shift from the London wall clock times
+        *start* to *end*, with the zone attached as the converters do"""
+    cal = Calendar()
+    event = Event()
+    event.add('summary', 'Night SHO: James')
+    event.add('dtstart', start.replace(tzinfo=TZ))
+    event.add('dtend', end.replace(tzinfo=TZ))
+    cal.add_component(event)
+    return cal
+
+
+def compacted_duration(start, end):
+    cal = compact_calendar(night_shift(start, end))
+    event = cal.walk('VEVENT')[0]
+    assert 'DTEND' not in event
+    return event.decoded('DURATION')
+
+
+def test_spring_forward():
+    # 20:00 GMT to 08:30 BST is 11.5 hours
+    assert compacted_duration(datetime(2018, 3, 24, 20),
+                              datetime(2018, 3, 25, 8, 30)) == \
+        timedelta(hours=11, minutes=30)
+
+
+def test_fall_back():
+    # 20:00 BST to 08:30 GMT is 13.5 hours
+    assert compacted_duration(datetime(2018, 10, 27, 20),
+                              datetime(2018, 10, 28, 8, 30)) == \
+        timedelta(hours=13, minutes=30)
+
+
+def test_no_change():
+    assert compacted_duration(datetime(2018, 3, 17, 20),
+                              datetime(2018, 3, 18, 8, 30)) == \
+        timedelta(hours=12, minutes=30)
+
+
+def test_exact_length_of_localized_times():
+    start = TZ.localize(datetime(2018, 3, 24, 20))
+    end = TZ.localize(datetime(2018, 3, 25, 8, 30))
+    assert exact_length(start, end) == timedelta(hours=11, minutes=30)
+    assert exact_length(start.replace(tzinfo=None),
+                        end.replace(tzinfo=None)) == \
+        timedelta(hours=12, minutes=30)
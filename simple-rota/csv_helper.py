@@ -0,0 +1,247 @@
+"""Functions and Classes to read large csv rotas quickly.
+
+
+This file provides two main classes: Reader and DictReader which, like their
+xlrd_helper counterparts, iterate over the rows of a csv file as lists or as
+dictionaries keyed by the header. Rows are parsed with csv.reader and a
+dictionary is built from the header and each row directly, which is cheaper
+than csv.DictReader.
+
+Given a *where* filter, a file bigger than CHUNK_SIZE is split by byte range
+into chunks that each end on a line boundary - never inside a quoted field -
+and the chunks are parsed and filtered in a pool of processes, with the rows
+returned in order. Only a few chunks are in flight at once. Without a filter
+the rows are streamed with a single csv.reader, as sending every row back
+from the workers costs more than parsing it.
+
+A short usage example::
+
+>>> import csv_helper
+>>> for row in csv_helper.DictReader('simple_rota.csv'):
+...     print(row['Date'], row['On-Call'])
+01/01/2018 James
+"""
+import csv
+import io
+import mmap
+import os
+from collections import deque
+from contextlib import contextmanager
+
+# Files bigger than this are parsed in chunks of this size in parallel
+CHUNK_SIZE = 1 << 24
+
+BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+
+@contextmanager
+def open_text(source, encoding='utf-8-sig'):
+    """Opens the path, bytes, memoryview or binary or text file-like *source*
+        as text for reading. A file-like *source* is not closed."""
+    if isinstance(source, str):
+        with open(source, encoding=encoding, newline='') as f:
+            yield f
+    elif isinstance(source, BUFFER_TYPES):
+        with io.TextIOWrapper(io.BytesIO(source), encoding=encoding,
+                              newline='') as f:
+            yield f
+    elif isinstance(source, io.TextIOBase):
+        yield source
+    else:
+        f = io.TextIOWrapper(source, encoding=encoding, newline='')
+        try:
+            yield f
+        finally:
+            f.detach()
+
+
+def _next_line(data, position, checked, quotes):
+    """Returns the start of the first line at or after *position* in *data*
+        that is not inside a quoted field, with the bytes up to *checked*
+        already known to hold *quotes* quote characters (modulo 2)"""
+    while True:
+        newline = data.find(b'\n', position)
+        if newline < 0:
+            return len(data), quotes
+        position = newline + 1
+        quotes ^= data[checked:position].count(b'"') & 1
+        checked = position
+        if not quotes:
+            return position, quotes
+
+
+def chunk_bounds(data, chunk_size=CHUNK_SIZE):
+    """Returns the byte offsets splitting the csv *data* into chunks of about
+        *chunk_size* bytes on line boundaries - a quoted field with a newline
+        in it is never split"""
+    bounds = [0]
+    quotes = 0
+    while bounds[-1] + chunk_size < len(data):
+        bound, quotes = _next_line(data, bounds[-1] + chunk_size,
+                                   bounds[-1], quotes)
+        bounds.append(bound)
+    if bounds[-1] < len(data):
+        bounds.append(len(data))
+    return bounds
+
+
+def _parse(text):
+    """Returns the non-blank rows of the csv *text* as lists"""
+    return [row for row in csv.reader(io.StringIO(text, newline='')) if row]
+
+
+def _column(field, header):
+    """Returns the index of the column *field* - an index or a name in the
+        *header* row"""
+    if isinstance(field, int):
+        return field
+    if header is None:
+        raise ValueError('A column name needs a header: %r' % field)
+    return header.index(field)
+
+
+def _matches(row, where):
+    # A missing cell is empty, as it is for xlrd_helper.Reader.convert
+    index, predicate = where
+    return predicate(row[index] if index < len(row) else '')
+
+
+def _parse_chunk(fname, start, end, encoding, where):
+    """Returns the rows in bytes *start* to *end* of the csv file *fname*
+        that match the (column index, predicate) pair *where*"""
+    with open(fname, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        text = data[start:end].decode(encoding)
+    return [row for row in csv.reader(io.StringIO(text, newline=''))
+            if row and _matches(row, where)]
+
+
+def _parallel_rows(fname, encoding, chunk_size, where, header):
+    """Yields the rows of the csv file *fname*, parsing and filtering chunks
+        of it in separate processes with at most two chunks per process in
+        flight"""
+    from concurrent.futures import ProcessPoolExecutor
+    with open(fname, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        names = None
+        if header:
+            # The header is the first non-blank row
+            rows = []
+            while not rows and start < len(data):
+                end, _ = _next_line(data, start, start, 0)
+                rows = _parse(data[start:end].decode(encoding))
+                start = end
+            if not rows:
+                return
+            names = rows[0]
+            yield names
+        bounds = [start] + [bound for bound in chunk_bounds(data, chunk_size)
+                            if bound > start]
+    if len(bounds) < 2:
+        return
+    where = (_column(where[0], names), where[1])
+    workers = min(len(bounds) - 1, os.cpu_count() or 1)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = deque()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            futures.append(pool.submit(_parse_chunk, fname, start, end,
+                                       encoding, where))
+            if len(futures) == 2 * workers:
+                yield from futures.popleft().result()
+        while futures:
+            yield from futures.popleft().result()
+
+
+def read_rows(source, encoding='utf-8-sig', chunk_size=CHUNK_SIZE,
+              where=None, header=False, parallel=True):
+    """Yields each non-blank row of the csv *source* - a path, bytes, a
+        memoryview or a file-like object - as a list of strings. Given a
+        (column, predicate) pair *where* only the rows whose column the
+        predicate is true for are kept; if *header* the first row is the
+        header, always kept, and the column may be one of its names.
+
+        A filtered file bigger than *chunk_size* is parsed in a pool of
+        processes, so the predicate must be picklable, unless *parallel* is
+        False or there is only one CPU."""
+    if where is not None and parallel and isinstance(source, str) and \
+            (os.cpu_count() or 1) > 1 and \
+            os.path.getsize(source) > chunk_size:
+        yield from _parallel_rows(source, encoding, chunk_size, where,
+                                  header)
+        return
+    with open_text(source, encoding) as f:
+        rows = (row for row in csv.reader(f) if row)
+        names = None
+        if header:
+            names = next(rows, None)
+            if names is None:
+                return
+            yield names
+        if where is None:
+            yield from rows
+            return
+        where = (_column(where[0], names), where[1])
+        for row in rows:
+            if _matches(row, where):
+                yield row
+
+
+class Reader:
+    """ Provides a Reader object that will iterate over the rows of the csv
+    *source* - a path, bytes, a memoryview or a file-like object - as lists
+    of strings, skipping blank rows. The *where*, *header* and *parallel*
+    parameters are as for read_rows."""
+
+    def __init__(self, source, encoding='utf-8-sig', chunk_size=CHUNK_SIZE,
+                 where=None, header=False, parallel=True):
+        self.source = source
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.where = where
+        self.header = header
+        self.parallel = parallel
+
+    def __iter__(self):
+        return read_rows(self.source, self.encoding, self.chunk_size,
+                         self.where, self.header, self.parallel)
+
+
+class DictReader:
+    """ Provides a DictReader object that will iterate over the rows of the
+    csv *source* as dictionaries, like csv.DictReader. The keys are the
+    optional *fieldnames* or else the first row. A short row is filled in
+    with *restval* and the extra values of a long row are kept in a list
+    under *restkey*.
+
+    Given a (fieldname, predicate) pair *where* only the rows whose field
+    the predicate is true for are read, filtered as they are parsed - in
+    parallel for a big file unless *parallel* is False."""
+
+    def __init__(self, source, fieldnames=None, restkey=None, restval=None,
+                 encoding='utf-8-sig', chunk_size=CHUNK_SIZE, where=None,
+                 parallel=True):
+        if where is not None and fieldnames is not None:
+            where = (list(fieldnames).index(where[0]), where[1])
+        self.reader = Reader(source, encoding, chunk_size, where,
+                             fieldnames is None, parallel)
+        self.fieldnames = fieldnames
+        self.restkey = restkey
+        self.restval = restval
+
+    def __iter__(self):
+        rows = iter(self.reader)
+        if self.fieldnames is None:
+            self.fieldnames = next(rows, None)
+            if self.fieldnames is None:
+                return
+        fieldnames = self.fieldnames
+        width = len(fieldnames)
+        for row in rows:
+            d = dict(zip(fieldnames, row))
+            if len(row) < width:
+                for key in fieldnames[len(row):]:
+                    d[key] = self.restval
+            elif len(row) > width:
+                d[self.restkey] = row[width:]
+            yield d
@@ -0,0 +1,134 @@
+"""Compress repeating events in a calendar into recurring events.
+
+
+This file provides compress_calendar which groups the events of a calendar
+that are the same apart from the day they start on - same summary,
+description, time of day and length - and, where a group repeats every few
+days or weeks, replaces it with a single event with an RRULE. Days missing
+from the pattern are listed in an EXDATE and extra days in an RDATE, so the
+occurrences of the recurring event are exactly the events it replaces. A
+consultant on every Monday for a year becomes one event rather than 52.
+
+A short usage example::
+
+>>> import ical_rrule
+>>> cal = ical_rrule.compress_calendar(create_calendar_for(...))
+>>> print(cal.to_ical().decode())
+...
+RRULE:FREQ=WEEKLY;COUNT=52
+EXDATE:20180528T080000
+...
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+# These properties differ between the occurrences of a recurring event
+VARYING_PROPERTIES = ('UID', 'DTSTART', 'DTEND', 'DTSTAMP', 'SEQUENCE')
+
+# Fewer occurrences than this are left as separate events
+MIN_OCCURRENCES = 3
+
+# The number of the most common gaps between events tried as the interval
+CANDIDATE_INTERVALS = 3
+
+
+def _day(value):
+    """Returns the proleptic ordinal of the date or datetime *value*"""
+    return value.toordinal()
+
+
+def _length(event, start):
+    if 'DTEND' in event:
+        return event.decoded('DTEND') - start
+    if 'DURATION' in event:
+        return event.decoded('DURATION')
+    return None
+
+
+def pattern_key(event):
+    """Returns the key of *event* shared by the events it could recur with:
+        everything but the day it starts on and its identity"""
+    start = event.decoded('DTSTART')
+    time_of_day = None if type(start) is date else start.timetz()
+    lines = tuple(str(line) for line in event.content_lines()
+                  if not str(line).startswith(VARYING_PROPERTIES))
+    return type(start), time_of_day, _length(event, start), lines
+
+
+def best_interval(days, candidates=CANDIDATE_INTERVALS):
+    """Returns the (interval, count, exdates, rdates) of the recurrence
+        starting on the first of the sorted distinct proleptic *days* with the
+        fewest exceptions - trying the most common gaps between the days"""
+    gaps = Counter(b - a for a, b in zip(days, days[1:]))
+    best = None
+    present = set(days)
+    for interval, _ in gaps.most_common(candidates):
+        on = [day for day in days if (day - days[0]) % interval == 0]
+        count = (on[-1] - days[0]) // interval + 1
+        exdates = [days[0] + k * interval for k in range(count)
+                   if days[0] + k * interval not in present]
+        rdates = [day for day in days if (day - days[0]) % interval != 0 or
+                  day > on[-1]]
+        if best is None or \
+                len(exdates) + len(rdates) < len(best[2]) + len(best[3]):
+            best = (interval, count, exdates, rdates)
+    return best
+
+
+def recurring_event(events, min_occurrences=MIN_OCCURRENCES):
+    """Returns the first of *events*, which share a pattern_key and start on
+        distinct days, with an RRULE, EXDATE and RDATE covering all of them
+        - or None if they do not repeat often enough to be worth it"""
+    events = sorted(events, key=lambda event: _day(event.decoded('DTSTART')))
+    if len(events) < min_occurrences:
+        return None
+    first = events[0]
+    start = first.decoded('DTSTART')
+    days = [_day(event.decoded('DTSTART')) for event in events]
+    interval, count, exdates, rdates = best_interval(days)
+    occurrences = count - len(exdates)
+    if occurrences < min_occurrences or len(exdates) > occurrences:
+        return None
+
+    def at(day):
+        return start + timedelta(days=day - days[0])
+
+    if interval % 7 == 0:
+        rule = {'FREQ': 'WEEKLY', 'INTERVAL': interval // 7}
+    else:
+        rule = {'FREQ': 'DAILY', 'INTERVAL': interval}
+    if rule['INTERVAL'] == 1:
+        del rule['INTERVAL']
+    rule['COUNT'] = count
+    first.add('rrule', rule)
+    if exdates:
+        first.add('exdate', [at(day) for day in exdates])
+    if rdates:
+        first.add('rdate', [at(day) for day in rdates])
+    return first
+
+
+def compress_calendar(cal, min_occurrences=MIN_OCCURRENCES):
+    """Replace the events of calendar *cal* that repeat with recurring
+        events, in place, and return it. A recurring event takes the place
+        and the UID of its first occurrence."""
+    groups = {}
+    for event in cal.subcomponents:
+        if event.name == 'VEVENT' and 'RRULE' not in event:
+            groups.setdefault(pattern_key(event), []).append(event)
+
+    replaced = {}
+    for events in groups.values():
+        # Events on the same day as another in the group stay as they are
+        by_day = {}
+        for event in events:
+            by_day.setdefault(_day(event.decoded('DTSTART')), event)
+        recurring = recurring_event(by_day.values(), min_occurrences)
+        if recurring is None:
+            continue
+        for event in by_day.values():
+            replaced[id(event)] = event is recurring
+
+    cal.subcomponents = [component for component in cal.subcomponents
+                         if replaced.get(id(component), True)]
+    return cal
@@ -0,0 +1,122 @@
+"""An index of the shifts of a rota for answering queries about who works when.
+
+
+This file provides the RotaIndex class which is built once from a RotaModel
+and keeps, for every person and for the whole rota, the shifts sorted by
+their start. Questions such as "who is on call on Christmas day?" or "what
+does James have next week?" are then answered with a binary search rather
+than by generating every calendar.
+
+A short usage example::
+
+>>> import rota_index
+>>> index = rota_index.RotaIndex(model)
+>>> for shift in index.on_duty(datetime(2018, 12, 25, 12, 0)):
+...     print(shift.name, shift.role)
+James SHO
+>>> len(index.events_for('James', date(2018, 1, 1), date(2018, 1, 8)))
+5
+"""
+from datetime import date, datetime
+import numpy as np
+
+
+def as_minutes(value):
+    """Returns a date, datetime or datetime64 *value* as a datetime64[m].
+        Times are local wall clock times, as in the RotaModel."""
+    if getattr(value, 'tzinfo', None) is not None:
+        value = value.replace(tzinfo=None)
+    return np.datetime64(value, 'm')
+
+
+class _Intervals:
+    """The shifts at *indices* of a model sorted by start, with the length of
+        the longest shift so that a search for the shifts overlapping a time
+        range only needs to look back that far"""
+
+    def __init__(self, model, indices):
+        order = np.argsort(model.starts[indices], kind='stable')
+        self.indices = np.asarray(indices)[order]
+        self.starts = model.starts[self.indices]
+        self.ends = model.ends[self.indices]
+        if len(self.indices):
+            self.longest = (self.ends - self.starts).max()
+        else:
+            self.longest = np.timedelta64(0, 'm')
+
+    def overlapping(self, start, end):
+        """Returns the indices of the shifts which overlap [start, end)"""
+        first = np.searchsorted(self.starts, start - self.longest,
+                                side='right')
+        last = np.searchsorted(self.starts, end, side='left')
+        found = self.indices[first:last]
+        return found[self.ends[first:last] > start]
+
+
+class RotaIndex:
+    """Provides queries on the shifts in a :class:`RotaModel`. The index is
+        built once and each query takes time logarithmic in the number of
+        shifts plus the number of shifts found.
+
+        Shifts are returned as Shifts in order of their start. A shift
+        overlaps a query if it starts before the end of the query and ends
+        after its start."""
+
+    def __init__(self, model):
+        self.model = model
+        self.everyone = _Intervals(model, np.arange(len(model)))
+        self.people = {name: _Intervals(model, indices)
+                       for (name,), indices in model.group_by('name')}
+
+    def __contains__(self, name):
+        return name in self.people
+
+    def names(self):
+        """Returns the sorted list of the names in the rota"""
+        return sorted(self.people)
+
+    def _shifts(self, indices, role=None):
+        shifts = self.model.shifts(indices)
+        if role is None:
+            return list(shifts)
+        return [shift for shift in shifts if shift.role == role]
+
+    def events_for(self, name, start, end, role=None):
+        """Returns the shifts of *name*, optionally only in *role*, which
+            overlap the time from *start* up to *end*"""
+        if name not in self.people:
+            return []
+        indices = self.people[name].overlapping(as_minutes(start),
+                                                as_minutes(end))
+        return self._shifts(indices, role)
+
+    def between(self, start, end, role=None):
+        """Returns everyone's shifts, optionally only in *role*, which
+            overlap the time from *start* up to *end*"""
+        indices = self.everyone.overlapping(as_minutes(start),
+                                            as_minutes(end))
+        return self._shifts(indices, role)
+
+    def on_duty(self, at, role=None):
+        """Returns the shifts, optionally only in *role*, being worked at the
+            time *at*. If *at* is a date the shifts on any part of that day
+            are returned."""
+        start = as_minutes(at)
+        if isinstance(at, date) and not isinstance(at, datetime):
+            end = start + np.timedelta64(1, 'D')
+        else:
+            end = start + np.timedelta64(1, 'm')
+        return self.between(start, end, role)
+
+    def next_for(self, name, after, role=None):
+        """Returns the first shift of *name*, optionally only in *role*,
+            starting at or after *after* or None"""
+        if name not in self.people:
+            return None
+        intervals = self.people[name]
+        first = np.searchsorted(intervals.starts, as_minutes(after),
+                                side='left')
+        for shift in self.model.shifts(intervals.indices[first:]):
+            if role is None or shift.role == role:
+                return shift
+        return None
@@ -0,0 +1,304 @@
+"""A SQLite store of the state of previous runs of a rota converter.
+
+
+This file provides the StateStore class which keeps, for every run of a
+converter, the number of rows and a digest of the shifts of every name and
+job in the rota. This replaces the last_names.csv file: new names are found
+with a single query and the history allows changes since any earlier run to
+be reported without re-reading old spreadsheets. It also keeps the events
+last published in each calendar so that delta calendars can be written, and
+the spelling corrections learned from near-duplicate names.
+
+A short usage example::
+
+>>> import rota_state
+>>> with rota_state.StateStore('generated') as store:
+...     run = store.record_run('multi_rota3.xls', entries)
+...     for name, job, number in store.new_names(run):
+...         print(name, job, number)
+Peters Consultant 2
+"""
+import sqlite3
+import hashlib
+import tempfile
+from datetime import datetime
+from os.path import exists, join
+
+STATE_FILENAME = 'rota_state.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    job TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (run, name, job)
+);
+CREATE INDEX IF NOT EXISTS entries_name_job ON entries (name, job, run);
+CREATE TABLE IF NOT EXISTS events (
+    calendar TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    sequence INTEGER NOT NULL,
+    ical BLOB NOT NULL,
+    PRIMARY KEY (calendar, uid)
+);
+CREATE TABLE IF NOT EXISTS corrections (
+    misspelling TEXT PRIMARY KEY,
+    correction TEXT NOT NULL
+);
+"""
+
+
+def digest_shifts(records, key, everyone):
+    """Returns a dictionary of key to hex digest of the (name, job, role,
+        day) of the shift *records* for that key. The *key* function maps a
+        record to its key and *everyone* is the key for all of the records.
+        The digests do not depend on the order of the records."""
+    keyed = {everyone: []}
+    for record in records:
+        name, job, role, day = record[:4]
+        shift = '%s\t%s\t%s\t%s' % (name, job, role, day.isoformat())
+        keyed.setdefault(key(record), []).append(shift)
+        keyed[everyone].append(shift)
+
+    return {k: _digest(keyed[k]) for k in keyed}
+
+
+def _digest(shifts):
+    """Returns the hex digest of the *shifts* in sorted order"""
+    h = hashlib.sha1()
+    for shift in sorted(shifts):
+        h.update(shift.encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+class PartitionDigests:
+    """Computes the same digests as digest_shifts from the shift *records*
+        of one partition at a time, where all the records of a name are in
+        the same partition. The sorted shifts of each name are kept in a
+        temporary file, as the digest of *everyone* needs them in order."""
+
+    def __init__(self, key, everyone):
+        self.key = key
+        self.everyone = everyone
+        self.blocks = tempfile.TemporaryFile()
+        self.offsets = {}
+        self.result = {}
+
+    def update(self, records):
+        """Add the digests of the shift *records* of a partition"""
+        by_name = {}
+        keyed = {}
+        for record in records:
+            name, job, role, day = record[:4]
+            shift = '%s\t%s\t%s\t%s' % (name, job, role, day.isoformat())
+            keyed.setdefault(self.key(record), []).append(shift)
+            by_name.setdefault(name, []).append(shift)
+        for k in keyed:
+            self.result[k] = _digest(keyed[k])
+        for name, shifts in by_name.items():
+            block = ''.join(shift + '\n' for shift in sorted(shifts))
+            block = block.encode('utf-8')
+            self.offsets[name] = (self.blocks.tell(), len(block))
+            self.blocks.write(block)
+
+    def digests(self):
+        """Returns the dictionary of key to digest, including everyone"""
+        # Every shift starts with its name and a tab, so the sorted shifts
+        # of everyone are the blocks of each name in that order
+        h = hashlib.sha1()
+        for name in sorted(self.offsets, key=lambda name: name + '\t'):
+            offset, length = self.offsets[name]
+            self.blocks.seek(offset)
+            h.update(self.blocks.read(length))
+        self.blocks.seek(0, 2)
+        digests = dict(self.result)
+        digests[self.everyone] = h.hexdigest()
+        return digests
+
+    def close(self):
+        self.blocks.close()
+
+
+class StateStore:
+    """Provides a store of the names and jobs seen in each run of a
+        converter kept in a SQLite database in *directory*.
+
+        If the database is new and a last_names.csv from an earlier version
+        of the converter exists in *directory* it is imported as the first
+        run so that its names are not reported as new."""
+
+    def __init__(self, directory, filename=STATE_FILENAME):
+        self.directory = directory
+        self.connection = sqlite3.connect(join(directory, filename))
+        self.connection.executescript(SCHEMA)
+        if self.last_run() is None:
+            self.import_last_names(join(directory, 'last_names.csv'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def import_last_names(self, fname):
+        """Import the names and numbers from a last_names.csv as a run"""
+        from csv import DictReader
+        if not exists(fname):
+            return None
+        with open(fname) as f:
+            entries = [(row['name'], row.get('job', ''), int(row['number']),
+                        None)
+                       for row in DictReader(f)]
+        return self.record_run(fname, entries)
+
+    def last_run(self):
+        """Returns the id of the most recent run or None"""
+        return self.connection.execute(
+            'SELECT max(id) FROM runs').fetchone()[0]
+
+    def record_run(self, source, entries):
+        """Record a new run of *source* with the given (name, job, number,
+            digest) entries in a single transaction, returning the run id"""
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (started, source) VALUES (?, ?)',
+                (datetime.now().isoformat(), source))
+            run = cursor.lastrowid
+            self.connection.executemany(
+                'INSERT INTO entries (run, name, job, number, digest) '
+                'VALUES (?, ?, ?, ?, ?)',
+                ((run, name, job, number, digest)
+                 for name, job, number, digest in entries))
+        return run
+
+    def names(self, run=None):
+        """Returns a list of the (name, job) entries in *run* (default the
+            latest run)"""
+        if run is None:
+            run = self.last_run()
+        return self.connection.execute(
+            'SELECT name, job FROM entries WHERE run = ? ORDER BY rowid',
+            (run,)).fetchall()
+
+    def new_names(self, run):
+        """Returns a list of the (name, job, number) entries in *run* that
+            have not been seen in any earlier run"""
+        return self.connection.execute(
+            'SELECT e.name, e.job, e.number FROM entries e '
+            'WHERE e.run = ? AND NOT EXISTS ('
+            '  SELECT 1 FROM entries p '
+            '  WHERE p.name = e.name AND p.job = e.job AND p.run < e.run) '
+            'ORDER BY e.rowid', (run,)).fetchall()
+
+    def changes_since(self, since, run=None):
+        """Returns a list of (change, name, job, old number, new number)
+            tuples describing what changed between run *since* and *run*
+            (default the latest run). The change is one of 'added',
+            'removed' or 'changed'."""
+        if run is None:
+            run = self.last_run()
+        old = self._entries(since)
+        new = self._entries(run)
+        changes = []
+        for key in new:
+            if key not in old:
+                changes.append(('added',) + key + (None, new[key][0]))
+            elif old[key][0] != new[key][0] or \
+                    None not in (old[key][1], new[key][1]) and \
+                    old[key][1] != new[key][1]:
+                changes.append(('changed',) + key +
+                               (old[key][0], new[key][0]))
+        for key in old:
+            if key not in new:
+                changes.append(('removed',) + key + (old[key][0], None))
+        return changes
+
+    def calendars(self):
+        """Returns a list of the calendars with published events"""
+        return [calendar for calendar, in self.connection.execute(
+            'SELECT DISTINCT calendar FROM events ORDER BY calendar')]
+
+    def update_events(self, calendar, events):
+        """Replace the published events of *calendar* with the given (uid,
+            digest, ical) *events*. Returns a list of the (uid, sequence) of
+            the added and changed events and a list of the (uid, sequence,
+            ical) of the removed events. The changes are not committed until
+            :meth:`commit` is called, once the calendars are published."""
+        old = {uid: (digest, sequence, ical)
+               for uid, digest, sequence, ical in self.connection.execute(
+                   'SELECT uid, digest, sequence, ical FROM events '
+                   'WHERE calendar = ?', (calendar,))}
+        requests = []
+        updates = []
+        new = set()
+        for uid, digest, ical in events:
+            new.add(uid)
+            if uid not in old:
+                sequence = 0
+            elif old[uid][0] != digest:
+                sequence = old[uid][1] + 1
+            else:
+                continue
+            requests.append((uid, sequence))
+            updates.append((calendar, uid, digest, sequence, ical))
+        cancels = [(uid, old[uid][1] + 1, old[uid][2])
+                   for uid in old if uid not in new]
+
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO events '
+            '(calendar, uid, digest, sequence, ical) '
+            'VALUES (?, ?, ?, ?, ?)', updates)
+        self.connection.executemany(
+            'DELETE FROM events WHERE calendar = ? AND uid = ?',
+            ((calendar, uid) for uid, _, _ in cancels))
+        return requests, cancels
+
+    def commit(self):
+        """Commit the changes made by update_events"""
+        self.connection.commit()
+
+    def rollback(self):
+        """Discard the changes made by update_events since the last commit"""
+        self.connection.rollback()
+
+    def corrections(self):
+        """Returns the dictionary of learned spelling corrections"""
+        return dict(self.connection.execute(
+            'SELECT misspelling, correction FROM corrections'))
+
+    def add_corrections(self, corrections):
+        """Save the (misspelling, correction) pairs in *corrections*"""
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO corrections (misspelling, correction) '
+                'VALUES (?, ?)', corrections)
+
+    def _entries(self, run):
+        return {(name, job): (number, digest)
+                for name, job, number, digest in self.connection.execute(
+                    'SELECT name, job, number, digest FROM entries '
+                    'WHERE run = ?', (run,))}
+
+
+def report_changes(changes):
+    """Print the changes returned by StateStore.changes_since"""
+    for change, name, job, old, new in changes:
+        who = '%s (%s)' % (name, job) if job != '' else name
+        if change == 'added':
+            print('Added: %s with %d rows' % (who, new))
+        elif change == 'removed':
+            print('Removed: %s with %d rows' % (who, old))
+        else:
+            print('Changed: %s from %d to %d rows' % (who, old, new))
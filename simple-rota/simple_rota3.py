@@ -2,21 +2,36 @@
 
 # _________________________________ IMPORTS _________________________________
 from icalendar import Calendar, Event
-import uuid
 from datetime import date, datetime, time, timedelta
 from collections import defaultdict
 import pytz
 import dateutil.parser
+from ical_helper import event_uid
 
 # ________________________________ CONSTANTS ________________________________
 # Define our local timezone - this is so that the rota works even when we cross
 # into BST/GMT
 TZ = pytz.timezone('Europe/London')
 
+# The name of this rota - used to give each event a stable identity
+ROTA = 'simple-rota'
+
 # Let's define the hours of work
 START_TIME = time(8, tzinfo=TZ)
 DURATION = timedelta(hours=12)
 
+# The same hours in the form used by the columnar rota model
+HOURS = {
+    'On-Call': {
+        'start': START_TIME,
+        'duration': DURATION
+    }
+}
+
+# The minimum rest between the end of one shift and the start of the next -
+# shorter rests and overlapping shifts are reported
+MIN_REST = timedelta(hours=11)
+
 
 # ________________________________ FUNCTIONS ________________________________
 # Conversion functions
@@ -29,21 +44,30 @@ def convert_to_date(date_str):
 
 
 # Calendar functions
-def create_event_for(row):
-    """Take a row and create an icalendar event for this row"""
+def create_event_for(row, dtstamp=None):
+    """Take a row and create an icalendar event for this row, stamped with
+        *dtstamp* or the current time"""
+    return create_shift_event(row['On-Call'],
+                              datetime.combine(convert_to_date(row['Date']),
+                                               START_TIME),
+                              dtstamp)
+
+
+def create_shift_event(name, start, dtstamp=None):
+    """Create an icalendar event for the shift of name starting at *start*,
+        a local wall clock datetime"""
     event = Event()
-    event.add('summary', 'On-Call: ' + row['On-Call'])
-    event.add('description', 'On-Call: ' + row['On-Call'])
-    event.add('dtstart', datetime.combine(convert_to_date(row['Date']),
-                                          START_TIME))
+    event.add('summary', 'On-Call: ' + name)
+    event.add('description', 'On-Call: ' + name)
+    event.add('dtstart', start.replace(tzinfo=TZ))
     event.add('duration', DURATION)
-    event.add('dtstamp', datetime.now())
+    event.add('dtstamp', dtstamp or datetime.now())
     event.add('location', 'At work')  # Set this to something useful
-    event.add('uid', uuid.uuid4())
+    event.add('uid', event_uid(ROTA, name, 'On-Call', start))
     return event
 
 
-def create_calendar_for(rows, title='Simple Rota'):
+def create_calendar_for(rows, title='Simple Rota', dtstamp=None):
     """Create a calendar using the rows"""
     # Create a basic iCalendar object
     cal = Calendar()
@@ -57,111 +81,529 @@ def create_calendar_for(rows, title='Simple Rota'):
 
     # Now open the rota
     for row in rows:
-        event = create_event_for(row)
+        event = create_event_for(row, dtstamp)
         cal.add_component(event)
 
     return cal
 
 
 # File reading functions
-def read_csv(fname, handler, sheet, *args, **kwds):
+def read_csv(fname, handler, sheet, *args, where=None, parallel=True,
+             **kwds):
     """Reads the given csv file *fname* as DictReader and calls handler with
-        the first argument as the reader. Optional and named parameters are
-        passed to the provided handler"""
-    from csv import DictReader
-    with open(fname) as f:
-        r = DictReader(f)
-        return handler(r, *args, **kwds)
+        the first argument as the reader, keeping only the rows *where* the
+        predicate of a (fieldname, predicate) pair is true - filtered in
+        parallel for a big file unless *parallel* is False. Optional and
+        named parameters are passed to the provided handler"""
+    from csv_helper import DictReader
+    r = DictReader(fname, where=where, parallel=parallel)
+    return handler(r, *args, **kwds)
 
 
-def read_excel(fname, handler, sheet=0, *args, **kwds):
+def read_excel(fname, handler, sheet=0, *args, where=None, **kwds):
     """Reads the given excel file *fname* as DictReader and calls handler with
-        the first argument as the reader. Optional and named parameters are
-        passed to the provided handler"""
+        the first argument as the reader, keeping only the rows *where* the
+        predicate of a (fieldname, predicate) pair is true. Optional and
+        named parameters are passed to the provided handler"""
     from xlrd_helper import DictReader
+    if not isinstance(fname, str):
+        # bytes, a memoryview or a file-like object
+        r = DictReader(fname, sheet_index=sheet, where=where)
+        return handler(r, *args, **kwds)
     with open(fname, 'rb') as f:
-        r = DictReader(f, sheet_index=sheet)
+        r = DictReader(f, sheet_index=sheet, where=where)
         return handler(r, *args, **kwds)
 
 
-def read(fname, handler, sheet=0, *args, **kwds):
+def read(fname, handler, sheet=0, *args, where=None, parallel=True,
+         **kwds):
     """Attempt to read given file *fname* as a DictReader and calls handler
-        with the first argument as the reader. Optional and named parameters
-        are passed to the provided handler"""
+        with the first argument as the reader, keeping only the rows *where*
+        the predicate of a (fieldname, predicate) pair is true. A csv file
+        is read in parallel as read_csv unless *parallel* is False. Optional
+        and named parameters are passed to the provided handler.
+        *fname* may also be the rota as bytes, a memoryview or a seekable
+        binary file-like object, in which case its format is found from its
+        first bytes"""
+    if not isinstance(fname, str):
+        from xlrd_helper import sniff_format
+        if sniff_format(fname) == 'csv':
+            return read_csv(fname, handler, sheet, *args, where=where,
+                            parallel=parallel, **kwds)
+        return read_excel(fname, handler, sheet, *args, where=where, **kwds)
     if fname.lower().endswith('.csv'):
-        return read_csv(fname, handler, sheet, *args, **kwds)
+        return read_csv(fname, handler, sheet, *args, where=where,
+                        parallel=parallel, **kwds)
     elif fname.lower().endswith('.xls') or fname.lower().endswith('.xlsx'):
-        return read_excel(fname, handler, sheet, *args, **kwds)
+        return read_excel(fname, handler, sheet, *args, where=where, **kwds)
     else:
         raise ValueError('Unknown filetype: %s' % fname)
 
 
+def date_where(window):
+    """Returns the *where* option of the readers which skips the rows outside
+        the dates in *window*, or None"""
+    from rota_window import window_where
+    return window_where(window, 'Date', convert_to_date)
+
+
+def merge_sheets(results):
+    """Merge the rota information read from each sheet of a workbook"""
+    from itertools import chain
+    from rota_model import RotaModel
+    if results and isinstance(results[0], RotaModel):
+        return RotaModel.concatenate(results)
+    if results and isinstance(results[0], list):
+        return list(chain.from_iterable(results))
+    merged = defaultdict(list)
+    for result in results:
+        for key in result:
+            merged[key].extend(result[key])
+    return merged
+
+
+def read_sheets(fname, handler, sheets, *args, **kwds):
+    """Reads each of the *sheets* of the excel file *fname* in a separate
+        process with handler, merging the results. Optional and named
+        parameters are passed to the provided handler"""
+    from xlrd_helper import map_sheets, sheet_indices
+    return merge_sheets(map_sheets(read, fname, handler,
+                                   sheet_indices(fname, sheets),
+                                   *args, **kwds))
+
+
 # Reading functions
-def handle_rows(rows):
-    """Given some rows, parse the rows and store the rota information"""
+def handle_rows(rows, kept=()):
+    """Given some rows, parse the rows and store the rota information. The
+        names in *kept* are kept even if they have no rows."""
     name_to_list_of_rows_dict = defaultdict(list)
     for row in rows:
         name = row['On-Call']
         name_to_list_of_rows_dict[name].append(row)
         name_to_list_of_rows_dict['All'].append(row)
+    for name in kept:
+        name_to_list_of_rows_dict.setdefault(name, [])
+        name_to_list_of_rows_dict.setdefault('All', [])
     return name_to_list_of_rows_dict
 
 
+def handle_rows_spilled(rows, spilled=None, kept=()):
+    """Store the rota information like handle_rows but in temporary files,
+        partitioned by name, rather than in memory. The rows are appended to
+        the SpilledRota *spilled* if given."""
+    from rota_spill import SpilledRota
+    if spilled is None:
+        spilled = SpilledRota()
+    for row in rows:
+        spilled.everything.append(row)
+        spilled.groups.append(row['On-Call'], row)
+    for name in kept:
+        spilled.groups.touch(name)
+    return spilled
+
+
+def read_spilled(fname, sheet, kept=(), where=None):
+    """Reads the rota *fname* into a SpilledRota, a sheet at a time, keeping
+        the names in *kept* and only the rows *where* the predicate of a
+        (fieldname, predicate) pair is true. A csv file is read in a single
+        process so that only a few of its rows are in memory at once."""
+    from rota_spill import SpilledRota
+    spilled = SpilledRota()
+    try:
+        if isinstance(sheet, int):
+            return read(fname, handle_rows_spilled, sheet, spilled, kept,
+                        where=where, parallel=False)
+        from xlrd_helper import sheet_indices
+        for index in sheet_indices(fname, sheet):
+            read(fname, handle_rows_spilled, index, spilled, kept,
+                 where=where, parallel=False)
+        return spilled
+    except BaseException:
+        spilled.close()
+        raise
+
+
+def shift_records(name_to_list_of_rows_dict):
+    """Yields a (name, job, role, day, row) tuple for every shift in the rota
+        information returned by handle_rows"""
+    for name in name_to_list_of_rows_dict:
+        if name == 'All':
+            continue
+        for row in name_to_list_of_rows_dict[name]:
+            yield (name, 'On-Call', 'On-Call',
+                   convert_to_date(row['Date']).date(), row)
+
+
+def handle_rows_columnar(rows, kept=()):
+    """Store the rota information as a columnar rota model, built straight
+        from the columns of the rows, with the shifts in the order of their
+        rows. The names in *kept* are kept even if they have no rows."""
+    from rota_model import RotaModel
+    rows = list(rows)
+    return RotaModel.from_columns(
+        [row['On-Call'] for row in rows],
+        ['On-Call'] * len(rows), ['On-Call'] * len(rows),
+        [convert_to_date(row['Date']).date() for row in rows], rows,
+        HOURS, [(name, 'On-Call') for name in kept])
+
+
+def load_index(fname, sheet=0, window=None):
+    """Returns a RotaIndex of the shifts in *window* of the rota *fname* to
+        query who works when without creating the calendars"""
+    from rota_index import RotaIndex
+    reader = read if isinstance(sheet, int) else read_sheets
+    return RotaIndex(reader(fname, handle_rows_columnar, sheet,
+                            where=date_where(window)))
+
+
 # Check last names functions
-def check_last_names(name_to_list_of_rows_dict, directory):
-    """Check from the previous run of this parser if there are new names,
-        returns a dictionary of names to number of rows"""
+def count_rows(name_to_list_of_rows_dict):
+    """Returns a dictionary of names to number of rows"""
+    return {name: len(name_to_list_of_rows_dict[name])
+            for name in name_to_list_of_rows_dict}
+
+
+def count_rows_columnar(model):
+    """Returns a dictionary of names to number of rows"""
+    name_to_number_of_rows = {'All': len(model)}
+    for (name,), number in model.counts('name').items():
+        name_to_number_of_rows[name] = number
+    for name, _ in model.empty:
+        name_to_number_of_rows[name] = 0
+    return name_to_number_of_rows
+
+
+def digest_rows(name_to_list_of_rows_dict):
+    """Returns a dictionary of names to a digest of their shifts"""
+    from rota_state import digest_shifts
+    return digest_shifts(shift_records(name_to_list_of_rows_dict),
+                         lambda record: record[0],
+                         'All')
+
+
+def digest_rows_columnar(model):
+    """Returns a dictionary of names to a digest of their shifts"""
+    from rota_state import digest_shifts
+    return digest_shifts(model.shifts(), lambda record: record[0], 'All')
+
+
+def published_names(directory):
+    """Returns the names of the last run, whose calendars are kept even if
+        they have no shifts in a window"""
     from os.path import exists, join
-    from csv import DictReader, DictWriter
-
-    last_names = {}
-    # Read the last names
-    if exists(join(directory, 'last_names.csv')):
-        with open(join(directory, 'last_names.csv')) as f:
-            r = DictReader(f)
-            for row in r:
-                last_names[row['name']] = int(row['number'])
-
-    name_to_number_of_rows = {}
-    with open(join(directory, 'last_names.csv'), 'w') as f:
-        w = DictWriter(f, ['name', 'number'])
-        w.writeheader()
-        for name in name_to_list_of_rows_dict:
-            number = len(name_to_list_of_rows_dict[name])
-            if name not in last_names:
-                # We have a new name
-                print('New name in rota: %s with %d rows' % (name, number))
-            w.writerow({'name': name, 'number': number})
-            name_to_number_of_rows['name'] = number
+    from rota_state import StateStore, STATE_FILENAME
+    if not exists(join(directory, STATE_FILENAME)):
+        return []
+    with StateStore(directory) as store:
+        return [name for name, _ in store.names() if name != 'All']
+
+
+def check_last_names(name_to_number_of_rows, directory, name_to_digest=None,
+                     source=''):
+    """Check from the previous runs of this parser if there are new names,
+        recording this run in the state store. Returns a dictionary of names
+        to number of rows"""
+    from rota_state import StateStore
+    if name_to_digest is None:
+        name_to_digest = {}
+
+    with StateStore(directory) as store:
+        run = store.record_run(source,
+                               [(name, '', number, name_to_digest.get(name))
+                                for name, number
+                                in name_to_number_of_rows.items()])
+        for name, _, number in store.new_names(run):
+            # We have a new name
+            print('New name in rota: %s with %d rows' % (name, number))
 
     return name_to_number_of_rows
 
 
-# Writing functions
-def create_calendars(name_to_list_of_rows_dict, directory):
+def report_changes_since(run, directory):
+    """Print what has changed in the rota since the given previous *run*"""
+    from rota_state import StateStore, report_changes
+    with StateStore(directory) as store:
+        report_changes(store.changes_since(run))
+
+
+# Conflict functions
+def check_conflicts(name_to_list_of_rows_dict, min_rest=MIN_REST):
+    """Print any overlapping shifts, or shifts with less than *min_rest*
+        between them, in the rota information returned by handle_rows"""
+    from rota_model import RotaModel
+    model = RotaModel.from_records(shift_records(name_to_list_of_rows_dict),
+                                   HOURS)
+    check_conflicts_columnar(model, min_rest)
+
+
+def check_conflicts_columnar(model, min_rest=MIN_REST):
+    """Print any overlapping shifts, or shifts with less than *min_rest*
+        between them, in the columnar rota model"""
+    from rota_conflicts import find_conflicts, report_conflicts
+    report_conflicts(find_conflicts(model, min_rest))
+
+
+def check_spilled(spilled, directory, source='', min_rest=MIN_REST):
+    """Check the SpilledRota *spilled* a partition at a time for new names
+        and, unless *min_rest* is None, conflicts"""
+    from rota_conflicts import find_conflicts, report_conflicts
+    from rota_model import RotaModel
+    from rota_state import PartitionDigests
+    counts = {'All': len(spilled.everything)}
+    digests = PartitionDigests(lambda record: record[0], 'All')
+    conflicts = []
+    try:
+        for name_to_list_of_rows_dict in spilled.groups.partitions():
+            counts.update(count_rows(name_to_list_of_rows_dict))
+            records = list(shift_records(name_to_list_of_rows_dict))
+            digests.update(records)
+            if min_rest is not None:
+                model = RotaModel.from_records(records, HOURS)
+                conflicts.extend(find_conflicts(model, min_rest))
+        if min_rest is not None:
+            report_conflicts(sorted(conflicts,
+                                    key=lambda conflict: conflict.name))
+        check_last_names(counts, directory, digests.digests(), source)
+    finally:
+        digests.close()
+
+
+# Working hours functions
+def report_hours(name_to_list_of_rows_dict, directory):
+    """Print a summary of the hours worked by each person in the rota
+        information returned by handle_rows and write their hours in each
+        week to working_hours.csv"""
+    from rota_model import RotaModel
+    model = RotaModel.from_records(shift_records(name_to_list_of_rows_dict),
+                                   HOURS)
+    report_hours_columnar(model, directory)
+
+
+def report_hours_columnar(model, directory):
+    """Print a summary of the hours worked by each person in the columnar
+        rota model and write their hours in each week to working_hours.csv"""
     from os.path import join
+    from rota_hours import (working_hours, report_working_hours,
+                            write_working_hours)
+    working = working_hours(model)
+    report_working_hours(working)
+    write_working_hours(working, join(directory, 'working_hours.csv'))
+
+
+# Writing functions
+def write_calendar(name, cal, writer, rrule=False, compact=False):
+    """Write the calendar *cal* of name with *writer*, with the repeating
+        events as recurring events if *rrule* and in the compact form if
+        *compact*, and return it. The events of a person are sorted by start
+        so that the calendar is the same however the rota was stored, while
+        the calendar of everyone keeps the order of the rota."""
+    from ical_compact import compact_calendar
+    from ical_helper import sort_events
+    from ical_rrule import compress_calendar
+    if name != 'All':
+        cal = sort_events(cal)
+    if rrule:
+        cal = compress_calendar(cal)
+    if compact:
+        cal = compact_calendar(cal)
+    writer.write('rota_%s.ics' % name, cal.to_ical())
+    return cal
+
+
+def write_calendars(name_to_list_of_rows_dict, writer, deltas=None,
+                    dtstamp=None, rrule=False, compact=False):
+    """Write the calendar of each name with *writer* using write_calendar,
+        and its delta calendars with the DeltaWriter *deltas* if given"""
     for name in name_to_list_of_rows_dict:
         rows = name_to_list_of_rows_dict[name]
-        cal = create_calendar_for(rows, 'Simple Rota for %s' % name)
-        with open(join(directory, 'rota_%s.ics' % name), 'wb') as f:
-            f.write(cal.to_ical())
+        cal = create_calendar_for(rows, 'Simple Rota for %s' % name,
+                                  dtstamp)
+        cal = write_calendar(name, cal, writer, rrule, compact)
+        if deltas is not None:
+            deltas.write('rota_%s' % name, cal)
+
+
+def create_calendars(name_to_list_of_rows_dict, directory, delta=False,
+                     dtstamp=None, output=None, rrule=False, compact=False):
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        write_calendars(name_to_list_of_rows_dict, writer, deltas, dtstamp,
+                        rrule, compact)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+def create_calendars_spilled(spilled, directory, delta=False, dtstamp=None,
+                             output=None, rrule=False, compact=False):
+    """Write the calendars of the SpilledRota *spilled* a partition at a
+        time. The calendar of everyone is streamed from disk, unless a delta,
+        recurring or compact events are wanted as they need all of its
+        events."""
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter, stream_calendar
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        if delta or rrule or compact:
+            write_calendars({'All': spilled.everything}, writer, deltas,
+                            dtstamp, rrule, compact)
+        else:
+            events = (create_event_for(row, dtstamp)
+                      for row in spilled.everything)
+            cal = create_calendar_for([], 'Simple Rota for All', dtstamp)
+            writer.write('rota_All.ics',
+                         b''.join(stream_calendar(cal, events)))
+        for name_to_list_of_rows_dict in spilled.groups.partitions():
+            write_calendars(name_to_list_of_rows_dict, writer, deltas,
+                            dtstamp, rrule, compact)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+def columnar_calendars(model, dtstamp=None):
+    """Yields the (name, calendar) of everyone in the columnar rota model,
+        creating the events from its arrays"""
+    # The shifts are in the order of the rows, which the calendar of
+    # everyone keeps
+    groups = [('All', range(len(model)))] if len(model) or model.empty \
+        else []
+    groups += [(name, indices) for (name,), indices in model.group_by('name')]
+    groups += [(name, []) for name, _ in model.empty]
+    names = model.name_codes.tolist()
+    starts = model.starts.tolist()
+    for name, indices in groups:
+        cal = create_calendar_for([], 'Simple Rota for %s' % name, dtstamp)
+        for i in indices:
+            cal.add_component(create_shift_event(model.names[names[i]],
+                                                 starts[i], dtstamp))
+        yield name, cal
+
+
+def create_calendars_columnar(model, directory, delta=False, dtstamp=None,
+                              output=None, rrule=False, compact=False):
+    """Write the calendars using slices of the columnar rota model"""
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        for name, cal in columnar_calendars(model, dtstamp):
+            cal = write_calendar(name, cal, writer, rrule, compact)
+            if deltas is not None:
+                deltas.write('rota_%s' % name, cal)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+# Export functions
+def export_rows(name_to_list_of_rows_dict, fname):
+    """Export the shifts in the rota information returned by handle_rows
+        to the SQLite database or JSON Lines file *fname*"""
+    from rota_model import RotaModel
+    model = RotaModel.from_records(shift_records(name_to_list_of_rows_dict),
+                                   HOURS)
+    export_rows_columnar(model, fname)
+
+
+def export_rows_columnar(model, fname):
+    """Export the shifts in the columnar rota model to the SQLite database or
+        JSON Lines file *fname*"""
+    from rota_export import export_shifts
+    number = export_shifts(model, fname, ROTA, TZ)
+    print('Exported %d shifts to %s' % (number, fname))
 
 
 # Main function
-def parse_file_and_create_calendars(fname, sheet, directory):
+def parse_file_and_create_calendars(fname, sheet, directory, columnar=False,
+                                    changes_since=None, delta=False,
+                                    output=None, cache=False,
+                                    min_rest=MIN_REST, hours=False,
+                                    export=None, spill=False, rrule=False,
+                                    window=None, compact=False):
     from os.path import exists
-    name_to_list_of_rows_dict = read(fname, handle_rows, sheet)
-
+    from ical_helper import source_timestamp
+    if spill and (columnar or cache or hours or export):
+        raise ValueError('Spilling only supports the calendars and the new '
+                         'name and conflict checks')
+    dtstamp = source_timestamp(fname)
     if not exists(directory):
         from os import makedirs
         makedirs(directory)
-    check_last_names(name_to_list_of_rows_dict, directory)
-    create_calendars(name_to_list_of_rows_dict, directory)
+    # The rows outside the window are skipped as they are read, so everyone
+    # with a calendar from the last run keeps it
+    where = date_where(window)
+    kept = published_names(directory) if window is not None else []
+    if spill:
+        with read_spilled(fname, sheet, kept, where) as spilled:
+            check_spilled(spilled, directory, fname, min_rest)
+            create_calendars_spilled(spilled, directory, delta, dtstamp,
+                                     output, rrule, compact)
+        if changes_since is not None:
+            report_changes_since(changes_since, directory)
+        return
+    reader = read if isinstance(sheet, int) else read_sheets
+    if cache:
+        from rota_cache import RotaCache, source_fingerprint
+        rota_cache = RotaCache(directory, fname, sheet, reader,
+                               (source_fingerprint(__file__), columnar,
+                                changes_since, delta, output, min_rest,
+                                hours, export, rrule, window, compact))
+        if rota_cache.unchanged():
+            print('Rota, configuration and calendars unchanged')
+            return
+        read_rows = rota_cache.read
+    else:
+        read_rows = reader
+    if columnar:
+        model = read_rows(fname, handle_rows_columnar, sheet, kept,
+                          where=where)
+    else:
+        name_to_list_of_rows_dict = read_rows(fname, handle_rows, sheet,
+                                              kept, where=where)
+
+    if min_rest is not None:
+        if columnar:
+            check_conflicts_columnar(model, min_rest)
+        else:
+            check_conflicts(name_to_list_of_rows_dict, min_rest)
+
+    if columnar:
+        check_last_names(count_rows_columnar(model), directory,
+                         digest_rows_columnar(model), fname)
+        create_calendars_columnar(model, directory, delta, dtstamp, output,
+                                  rrule, compact)
+    else:
+        check_last_names(count_rows(name_to_list_of_rows_dict), directory,
+                         digest_rows(name_to_list_of_rows_dict), fname)
+        create_calendars(name_to_list_of_rows_dict, directory, delta,
+                         dtstamp, output, rrule, compact)
+    if hours:
+        if columnar:
+            report_hours_columnar(model, directory)
+        else:
+            report_hours(name_to_list_of_rows_dict, directory)
+    if export is not None:
+        if columnar:
+            export_rows_columnar(model, export)
+        else:
+            export_rows(name_to_list_of_rows_dict, export)
+    if changes_since is not None:
+        report_changes_since(changes_since, directory)
+    if cache:
+        rota_cache.save()
 
 
 # ___________________________________ MAIN ___________________________________
 if __name__ == '__main__':
     from argparse import ArgumentParser
+    from xlrd_helper import sheet_spec
+    from rota_window import window_spec
     parser = ArgumentParser(description='Simple Rota reader')
 
     parser.add_argument('filename',
@@ -176,10 +618,100 @@ if __name__ == '__main__':
 
     parser.add_argument('--sheet',
                         nargs='?',
-                        type=int,
-                        help='excel spreadsheet id',
+                        type=sheet_spec,
+                        help='excel spreadsheet id, a list or range of ids '
+                             'such as 0,2-4 or all',
                         default=0)
 
+    parser.add_argument('--columnar',
+                        action='store_true',
+                        help='use the columnar rota model')
+
+    parser.add_argument('--changes-since',
+                        type=int,
+                        help='report the changes since this previous run',
+                        default=None)
+
+    parser.add_argument('--delta',
+                        action='store_true',
+                        help='also write calendars of the changed events')
+
+    parser.add_argument('--archive',
+                        help='write the calendars into this zip or tar file',
+                        default=None)
+
+    parser.add_argument('--gzip',
+                        choices=['also', 'only'],
+                        help='also or only write gzip compressed calendars',
+                        default=None)
+
+    parser.add_argument('--gzip-level',
+                        type=int,
+                        help='gzip compression level',
+                        default=9)
+
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='cache the parsed rota and skip unchanged runs')
+
+    parser.add_argument('--min-rest',
+                        type=float,
+                        help='report rests between shifts shorter than this '
+                             'many hours',
+                        default=11)
+
+    parser.add_argument('--no-conflicts',
+                        action='store_true',
+                        help='do not check for overlapping shifts')
+
+    parser.add_argument('--hours',
+                        action='store_true',
+                        help='report the hours worked by each person')
+
+    parser.add_argument('--export',
+                        help='export the shifts to this SQLite database or '
+                             '.jsonl file',
+                        default=None)
+
+    parser.add_argument('--spill',
+                        action='store_true',
+                        help='group the rows in temporary files rather than '
+                             'in memory')
+
+    parser.add_argument('--rrule',
+                        action='store_true',
+                        help='write repeating shifts as recurring events')
+
+    parser.add_argument('--window',
+                        type=window_spec,
+                        help='only the shifts from START up to END - dates, '
+                             'today or offsets from today such as '
+                             '--window=-30d:+12m',
+                        metavar='START:END',
+                        default=None)
+
+    parser.add_argument('--compact',
+                        action='store_true',
+                        help='write smaller calendars without the repeated '
+                             'text and properties')
+
     args = parser.parse_args()
 
-    parse_file_and_create_calendars(args.filename, args.sheet, args.directory)
+    parse_file_and_create_calendars(args.filename,
+                                    args.sheet,
+                                    args.directory,
+                                    args.columnar,
+                                    args.changes_since,
+                                    args.delta,
+                                    {'archive': args.archive,
+                                     'gzip': args.gzip,
+                                     'compresslevel': args.gzip_level},
+                                    args.cache,
+                                    None if args.no_conflicts
+                                    else timedelta(hours=args.min_rest),
+                                    args.hours,
+                                    args.export,
+                                    args.spill,
+                                    args.rrule,
+                                    args.window,
+                                    args.compact)
@@ -3,11 +3,220 @@
 
 This file provides two main classes: Reader and DictReader which are
 reimplementations of their csv counterparts
+
+Opened workbooks are kept in a small process-wide cache, keyed by the path,
+modification time and size of the file, so readers of the same unchanged file
+share a single parsed book. A reader only loads the sheet it reads, the other
+sheets of an xls workbook are never parsed.
+
+A rota can also be read from memory - bytes, a memoryview or a file-like
+object - with sniff_format telling an excel workbook from a csv file by its
+first bytes.
+
+Several sheets of a workbook are read in parallel, one process per sheet,
+with map_sheets - each process loading just its own sheet.
 """
+import io
+import os
 import xlrd
 import mmap
+import threading
 from collections import OrderedDict
 
+EMPTY_CELL = xlrd.sheet.Cell(xlrd.XL_CELL_EMPTY, '')
+
+# The number of parsed workbooks kept in the cache
+BOOK_CACHE_SIZE = 8
+
+_books = OrderedDict()
+_books_lock = threading.Lock()
+_loading = {}
+
+# The first bytes of each format of file
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP_MAGIC = b'PK\x03\x04'
+BIFF_MAGICS = (b'\x09\x00', b'\x09\x02', b'\x09\x04', b'\x09\x08')
+
+BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+
+def _head(source, size=8):
+    """Returns the first *size* bytes of the buffer or seekable binary file
+        *source* without moving its position"""
+    if isinstance(source, BUFFER_TYPES):
+        return bytes(source[:size])
+    position = source.tell()
+    try:
+        return source.read(size)
+    finally:
+        source.seek(position)
+
+
+def sniff_format(source):
+    """Returns 'xls', 'xlsx' or 'csv' for the format of the rota in the
+        bytes, memoryview or seekable binary file *source*, from its first
+        bytes"""
+    head = _head(source)
+    if head.startswith(OLE2_MAGIC) or head.startswith(BIFF_MAGICS):
+        return 'xls'
+    if head.startswith(ZIP_MAGIC):
+        return 'xlsx'
+    return 'csv'
+
+
+def _open_workbook(contents, sheets, *args, **kwargs):
+    """Parse the workbook in the bytes-like *contents*: every sheet if
+        *sheets* is None, otherwise only the sheets at the indices in
+        *sheets* - none for an empty list - which are all that can be read
+        from the returned book"""
+    if sheets is None:
+        return xlrd.open_workbook(file_contents=contents,
+                                  ragged_rows=True,
+                                  *args,
+                                  **kwargs)
+    book = xlrd.open_workbook(file_contents=contents,
+                              ragged_rows=True,
+                              on_demand=True,
+                              *args,
+                              **kwargs)
+    for index in sheets:
+        book.sheet_by_index(index)
+    # The loaded sheets are kept, the contents are not needed for them
+    book.release_resources()
+    return book
+
+
+def _parse_book(f, sheets, *args, **kwargs):
+    """Parse the *sheets* of the workbook in the open file *f*"""
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _open_workbook(data, sheets, *args, **kwargs)
+
+
+def _contents(f):
+    """Returns the bytes-like contents of the buffer or file-like object *f*
+        that xlrd can slice, copying only when it must"""
+    if isinstance(f, memoryview):
+        # xlrd concatenates slices, which memoryviews do not support, so use
+        # the bytes underneath a view of all of them
+        if isinstance(f.obj, (bytes, mmap.mmap)) and f.nbytes == len(f.obj):
+            return f.obj
+        return f.tobytes()
+    if isinstance(f, (bytes, bytearray)):
+        return f
+    if isinstance(f, io.BytesIO):
+        # Shares the buffer of the BytesIO rather than copying it
+        return f.getvalue()
+    return f.read()
+
+
+def _parse_buffer(f, sheets, *args, **kwargs):
+    """Parse the *sheets* of the workbook in the buffer or file-like object
+        *f*"""
+    return _open_workbook(_contents(f), sheets, *args, **kwargs)
+
+
+def _has_fileno(f):
+    try:
+        f.fileno()
+    except (AttributeError, OSError, ValueError):
+        return False
+    return True
+
+
+def open_book(f, *args, sheets=None, **kwargs):
+    """Returns the parsed workbook of the open file *f*, which may also be
+        bytes, a memoryview or a file-like object without a file descriptor.
+        Only the sheets at the indices in *sheets* are loaded, if it is
+        given - an xls workbook is then opened on demand and its other
+        sheets are never parsed.
+
+        If *f* is a file with a name the book is shared with any other
+        reader of the same unchanged file, it is only parsed again when the
+        file's modification time or size changes. The least recently used
+        books are dropped from the cache once it has more than
+        BOOK_CACHE_SIZE books."""
+    if sheets is not None:
+        sheets = tuple(sheets)
+    if isinstance(f, BUFFER_TYPES) or not _has_fileno(f):
+        return _parse_buffer(f, sheets, *args, **kwargs)
+    name = getattr(f, 'name', None)
+    if not isinstance(name, str) or args:
+        return _parse_book(f, sheets, *args, **kwargs)
+    stat = os.fstat(f.fileno())
+    key = (os.path.realpath(name), stat.st_mtime_ns, stat.st_size, sheets,
+           tuple(sorted(kwargs.items())))
+
+    with _books_lock:
+        if key in _books:
+            _books.move_to_end(key)
+            return _books[key]
+        # Only one thread parses each book, the others wait for it
+        lock = _loading.setdefault(key, threading.Lock())
+
+    with lock:
+        with _books_lock:
+            if key in _books:
+                return _books[key]
+        book = _parse_book(f, sheets, **kwargs)
+        with _books_lock:
+            _books[key] = book
+            _loading.pop(key, None)
+            while len(_books) > BOOK_CACHE_SIZE:
+                _books.popitem(last=False)
+    return book
+
+
+def clear_book_cache():
+    """Drop every parsed workbook from the cache"""
+    with _books_lock:
+        _books.clear()
+
+
+def sheet_spec(text):
+    """Parses a --sheet option: a sheet index, 'all' or a list of indices
+        and ranges such as '0,2-4'. Returns the index of a single sheet,
+        'all' or a list of indices, each only once - in the order first
+        given - so that no sheet is read twice."""
+    if text.strip().lower() == 'all':
+        return 'all'
+    sheets = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        if last:
+            sheets.extend(range(int(first), int(last) + 1))
+        else:
+            sheets.append(int(first))
+    sheets = list(dict.fromkeys(sheets))
+    return sheets[0] if len(sheets) == 1 else sheets
+
+
+def sheet_indices(fname, sheets):
+    """Returns the list of sheet indices of the --sheet option *sheets* for
+        the excel file *fname*, without duplicates"""
+    if sheets == 'all':
+        # The number of sheets without loading any of them
+        with open(fname, 'rb') as f:
+            return list(range(open_book(f, sheets=()).nsheets))
+    if isinstance(sheets, int):
+        return [sheets]
+    return list(dict.fromkeys(sheets))
+
+
+def map_sheets(read, fname, handler, sheets, *args, **kwds):
+    """Returns a list of the results of read(fname, handler, sheet) for each
+        of *sheets*, in order, reading each sheet in a separate process.
+        Optional and named parameters are passed to read and so to the
+        handler, which must be a module level function so that it can be
+        pickled."""
+    if len(sheets) == 1:
+        return [read(fname, handler, sheets[0], *args, **kwds)]
+    from concurrent.futures import ProcessPoolExecutor
+    workers = min(len(sheets), os.cpu_count() or 1)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(read, fname, handler, sheet, *args, **kwds)
+                   for sheet in sheets]
+        return [future.result() for future in futures]
+
 
 def cell_value_converter(cell, *args, **kwds):
     """Returns the value of a given cell."""
@@ -33,9 +242,26 @@ def auto_converter(cell, book=None, date_format='%Y/%m/%d', *args, **kwds):
         return str(cell.value).strip()
 
 
+class _Cursor:
+    """An iteration over the (row index, row) pairs *numbered*, giving the
+        rows and keeping the sheet row index of the last one in row_num"""
+
+    def __init__(self, numbered):
+        self.numbered = numbered
+        self.row_num = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.row_num, row = next(self.numbered)
+        return row
+
+
 class Reader:
     """ Provides a Reader object that will iterate over the rows in the given
-    *excelfile*.  An optional *sheet_index* parameter for the sheet_index can
+    *excelfile* - an open file, bytes, a memoryview or a file-like object.
+    An optional *sheet_index* parameter for the sheet_index can
     be provided, as can a *converter* parameter to convert the cell to a useful
     value. The other optional *args and **fmtparams can be given to pass values
     to the converter.
@@ -44,6 +270,13 @@ class Reader:
     run on each, and is passed the cell, and named parameters: sheet, book, i,
     and j in additional to the *args and **fmtparams.
 
+    Only part of the sheet can be read by giving the indices of the *columns*
+    wanted, a *rows* range or slice of the row indices, and a *where* pair of
+    a column index and a predicate on its converted value. Only the cells of
+    the rows and columns used are converted - the *where* column first - and
+    cells after the end of a row are not converted but given the value of an
+    empty cell.
+
     A short usage example::
 
     >>> import xlrd_helper
@@ -56,33 +289,90 @@ class Reader:
 
 
     If cell is required rather than just the value a *converter* of
-    `lambda x : x` will suffice."""
+    `lambda x : x` will suffice.
+
+    Readers of the same file share the parsed book from :func:`open_book`,
+    which is never changed, and each iteration over a Reader is a separate
+    cursor with the index of its current row in row_num - so readers can be
+    used from several threads at once::
+
+    >>> rows = iter(spamreader)
+    >>> for row in rows:
+    ...     print(rows.row_num, row[1])
+    0 Spam
+    1 Lovely Spam"""
 
     def __init__(self, f, sheet_index=0, converter=auto_converter, *args,
-                 **kwargs):
+                 columns=None, rows=None, where=None, **kwargs):
         self.f = f
         self.sheet_index = sheet_index
         self.converter = converter
-        self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        self.book = xlrd.open_workbook(file_contents=self.data,
-                                       *args,
-                                       **kwargs)
+        self.book = open_book(f, *args, sheets=(sheet_index,), **kwargs)
         self.sheet = self.book.sheet_by_index(sheet_index)
-        self.row_num = 0
+        self.columns = columns
+        self.rows = rows
+        self.where = where
         self.args = args
         self.kwargs = kwargs
+        self._empty = None
+        self._empty_lock = threading.Lock()
+
+    def convert(self, i, j):
+        """Returns the converted value of the cell in row *i* and column *j*,
+            which is the value of an empty cell after the end of the row"""
+        if j >= self.sheet.row_len(i):
+            with self._empty_lock:
+                if self._empty is None:
+                    self._empty = self.converter(EMPTY_CELL,
+                                                 book=self.book,
+                                                 sheet=self.sheet,
+                                                 i=i,
+                                                 j=j,
+                                                 *self.args,
+                                                 **self.kwargs)
+                return self._empty
+        return self.converter(self.sheet.cell(i, j),
+                              book=self.book,
+                              sheet=self.sheet,
+                              i=i,
+                              j=j,
+                              *self.args,
+                              **self.kwargs)
+
+    def row(self, i, columns=None):
+        """Returns the converted values of the *columns* (default all) of row
+            *i*"""
+        if columns is None:
+            columns = range(self.sheet.ncols)
+        return [self.convert(i, j) for j in columns]
+
+    def row_indices(self, rows=None):
+        """Returns the range of the row indices in the slice or range *rows*
+            (default all rows) of the sheet"""
+        indices = range(self.sheet.nrows)
+        if rows is None:
+            return indices
+        if isinstance(rows, range):
+            rows = slice(rows.start, rows.stop, rows.step)
+        return indices[rows]
+
+    def numbered(self, rows=None, columns=None, where=None):
+        """Yields the (row index, row) pairs of the converted *columns* of the
+            *rows* of the sheet for which the predicate of the (column,
+            predicate) pair *where* is true"""
+        for i in self.row_indices(rows):
+            if where is not None and not where[1](self.convert(i, where[0])):
+                continue
+            yield i, self.row(i, columns)
+
+    def select(self, rows=None, columns=None, where=None):
+        """Returns a cursor over the rows of :meth:`numbered`, with the row
+            index of the current row in its row_num"""
+        return _Cursor(self.numbered(rows, columns, where))
 
     def __iter__(self):
-        for i, row in enumerate(self.sheet.get_rows()):
-            self.row_num = i
-            yield [self.converter(cell,
-                                  book=self.book,
-                                  sheet=self.sheet,
-                                  i=i,
-                                  j=j,
-                                  *self.args,
-                                  **self.kwargs)
-                   for j, cell in enumerate(row)]
+        return self.select(self.rows, self.columns, self.where)
+
 
 class DictReader:
     """Creates an object that operates like a csv.DictReader but acting on an
@@ -92,7 +382,7 @@ class DictReader:
 
         The *fieldnames* parameter is a :term: `sequence`. If *fieldnames* is
         omitted, the values in the first non-blank row of the excel sheet will
-        be used as the fieldnames.
+        be used as the fieldnames, read again by each iteration.
 
         If a row has more fields than fieldnames, the remaining data is placed
         in a list and stored with the fieldname specified by *restkey* (which
@@ -100,8 +390,15 @@ class DictReader:
         fieldnames, the missing values are filled with *restval* (which
         defaults to ``None``).
 
+        The *columns* parameter selects the fields wanted by fieldname or
+        index, *rows* is a range or slice of the row indices of the sheet and
+        *where* is a pair of a fieldname (or index) and a predicate on its
+        value - see :class:`Reader`. Only the fields selected are in each
+        row.
+
         All other optional or keyword arguments are passed to the underlying
-        :class:`Reader` instance.
+        :class:`Reader` instance. As for a Reader each iteration is a cursor
+        with the sheet row index of its current row in row_num.
 
         A short usage example::
 
@@ -113,35 +410,61 @@ class DictReader:
         Eric Idle
         John Cleese"""
     def __init__(self, f, fieldnames=None, restkey=None, restval=None,
-                 sheet_index=0, *args, **kwds):
-        self._fieldnames = fieldnames
+                 sheet_index=0, *args, columns=None, rows=None, where=None,
+                 **kwds):
+        self.fieldnames = fieldnames
+        self._header = fieldnames is None
         self.restkey = restkey
+        self.restval = restval
         self.reader = Reader(f, sheet_index, *args, **kwds)
-        self.row_num = self.reader.row_num
-
-    @property
-    def fieldnames(self):
-        self.row_num = self.reader.row_num
-        return self._fieldnames
+        self.columns = columns
+        self.rows = rows
+        self.where = where
 
-    @fieldnames.setter
-    def fieldnames(self, value):
-        self._fieldnames = value
+    @staticmethod
+    def _index(field, fieldnames):
+        """Returns the column index of the fieldname or index *field*"""
+        if isinstance(field, int):
+            return field
+        return list(fieldnames).index(field)
 
     def __iter__(self):
-        for row in self.reader:
-            if row == []:
-                pass
-            self.row_num = self.reader.row_num
-            if self.fieldnames is None:
-                self._fieldnames = row
+        return _Cursor(self._numbered())
+
+    def _numbered(self):
+        if self.columns is None and self.rows is None and self.where is None:
+            yield from self._numbered_all()
+            return
+
+        rows = self.reader.row_indices(self.rows)
+        fieldnames = self.fieldnames
+        if self._header:
+            fieldnames = self.fieldnames = self.reader.row(0)
+            rows = rows[1:] if rows and rows[0] == 0 else rows
+        columns = self.columns
+        if columns is None:
+            columns = range(len(fieldnames))
+        columns = [self._index(column, fieldnames) for column in columns]
+        keys = [fieldnames[j] if j < len(fieldnames)
+                else self.restkey for j in columns]
+        where = None
+        if self.where is not None:
+            where = (self._index(self.where[0], fieldnames), self.where[1])
+        for i, row in self.reader.numbered(rows, columns, where):
+            yield i, OrderedDict(zip(keys, row))
+
+    def _numbered_all(self):
+        fieldnames = None if self._header else self.fieldnames
+        for i, row in self.reader.numbered():
+            if fieldnames is None:
+                fieldnames = self.fieldnames = row
             else:
-                d = OrderedDict(zip(self.fieldnames, row))
-                len_fieldnames = len(self.fieldnames)
+                d = OrderedDict(zip(fieldnames, row))
+                len_fieldnames = len(fieldnames)
                 len_row = len(row)
                 if len_fieldnames < len_row:
                     d[self.restkey] = row[len_fieldnames:]
                 elif len_fieldnames > len_row:
-                    for key in self.fieldnames[len_row:]:
+                    for key in fieldnames[len_row:]:
                         d[key] = self.restval
-                yield d
+                yield i, d
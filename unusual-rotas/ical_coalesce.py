@@ -0,0 +1,101 @@
+"""Merge whole day events on consecutive days into multi-day events.
+
+
+This file provides coalesce_calendar which finds runs of whole day events in
+a calendar - a consultant on for a week, say - that are for the same person
+and role and follow straight on from each other, and replaces each run with
+a single event lasting all of its days. If the descriptions of the days in a
+run differ, for example because different staff are on with them each day,
+the merged event lists the description of every day.
+
+A short usage example::
+
+>>> import ical_coalesce
+>>> cal = ical_coalesce.coalesce_calendar(create_calendar_for(...))
+>>> print(cal.to_ical().decode())
+...
+SUMMARY:Consultant: Jones
+DTSTART;VALUE=DATE:20180212
+DURATION:P5D
+...
+"""
+from datetime import date
+
+# These properties differ between the days of a run
+VARYING_PROPERTIES = ('UID', 'DTSTART', 'DTEND', 'DURATION', 'DTSTAMP',
+                      'SEQUENCE', 'SUMMARY', 'DESCRIPTION')
+
+
+def summary_of(event):
+    """Returns the summary of *event* - the default key of coalesce_calendar"""
+    return str(event.get('SUMMARY', ''))
+
+
+def _length(event, start):
+    if 'DTEND' in event:
+        return event.decoded('DTEND') - start
+    return event.decoded('DURATION')
+
+
+def _run_key(event, key):
+    lines = tuple(str(line) for line in event.content_lines()
+                  if not str(line).startswith(VARYING_PROPERTIES))
+    return key(event), lines
+
+
+def merged_event(run, title):
+    """Returns the first of the whole day events in *run*, which follow on
+        from each other, changed to last all of their days. If their
+        descriptions differ its summary is *title* and its description has
+        the description of each day."""
+    first = run[0]
+    start = first.decoded('DTSTART')
+    last = run[-1]
+    end = last.decoded('DTSTART') + _length(last, last.decoded('DTSTART'))
+    for name in ('DTEND', 'DURATION'):
+        if name in first:
+            del first[name]
+    first.add('duration', end - start)
+
+    descriptions = [str(event.get('DESCRIPTION', '')) for event in run]
+    if len(set(descriptions)) > 1:
+        del first['SUMMARY']
+        first.add('summary', title)
+        del first['DESCRIPTION']
+        first.add('description', '\n'.join(
+            '%s: %s' % (event.decoded('DTSTART').isoformat(), description)
+            for event, description in zip(run, descriptions)))
+    return first
+
+
+def coalesce_calendar(cal, key=summary_of):
+    """Merge each run of whole day events in calendar *cal* on consecutive
+        days with the same *key* - a function of the event giving its person
+        and role, by default its summary - and otherwise the same properties
+        into one event, in place, and return it. The merged event takes the
+        place and the UID of the first day of the run."""
+    groups = {}
+    for event in cal.subcomponents:
+        if event.name == 'VEVENT' and 'RRULE' not in event and \
+                type(event.decoded('DTSTART')) is date:
+            groups.setdefault(_run_key(event, key), []).append(event)
+
+    removed = set()
+    for (title, _), events in groups.items():
+        events.sort(key=lambda event: event.decoded('DTSTART'))
+        runs = []
+        end = None
+        for event in events:
+            start = event.decoded('DTSTART')
+            if start != end:
+                runs.append([])
+            runs[-1].append(event)
+            end = start + _length(event, start)
+        for run in runs:
+            if len(run) > 1:
+                merged_event(run, title)
+                removed.update(id(event) for event in run[1:])
+
+    cal.subcomponents = [component for component in cal.subcomponents
+                         if id(component) not in removed]
+    return cal
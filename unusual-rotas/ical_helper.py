@@ -0,0 +1,225 @@
+"""Functions to help create and publish icalendar files.
+
+
+This file provides event_uid which gives an event a stable identity, so that
+the same shift gets the same UID every time a rota is converted,
+source_timestamp which gives a DTSTAMP that only changes when the rota file
+does, sort_events which puts the events of a calendar in a fixed order,
+stream_calendar which gives the bytes of a calendar an event at a time, and
+DeltaWriter which writes calendars containing only the events that have
+been added, changed or removed since the previous run.
+"""
+import os
+import uuid
+import hashlib
+from datetime import date, datetime, time
+from os.path import getmtime
+import pytz
+from icalendar import Calendar, Event
+
+PRODID = '-//hacksw/handcal/NONSGML v1.0//EN'
+
+UID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL,
+                           'https://zeripath.github.io/sample-rota-converters')
+
+# These properties change from run to run and are not part of the event
+VOLATILE_PROPERTIES = (b'UID', b'DTSTAMP', b'SEQUENCE')
+
+# The suffixes of the delta calendars of added and changed events and of
+# removed events
+DELTA_SUFFIXES = ('delta', 'cancel')
+
+
+def event_uid(*identity):
+    """Returns a UID for the event identified by *identity*, for example
+        (rota, name, role, day). The same identity always gives the same
+        UID."""
+    parts = []
+    for part in identity:
+        if isinstance(part, datetime):
+            part = part.date()
+        if isinstance(part, date):
+            part = part.isoformat()
+        parts.append(str(part))
+    return str(uuid.uuid5(UID_NAMESPACE, '\x1f'.join(parts)))
+
+
+def source_timestamp(fname):
+    """Returns the modification time of the file *fname* as a UTC datetime,
+        suitable for use as the DTSTAMP of the events created from it"""
+    return datetime.fromtimestamp(int(getmtime(fname)), pytz.utc)
+
+
+def event_digest(event):
+    """Returns a hex digest of the content of the *event* ignoring the
+        properties that change from run to run"""
+    h = hashlib.sha1()
+    for line in event.to_ical().splitlines():
+        if not line.startswith(VOLATILE_PROPERTIES):
+            h.update(line)
+            h.update(b'\n')
+    return h.hexdigest()
+
+
+def new_calendar(title, method=None):
+    """Create an empty calendar called *title* with an optional *method*"""
+    cal = Calendar()
+    cal.add('prodid', PRODID)
+    cal.add('version', '2.0')
+    if method is not None:
+        cal.add('method', method)
+    cal.add('x-wr-calname', title)
+    return cal
+
+
+def event_start(event):
+    """Returns the local wall clock start of *event* as a naive datetime,
+        midnight for a whole day event"""
+    start = event.decoded('DTSTART')
+    if not isinstance(start, datetime):
+        start = datetime.combine(start, time())
+    return start.replace(tzinfo=None)
+
+
+def sort_events(cal):
+    """Sort the events of calendar *cal* by start and UID, in place, and
+        return it - the same shifts then give the same calendar however they
+        were grouped"""
+    events = [component for component in cal.subcomponents
+              if component.name == 'VEVENT']
+    events.sort(key=lambda event: (event_start(event), str(event['UID'])))
+    cal.subcomponents = [component for component in cal.subcomponents
+                         if component.name != 'VEVENT'] + events
+    return cal
+
+
+def stream_calendar(cal, events):
+    """Yields the bytes of the calendar *cal* with each of *events* added,
+        the same as cal.to_ical() but without holding every event in memory
+        at once"""
+    end = b'END:VCALENDAR\r\n'
+    header = cal.to_ical()
+    yield header[:-len(end)]
+    for event in events:
+        yield event.to_ical()
+    yield end
+
+
+def cancel_event_for(event, sequence, dtstamp=None):
+    """Create a cancellation for the previously published *event*"""
+    cancel = Event()
+    cancel['uid'] = event['UID']
+    cancel['dtstart'] = event['DTSTART']
+    if 'SUMMARY' in event:
+        cancel['summary'] = event['SUMMARY']
+    cancel.add('dtstamp', dtstamp or datetime.now())
+    cancel.add('sequence', sequence)
+    cancel.add('status', 'CANCELLED')
+    return cancel
+
+
+def delta_calendars_for(store, stem, cal, dtstamp=None):
+    """Compare the events in *cal* with those published for *stem* in the
+        previous run, recording the new events in the *store*. Returns a
+        calendar of the added and changed events (METHOD:REQUEST) and one of
+        the removed events (METHOD:CANCEL), either may be None if empty."""
+    title = str(cal.get('X-WR-CALNAME', stem))
+    events = {}
+    for event in cal.walk('VEVENT'):
+        events[str(event['UID'])] = event
+
+    requests, cancels = store.update_events(
+        stem,
+        [(uid, event_digest(event), event.to_ical())
+         for uid, event in events.items()])
+
+    # The time zones of a compact calendar are needed by its deltas too
+    timezones = cal.walk('VTIMEZONE')
+
+    request_cal = None
+    if requests:
+        request_cal = new_calendar(title, 'REQUEST')
+        request_cal.subcomponents.extend(timezones)
+        for uid, sequence in requests:
+            event = events[uid]
+            if 'SEQUENCE' in event:
+                del event['SEQUENCE']
+            event.add('sequence', sequence)
+            request_cal.add_component(event)
+
+    cancel_cal = None
+    if cancels:
+        cancel_cal = new_calendar(title, 'CANCEL')
+        cancel_cal.subcomponents.extend(timezones)
+        for uid, sequence, ical in cancels:
+            cancel_cal.add_component(
+                cancel_event_for(Event.from_ical(ical), sequence, dtstamp))
+
+    return request_cal, cancel_cal
+
+
+def delta_stems(directory):
+    """Returns the set of stems of the delta calendars in *directory*"""
+    stems = set()
+    for fname in os.listdir(directory):
+        if fname.endswith('.gz'):
+            fname = fname[:-len('.gz')]
+        for suffix in DELTA_SUFFIXES:
+            if fname.endswith('.%s.ics' % suffix):
+                stems.add(fname[:-len('.%s.ics' % suffix)])
+    return stems
+
+
+class DeltaWriter:
+    """Writes the delta calendars of the calendars of a run as stem.delta.ics
+        and stem.cancel.ics with the CalendarWriter *writer*, comparing them
+        with the events published in the previous run.
+
+        Call :meth:`write` for each calendar and :meth:`close` once all of
+        them are written: the events of calendars from earlier runs that
+        are not in this one - people who have left the rota - are then
+        cancelled and the delta files with no changes in this run are
+        removed so that they are not imported again. The new events are
+        only committed to the state store once *writer* has closed and
+        every file has been written."""
+
+    def __init__(self, writer, dtstamp=None):
+        from rota_state import StateStore
+        self.writer = writer
+        self.dtstamp = dtstamp
+        self.store = StateStore(writer.directory)
+        self.stems = set()
+        writer.after_close(self._finish)
+
+    def write(self, stem, cal):
+        """Write the delta calendars of the calendar *cal* published as
+            stem.ics"""
+        self.stems.add(stem)
+        request_cal, cancel_cal = delta_calendars_for(self.store, stem, cal,
+                                                      self.dtstamp)
+        for suffix, delta_cal in zip(DELTA_SUFFIXES,
+                                     (request_cal, cancel_cal)):
+            fname = '%s.%s.ics' % (stem, suffix)
+            if delta_cal is not None:
+                self.writer.write(fname, delta_cal.to_ical())
+            else:
+                self.writer.remove(fname)
+
+    def close(self):
+        """Cancel the events of the calendars published before but not
+            written in this run and remove the stale delta files"""
+        for stem in self.store.calendars():
+            if stem not in self.stems:
+                self.write(stem, new_calendar(stem))
+        for stem in delta_stems(self.writer.directory) - self.stems:
+            for suffix in DELTA_SUFFIXES:
+                self.writer.remove('%s.%s.ics' % (stem, suffix))
+
+    def _finish(self, written):
+        try:
+            if written:
+                self.store.commit()
+            else:
+                self.store.rollback()
+        finally:
+            self.store.close()
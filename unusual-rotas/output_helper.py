@@ -0,0 +1,461 @@
+"""Classes to help write the generated calendars safely and quickly.
+
+
+This file provides the CalendarWriter class which writes each file to a
+temporary file in the same directory and atomically renames it into place, so
+that subscribers never see a half-written calendar. Files whose content has
+not changed are left alone and the writes are run in a bounded thread pool to
+overlap the latency of slow (e.g. NFS mounted) file-systems.
+
+It also provides the ArchiveWriter class which streams every file into a
+single zip or tar archive with a manifest of their sizes and hashes, so that
+the output can be published in one transfer. Use open_writer to get the
+writer for the chosen output mode.
+
+Both writers can also write a gzip compressed copy of each file as
+fname.gz, alongside or instead of the plain file, for static web servers that
+send precompressed files directly.
+
+A short usage example::
+
+>>> import output_helper
+>>> with output_helper.CalendarWriter('generated') as writer:
+...     writer.write('rota_All.ics', cal.to_ical())
+>>> print(writer.written, writer.unchanged)
+1 0
+"""
+import io
+import os
+import json
+import tarfile
+import zipfile
+import hashlib
+import tempfile
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from gzip import GzipFile
+from os.path import basename, join
+
+BUFFER_SIZE = 1 << 20
+WORKERS = 4
+
+ARCHIVE_FORMATS = {
+    '.zip': 'zip',
+    '.tar': 'w',
+    '.tar.gz': 'w:gz',
+    '.tgz': 'w:gz',
+    '.tar.bz2': 'w:bz2',
+    '.tar.xz': 'w:xz',
+}
+MANIFEST = 'manifest.json'
+
+GZIP_MODES = (None, 'also', 'only')
+COMPRESS_LEVEL = 9
+
+
+def _current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def file_digest(fname, buffer_size=BUFFER_SIZE):
+    """Returns the sha1 hex digest of the file *fname* or None if it does not
+        exist"""
+    h = hashlib.sha1()
+    try:
+        with open(fname, 'rb', buffering=0) as f:
+            for chunk in iter(lambda: f.read(buffer_size), b''):
+                h.update(chunk)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def gzip_compress(data, compresslevel=COMPRESS_LEVEL,
+                  buffer_size=BUFFER_SIZE):
+    """Returns the gzip compression of the bytes *data*, compressed a buffer
+        at a time. The header has no timestamp so the same data always gives
+        the same bytes."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    view = memoryview(data)
+    chunks = [compressor.compress(view[i:i + buffer_size])
+              for i in range(0, len(view), buffer_size)]
+    chunks.append(compressor.flush())
+    return b''.join(chunks)
+
+
+def _replace_file(path, data, mode):
+    """Write the bytes *data* to a temporary file next to *path* and
+        atomically rename it over *path*"""
+    directory, fname = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(dir=directory or '.', prefix='.%s.' % fname,
+                               suffix='.tmp')
+    try:
+        with open(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class _DigestWriter:
+    """Passes the bytes written to it on to the file *f*, counting them and
+        taking their sha1"""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.size += len(data)
+        self.sha1.update(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+class _Encoder:
+    """Mixin that works out the files to write for the chosen *gzip* mode,
+        keeps count of the plain and compressed sizes and calls the
+        after_close callbacks"""
+
+    def _init_encoding(self, gzip, compresslevel):
+        if gzip not in GZIP_MODES:
+            raise ValueError('Unknown gzip mode: %s' % gzip)
+        self.gzip = gzip
+        self.compresslevel = compresslevel
+        self.lock = threading.Lock()
+        self.plain_bytes = 0
+        self.compressed_bytes = 0
+        self.written = 0
+        self.unchanged = 0
+        self.callbacks = []
+
+    def _count(self, attribute, amount=1):
+        with self.lock:
+            setattr(self, attribute, getattr(self, attribute) + amount)
+
+    def _encodings(self, fname, data):
+        """Returns the (fname, bytes) pairs to write for *data*"""
+        if self.gzip is None:
+            return [(fname, data)]
+        compressed = gzip_compress(data, self.compresslevel)
+        self._count('plain_bytes', len(data))
+        self._count('compressed_bytes', len(compressed))
+        if self.gzip == 'only':
+            return [(fname + '.gz', compressed)]
+        return [(fname, data), (fname + '.gz', compressed)]
+
+    def _names(self, fname):
+        """Returns the names of the files that would be written for fname"""
+        names = [] if self.gzip == 'only' else [fname]
+        if self.gzip is not None:
+            names.append(fname + '.gz')
+        return names
+
+    def after_close(self, callback):
+        """Call *callback* with True once the writer has closed and every
+            file has been written, or with False if the writing failed"""
+        self.callbacks.append(callback)
+
+    def _closed(self, written):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(written)
+
+    def report(self):
+        """Returns a short report of what was written"""
+        report = 'Wrote %d files, %d unchanged' % (self.written,
+                                                   self.unchanged)
+        if self.compressed_bytes:
+            report += '; compressed %d to %d bytes (ratio %.1f:1)' % (
+                self.plain_bytes, self.compressed_bytes,
+                self.plain_bytes / self.compressed_bytes)
+        return report
+
+
+class CalendarWriter(_Encoder):
+    """Provides a writer of files in *directory*. Each call to :meth:`write`
+        is queued to a pool of *workers* threads which write the data to a
+        temporary file with a buffer of *buffer_size* bytes and rename it over
+        the target - unless the target already has the same content.
+
+        If *gzip* is 'also' a copy compressed at *compresslevel* is written as
+        fname.gz next to each file, if it is 'only' just the compressed copy
+        is written. The compression is done in the writing threads, straight
+        into the temporary file.
+
+        At most *pending* writes - by default twice the workers - are queued
+        at once; :meth:`write` waits for one to finish before queueing more
+        so that the data of every calendar is not held in memory.
+
+        Use the writer as a context manager: on exit every queued write has
+        finished and the first error, if any, is raised. If the block raised
+        the writer is aborted instead."""
+
+    def __init__(self, directory, workers=WORKERS, buffer_size=BUFFER_SIZE,
+                 fsync=True, gzip=None, compresslevel=COMPRESS_LEVEL,
+                 pending=None):
+        self._init_encoding(gzip, compresslevel)
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self.mode = 0o666 & ~_current_umask()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = pending or 2 * workers
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self, fname, data):
+        """Queue the writing of the bytes *data* to *fname* in the directory"""
+        self._submit(self._write, fname, data)
+
+    def remove(self, fname):
+        """Queue the removal of *fname* in the directory if it exists"""
+        for name in self._names(fname):
+            self._submit(self._remove, name)
+
+    def _submit(self, function, *args):
+        if len(self.futures) >= self.pending:
+            done, pending = wait(self.futures, return_when=FIRST_COMPLETED)
+            self.futures = list(pending)
+            for future in done:
+                future.result()
+        self.futures.append(self.executor.submit(function, *args))
+
+    def close(self):
+        """Wait for the queued writes to finish, raising the first error"""
+        self.executor.shutdown(wait=True)
+        futures, self.futures = self.futures, []
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            self._closed(False)
+            raise
+        self._closed(True)
+
+    def abort(self):
+        """Wait for the queued writes to finish, ignoring their errors, when
+            the calendars could not all be made"""
+        self.executor.shutdown(wait=True)
+        self.futures = []
+        self._closed(False)
+
+    def _write(self, fname, data):
+        if self.gzip != 'only':
+            self._write_file(fname, data)
+        if self.gzip is not None:
+            self._write_gzip(fname + '.gz', data)
+
+    def _unchanged(self, path, size, digest):
+        """Returns True if the file *path* has *size* bytes with sha1
+            *digest*"""
+        try:
+            return os.stat(path).st_size == size and \
+                file_digest(path, self.buffer_size) == digest
+        except FileNotFoundError:
+            return False
+
+    def _write_file(self, fname, data):
+        path = join(self.directory, fname)
+        if self._unchanged(path, len(data), hashlib.sha1(data).hexdigest()):
+            self._count('unchanged')
+            return
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory,
+                                   prefix='.%s.' % fname,
+                                   suffix='.tmp')
+        try:
+            with open(fd, 'wb', buffering=self.buffer_size) as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.chmod(tmp, self.mode)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._count('written')
+
+    def _write_gzip(self, fname, data):
+        """Compress *data* into a temporary file, a buffer at a time, and
+            rename it over *fname* unless that has the same content"""
+        path = join(self.directory, fname)
+        fd, tmp = tempfile.mkstemp(dir=self.directory,
+                                   prefix='.%s.' % fname,
+                                   suffix='.tmp')
+        try:
+            with open(fd, 'wb', buffering=self.buffer_size) as f:
+                out = _DigestWriter(f)
+                # No name or timestamp so the same data gives the same file
+                with GzipFile(filename='', mode='wb', fileobj=out, mtime=0,
+                              compresslevel=self.compresslevel) as gz:
+                    view = memoryview(data)
+                    for i in range(0, len(view), self.buffer_size):
+                        gz.write(view[i:i + self.buffer_size])
+                self._count('plain_bytes', len(data))
+                self._count('compressed_bytes', out.size)
+                unchanged = self._unchanged(path, out.size,
+                                            out.sha1.hexdigest())
+                if not unchanged:
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            if unchanged:
+                os.unlink(tmp)
+                self._count('unchanged')
+                return
+            os.chmod(tmp, self.mode)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._count('written')
+
+    def _remove(self, fname):
+        try:
+            os.remove(join(self.directory, fname))
+        except FileNotFoundError:
+            pass
+
+
+class ArchiveWriter(_Encoder):
+    """Provides a writer with the same interface as :class:`CalendarWriter`
+        which streams each file into the single archive *archive* in
+        *directory*. The format is chosen from the suffix of *archive*: .zip,
+        .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz.
+
+        The *gzip* and *compresslevel* parameters are as for CalendarWriter.
+        On close a manifest of the name, size and sha1 of each file is added
+        to the archive and written next to it as *archive*.manifest.json so
+        that consumers can decide what to fetch.
+
+        Like CalendarWriter the archive is written to a temporary file in
+        *directory* and renamed into place on close, so the previous archive
+        is kept if the writer is aborted."""
+
+    def __init__(self, directory, archive, gzip=None,
+                 compresslevel=COMPRESS_LEVEL):
+        self._init_encoding(gzip, compresslevel)
+        self.directory = directory
+        self.path = join(directory, archive)
+        self.mode = 0o666 & ~_current_umask()
+        self.manifest = []
+        for suffix, mode in ARCHIVE_FORMATS.items():
+            if archive.lower().endswith(suffix):
+                break
+        else:
+            raise ValueError('Unknown archive type: %s' % archive)
+        fd, self.tmp = tempfile.mkstemp(dir=directory,
+                                        prefix='.%s.' % archive,
+                                        suffix='.tmp')
+        os.close(fd)
+        try:
+            if mode == 'zip':
+                self.zip = zipfile.ZipFile(self.tmp, 'w',
+                                           zipfile.ZIP_DEFLATED)
+                self.tar = None
+            else:
+                self.zip = None
+                self.tar = tarfile.open(self.tmp, mode)
+        except BaseException:
+            os.unlink(self.tmp)
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self, fname, data):
+        """Add the bytes *data* to the archive as *fname*"""
+        for name, encoded in self._encodings(fname, data):
+            self._add(name, encoded)
+            self.manifest.append({'name': name,
+                                  'size': len(encoded),
+                                  'sha1': hashlib.sha1(encoded).hexdigest()})
+            self.written += 1
+
+    def remove(self, fname):
+        """Files not written are simply not in the archive"""
+        pass
+
+    def close(self):
+        """Add the manifest to the archive, finish it and rename it into
+            place"""
+        if self.zip is None and self.tar is None:
+            return
+        try:
+            manifest = json.dumps({'archive': basename(self.path),
+                                   'files': self.manifest},
+                                  indent=1, sort_keys=True).encode('utf-8')
+            self._add(MANIFEST, manifest)
+            self._finish()
+            os.chmod(self.tmp, self.mode)
+            os.replace(self.tmp, self.path)
+            _replace_file(self.path + '.' + MANIFEST, manifest, self.mode)
+        except BaseException:
+            self.abort()
+            raise
+        self._closed(True)
+
+    def abort(self):
+        """Drop the partly written archive, ignoring any error closing it,
+            leaving any previous archive and manifest in place"""
+        try:
+            if self.zip is not None or self.tar is not None:
+                self._finish()
+        except Exception:
+            pass
+        try:
+            os.unlink(self.tmp)
+        except FileNotFoundError:
+            pass
+        self._closed(False)
+
+    def _finish(self):
+        archive = self.zip if self.zip is not None else self.tar
+        self.zip = self.tar = None
+        archive.close()
+
+    def _add(self, fname, data):
+        if self.zip is not None:
+            # A fixed date keeps the archive the same for the same calendars
+            info = zipfile.ZipInfo(fname, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            self.zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(fname)
+            info.size = len(data)
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+
+
+def open_writer(directory, archive=None, **kwargs):
+    """Returns an ArchiveWriter if an *archive* is given, otherwise a
+        CalendarWriter for *directory*. Other named parameters are passed to
+        the writer."""
+    if archive is not None:
+        return ArchiveWriter(directory, archive, **kwargs)
+    return CalendarWriter(directory, **kwargs)
@@ -0,0 +1,148 @@
+"""A cache of parsed rotas to avoid re-reading unchanged spreadsheets.
+
+
+This file provides the RotaCache class which stores the rows read from a rota
+in a JSON file in the user's cache directory - not the output directory,
+which is published - keyed by a hash of the memory-mapped input file and the
+sheet index. A re-run on the same input loads the cached rows instead of
+opening the spreadsheet again, and if the input, the configuration and the
+files in the output directory are all unchanged since the last run the whole
+run can be skipped.
+
+A short usage example::
+
+>>> import rota_cache
+>>> cache = rota_cache.RotaCache('generated', 'multi_rota3.xls', 0, read,
+...                              config=(source_fingerprint(__file__),))
+>>> if not cache.unchanged():
+...     rows_data = cache.read('multi_rota3.xls', handle_rows, 0)
+...     create_calendars(rows_data, 'generated')
+...     cache.save()
+"""
+import os
+import json
+import mmap
+import hashlib
+from os.path import abspath, basename, dirname, expanduser, join
+
+CACHE_DIR = 'rota_converters'
+CACHE_VERSION = 2
+
+# Files in the output directory which change on every run - and the cache
+# directory of earlier versions
+IGNORED_OUTPUTS = ('.rota_cache', 'rota_state.sqlite',
+                   'rota_state.sqlite-journal')
+
+
+def file_fingerprint(fname, *extra):
+    """Returns a hex digest of the contents of *fname*, read through mmap,
+        and any *extra* values such as the sheet index"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                h.update(data)
+    h.update(repr(extra).encode('utf-8'))
+    return h.hexdigest()
+
+
+def source_fingerprint(script):
+    """Returns a hex digest of the converter *script* and of the helper
+        modules next to it, so that a change to any of them changes the
+        configuration"""
+    directory = dirname(abspath(script))
+    h = hashlib.blake2b(digest_size=16)
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            h.update(name.encode('utf-8'))
+            h.update(file_fingerprint(join(directory, name)).encode('ascii'))
+    return h.hexdigest()
+
+
+def cache_directory(directory):
+    """Returns the directory in the user's cache directory - under
+        $XDG_CACHE_HOME or ~/.cache - for the cache of the output
+        *directory*"""
+    root = os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    name = hashlib.blake2b(abspath(directory).encode('utf-8'),
+                           digest_size=8).hexdigest()
+    return join(root, CACHE_DIR, name)
+
+
+def output_manifest(directory):
+    """Returns a dictionary of the files in *directory* to their size and
+        modification time"""
+    manifest = {}
+    for entry in os.scandir(directory):
+        if entry.name not in IGNORED_OUTPUTS and entry.is_file():
+            stat = entry.stat()
+            manifest[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return manifest
+
+
+class RotaCache:
+    """Provides a cache of the rows of sheet *sheet* of the rota *fname*,
+        kept in *directory*. The *reader* is the converter's read function,
+        used when the rows are not in the cache, and *config* is a tuple of
+        anything else that affects the output - e.g. a fingerprint of the
+        converter and its helpers and its options. The rows must be lists or
+        dictionaries of strings, numbers and None as they are kept as
+        JSON."""
+
+    def __init__(self, directory, fname, sheet, reader, config=()):
+        self.directory = directory
+        self.reader = reader
+        self.path = join(cache_directory(directory),
+                         '%s-%s.json' % (basename(fname), sheet))
+        self.key = file_fingerprint(fname, sheet, CACHE_VERSION)
+        self.config = hashlib.blake2b(repr(config).encode('utf-8'),
+                                      digest_size=16).hexdigest()
+        self.rows = None
+        self.entry = self._load()
+        if self.entry is not None and self.entry['key'] == self.key:
+            self.rows = self.entry['rows']
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or \
+                entry.get('version') != CACHE_VERSION:
+            return None
+        return entry
+
+    def unchanged(self):
+        """Returns True if the input, the configuration and the output
+            directory are all the same as at the end of the last run"""
+        return self.rows is not None and \
+            self.entry['config'] == self.config and \
+            self.entry['outputs'] == output_manifest(self.directory)
+
+    def read(self, fname, handler, sheet=0, *args, where=None, **kwds):
+        """Calls handler with the cached rows - reading them with the reader
+            if they are not cached - or only those whose field the predicate
+            of the (field, predicate) pair *where* is true for, as the reader
+            would. Optional and named parameters are passed to the provided
+            handler"""
+        if self.rows is None:
+            self.rows = self.reader(fname, list, sheet)
+        rows = iter(self.rows)
+        if where is not None:
+            field, predicate = where
+            rows = (row for row in rows if predicate(row[field]))
+        return handler(rows, *args, **kwds)
+
+    def save(self):
+        """Save the rows, configuration and the output manifest"""
+        os.makedirs(dirname(self.path), mode=0o700, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION,
+                       'key': self.key,
+                       'config': self.config,
+                       'rows': self.rows,
+                       'outputs': output_manifest(self.directory)},
+                      f, separators=(',', ':'))
+        os.replace(tmp, self.path)
@@ -0,0 +1,76 @@
+"""Functions to find clashing shifts in a rota.
+
+
+This file provides find_conflicts which sorts each person's shifts in a
+RotaModel by their start once and sweeps through them, reporting shifts that
+overlap - for example a night shift running into a day shift the next
+morning - and shifts that leave less than the minimum rest since the end of
+the previous one.
+
+A short usage example::
+
+>>> import rota_conflicts
+>>> conflicts = rota_conflicts.find_conflicts(model, timedelta(hours=11))
+>>> rota_conflicts.report_conflicts(conflicts)
+Overlapping shifts for Bob: Night SpR 2018-02-02 20:00-08:30 and SpR \
+2018-02-03 08:00-20:30
+"""
+from datetime import timedelta
+from collections import namedtuple
+
+# The minimum rest between the end of one shift and the start of the next
+MIN_REST = timedelta(hours=11)
+ZERO = timedelta(0)
+
+Conflict = namedtuple('Conflict', ['kind', 'name', 'first', 'second', 'gap'])
+
+
+def find_conflicts(model, min_rest=MIN_REST):
+    """Returns a list of Conflicts between the shifts of each person in the
+        RotaModel *model*. The kind of a conflict is 'overlap' if the second
+        shift starts before the first has finished, or 'rest' if the gap
+        between them is less than *min_rest*. Shifts that follow straight on
+        from each other, such as an AM and a PM shift, are not short of
+        rest. Whole day shifts, which are not hours of work, are only checked
+        for overlaps."""
+    conflicts = []
+    for (name,), indices in model.group_by('name'):
+        # group_by returns the indices sorted by start
+        starts = model.starts[indices].tolist()
+        ends = model.ends[indices].tolist()
+        allday = model.allday[indices].tolist()
+        latest = None
+        latest_timed = None
+        for i in range(len(indices)):
+            if latest is not None and starts[i] < ends[latest]:
+                conflicts.append(('overlap', name, indices[latest],
+                                  indices[i], starts[i] - ends[latest]))
+            elif not allday[i] and latest_timed is not None and \
+                    ZERO < starts[i] - ends[latest_timed] < min_rest:
+                conflicts.append(('rest', name, indices[latest_timed],
+                                  indices[i], starts[i] - ends[latest_timed]))
+            if latest is None or ends[i] > ends[latest]:
+                latest = i
+            if not allday[i] and \
+                    (latest_timed is None or ends[i] > ends[latest_timed]):
+                latest_timed = i
+    return [Conflict(kind, name, model.shift(first), model.shift(second), gap)
+            for kind, name, first, second, gap in conflicts]
+
+
+def _describe(shift):
+    return '%s %s-%s' % (shift.role, shift.start.strftime('%Y-%m-%d %H:%M'),
+                         shift.end.strftime('%H:%M'))
+
+
+def report_conflicts(conflicts):
+    """Print the conflicts returned by find_conflicts"""
+    for conflict in conflicts:
+        if conflict.kind == 'overlap':
+            print('Overlapping shifts for %s: %s and %s' %
+                  (conflict.name, _describe(conflict.first),
+                   _describe(conflict.second)))
+        else:
+            print('Short rest for %s: %.1f hours between %s and %s' %
+                  (conflict.name, conflict.gap.total_seconds() / 3600,
+                   _describe(conflict.first), _describe(conflict.second)))
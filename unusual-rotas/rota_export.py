@@ -0,0 +1,134 @@
+"""Functions to export the shifts of a rota for other systems.
+
+
+This file provides export_shifts which writes every shift in a RotaModel -
+the person, job, role, start, end and the row of the rota it came from - to
+a SQLite database or a JSON Lines file, so that other systems (payroll, the
+bleep directory) can use the shifts without parsing the calendars. The start
+and end are ISO 8601 times with their UTC offset in the rota's time zone.
+The columns of the model are converted in bulk and SQLite rows are inserted
+in batches within a single transaction.
+
+A short usage example::
+
+>>> import rota_export
+>>> rota_export.export_shifts(model, 'shifts.sqlite', 'multi-rota', TZ)
+151
+>>> rota_export.export_shifts(model, 'shifts.jsonl', 'multi-rota', TZ)
+151
+"""
+import json
+import sqlite3
+from itertools import islice
+import numpy as np
+
+BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shifts (
+    rota TEXT NOT NULL,
+    name TEXT NOT NULL,
+    job TEXT NOT NULL,
+    role TEXT NOT NULL,
+    day TEXT NOT NULL,
+    start_time TEXT NOT NULL,
+    end_time TEXT NOT NULL,
+    allday INTEGER NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS shifts_rota_name
+    ON shifts (rota, name, start_time);
+"""
+
+COLUMNS = ('rota', 'name', 'job', 'role', 'day', 'start_time', 'end_time',
+           'allday', 'source')
+
+
+def _json_sources(sources):
+    """Yields each of *sources* as JSON - encoding each row only once, as a
+        row is the source of a shift for everyone in it"""
+    encoded = {}
+    for source in sources:
+        key = id(source)
+        if key not in encoded:
+            encoded[key] = json.dumps(source)
+        yield encoded[key]
+
+
+def _localize(tz, value):
+    if hasattr(tz, 'localize'):
+        # pytz time zones must localize to get the offset of the date
+        return tz.localize(value)
+    return value.replace(tzinfo=tz)
+
+
+def iso_times(times, tz=None):
+    """Returns an array of the local wall clock datetime64[m] *times* as ISO
+        8601 strings, with their UTC offset in the time zone *tz* if given.
+        Each distinct time is only converted once."""
+    if tz is None:
+        return np.datetime_as_string(times)
+    distinct, inverse = np.unique(times, return_inverse=True)
+    strings = np.array([_localize(tz, value).isoformat(timespec='minutes')
+                        for value in distinct.tolist()], dtype=object)
+    return strings[inverse.reshape(-1)]
+
+
+def shift_rows(model, rota, sources=list, tz=None):
+    """Yields a tuple of the COLUMNS of each shift in the RotaModel *model*
+        in order of start, with the times as ISO 8601 strings with their UTC
+        offset in the time zone *tz*. The *sources* function is given the
+        sources of the shifts in that order."""
+    order = np.argsort(model.starts, kind='stable')
+    names = np.array(model.names, dtype=object)[model.name_codes[order]]
+    jobs = np.array(model.jobs, dtype=object)[model.job_codes[order]]
+    roles = np.array(model.roles, dtype=object)[model.role_codes[order]]
+    days = np.datetime_as_string(model.days[order])
+    starts = iso_times(model.starts[order], tz)
+    ends = iso_times(model.ends[order], tz)
+    allday = model.allday[order].astype(int)
+    return zip([rota] * len(order), names.tolist(), jobs.tolist(),
+               roles.tolist(), days.tolist(), starts.tolist(), ends.tolist(),
+               allday.tolist(), sources(model.sources[order].tolist()))
+
+
+def export_sqlite(model, fname, rota, tz=None, batch_size=BATCH_SIZE):
+    """Replace the shifts of *rota* in the SQLite database *fname* with those
+        in *model*, in the time zone *tz*, in a single transaction. Returns
+        the number of shifts."""
+    connection = sqlite3.connect(fname)
+    try:
+        connection.executescript(SCHEMA)
+        # The source rows are stored as JSON
+        rows = shift_rows(model, rota, _json_sources, tz)
+        with connection:
+            connection.execute('DELETE FROM shifts WHERE rota = ?', (rota,))
+            for batch in iter(lambda: list(islice(rows, batch_size)), []):
+                connection.executemany(
+                    'INSERT INTO shifts (%s) VALUES (%s)' %
+                    (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                    batch)
+    finally:
+        connection.close()
+    return len(model)
+
+
+def export_jsonl(model, fname, rota, tz=None):
+    """Write the shifts in *model*, in the time zone *tz*, to *fname* as JSON
+        Lines, one object per shift. Returns the number of shifts."""
+    with open(fname, 'w', encoding='utf-8') as f:
+        for row in shift_rows(model, rota, tz=tz):
+            row = dict(zip(COLUMNS, row))
+            row['allday'] = bool(row['allday'])
+            f.write(json.dumps(row))
+            f.write('\n')
+    return len(model)
+
+
+def export_shifts(model, fname, rota, tz=None):
+    """Export the shifts in *model*, whose times are local to the time zone
+        *tz*, to *fname* as JSON Lines if it ends in .jsonl, otherwise to a
+        SQLite database"""
+    if fname.lower().endswith('.jsonl'):
+        return export_jsonl(model, fname, rota, tz)
+    return export_sqlite(model, fname, rota, tz)
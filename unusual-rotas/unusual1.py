@@ -4,17 +4,21 @@ person"""
 
 # __________________________________ IMPORTS __________________________________
 from icalendar import Calendar, Event
-import uuid
 from datetime import date, datetime, timedelta
 from collections import defaultdict
 import pytz
 import dateutil.parser
+from ical_helper import event_uid
+from rota_window import in_window
 
 # _________________________________ CONSTANTS _________________________________
 # Define our local timezone
 # - this is so that the rota works even when we cross into BST/GMT
 TZ = pytz.timezone('Europe/London')
 
+# The name of this rota - used to give each event a stable identity
+ROTA = 'unusual-1'
+
 # Let's define the hours of work
 HOURS = {
     'On-Call': {
@@ -29,6 +33,13 @@ BETWEEN = (date(2017, 12, 6), date(2018, 3, 7))
 
 START_DAY = date(2016, 1, 1)
 
+# The columns of the rota that are used - the day, the name and any notes
+COLUMNS = (0, 1, 2)
+
+# The minimum rest between the end of one shift and the start of the next -
+# shorter rests and overlapping shifts are reported
+MIN_REST = timedelta(hours=11)
+
 # _________________________________ FUNCTIONS _________________________________
 # Spelling corrections
 SPELLING_CORRECTIONS = {}
@@ -51,7 +62,7 @@ def autocorrect(name):
 
 
 # Calendar functions
-def create_calendar_for(name, dates, between):
+def create_calendar_for(name, dates, between, dtstamp=None):
     """Create a calendar for name in job using the provided rows"""
     # Create a basic iCalendar object
     cal = Calendar()
@@ -65,45 +76,57 @@ def create_calendar_for(name, dates, between):
 
     # Now open the rota
     if name == 'All':
-        for day, name, additional in dates:
-            if (day >= between[0] and day < between[1]):
+        for day, name, row in dates:
+            if in_window(day, between):
                 if day.weekday() == 5:  # SAT
                     # Get a day off before
                     cal.add_component(
                         create_event_for('Lieu',
                                          day - timedelta(days=1),
                                          '',
-                                         name))
+                                         name,
+                                         dtstamp=dtstamp))
                 cal.add_component(create_event_for('On-Call',
                                                    day,
-                                                   additional,
-                                                   name))
+                                                   row[2],
+                                                   name,
+                                                   dtstamp=dtstamp))
                 if day.weekday() < 4 or day.weekday() == 6:  # MON-THURS or SUN
                     # Get a day off afterwards
                     cal.add_component(
                         create_event_for('Lieu',
                                          day + timedelta(days=1),
                                          '',
-                                         name))
+                                         name,
+                                         dtstamp=dtstamp))
     else:
-        for day, name, additional in dates:
+        for day, name, row in dates:
             # OK first of all create the on-call event for this day
-            if (day >= between[0] and day < between[1]):
+            if in_window(day, between):
                 if day.weekday() == 5:  # SAT
                     # Get a day off before
                     cal.add_component(
-                        create_event_for('Lieu', day - timedelta(days=1)))
-                cal.add_component(create_event_for('On-Call', day, additional))
+                        create_event_for('Lieu', day - timedelta(days=1),
+                                         owner=name, dtstamp=dtstamp))
+                cal.add_component(create_event_for('On-Call', day, row[2],
+                                                   owner=name,
+                                                   dtstamp=dtstamp))
                 if day.weekday() < 4 or day.weekday() == 6:  # MON-THURS or SUN
                     # Get a day off afterwards
                     cal.add_component(
-                        create_event_for('Lieu', day + timedelta(days=1)))
+                        create_event_for('Lieu', day + timedelta(days=1),
+                                         owner=name, dtstamp=dtstamp))
     return cal
 
 
-def create_event_for(role, day, additional='', name=''):
-    """Create an icalendar event for this row for name and role"""
+def create_event_for(role, day, additional='', name='', owner=None,
+                     dtstamp=None):
+    """Create an icalendar event for this row for name and role, stamped with
+    *dtstamp* or the current time. The *owner* is the person the event is for
+    if their name is not to be shown"""
     event = Event()
+    if owner is None:
+        owner = name
 
     # Munge the role
 
@@ -143,21 +166,20 @@ def create_event_for(role, day, additional='', name=''):
                           day + timedelta(days=1),
                           HOURS[role]['end']))
 
-    event.add('dtstamp', datetime.now())
+    event.add('dtstamp', dtstamp or datetime.now())
     event.add('location', 'At work')  # Set this to something useful
-    event.add('uid', uuid.uuid4())
+    event.add('uid', event_uid(ROTA, owner, role, day))
     return event
 
 
 # File reading functions
 def read_csv(fname, handler, sheet, *args, **kwds):
-    """Reads the given csv file *fname* as DictReader and calls handler with
+    """Reads the given csv file *fname* as a Reader and calls handler with
     the first argument as the reader. Optional and named parameters are passed
     to the provided handler"""
-    from csv import Reader
-    with open(fname) as f:
-        r = Reader(f)
-        return handler(r, *args, **kwds)
+    from csv_helper import Reader
+    r = Reader(fname)
+    return handler(r, *args, **kwds)
 
 
 def read_excel(fname, handler, sheet=0, *args, **kwds):
@@ -165,15 +187,27 @@ def read_excel(fname, handler, sheet=0, *args, **kwds):
     the first argument as the reader. Optional and named parameters are passed
     to the provided handler"""
     from xlrd_helper import Reader
+    if not isinstance(fname, str):
+        # bytes, a memoryview or a file-like object
+        r = Reader(fname, sheet_index=sheet, columns=COLUMNS)
+        return handler(r, *args, **kwds)
     with open(fname, 'rb') as f:
-        r = Reader(f, sheet_index=sheet)
+        r = Reader(f, sheet_index=sheet, columns=COLUMNS)
         return handler(r, *args, **kwds)
 
 
 def read(fname, handler, sheet=0, *args, **kwds):
     """Attempt to read given file *fname* as a DictReader and calls handler
     with the first argument as the reader. Optional and named parameters are
-    passed to the provided handler"""
+    passed to the provided handler.
+    *fname* may also be the rota as bytes, a memoryview or a seekable
+    binary file-like object, in which case its format is found from its
+    first bytes"""
+    if not isinstance(fname, str):
+        from xlrd_helper import sniff_format
+        if sniff_format(fname) == 'csv':
+            return read_csv(fname, handler, sheet, *args, **kwds)
+        return read_excel(fname, handler, sheet, *args, **kwds)
     if fname.lower().endswith('.csv'):
         return read_csv(fname, handler, sheet, *args, **kwds)
     elif fname.lower().endswith('.xls') or fname.lower().endswith('.xlsx'):
@@ -182,9 +216,22 @@ def read(fname, handler, sheet=0, *args, **kwds):
         raise ValueError('Unknown filetype: %s' % fname)
 
 
+def read_sheets(fname, handler, sheets, *args, **kwds):
+    """Reads each of the *sheets* of the excel file *fname* in a separate
+    process and calls handler with all of their rows in turn - the day of a
+    row follows on from the rows before it, so the rows of the sheets are
+    not handled separately. Optional and named parameters are passed to the
+    provided handler"""
+    from itertools import chain
+    from xlrd_helper import map_sheets, sheet_indices
+    rows = map_sheets(read, fname, list, sheet_indices(fname, sheets))
+    return handler(chain.from_iterable(rows), *args, **kwds)
+
+
 # Reading functions
-def handle_rows(rows):
-    """Store the rota information by name and job"""
+def on_call_days(rows):
+    """Returns a dictionary of each on-call day, in the order of the rows, to
+    the (name, row) on call that day"""
     today = START_DAY
     on_call = {}
 
@@ -199,77 +246,406 @@ def handle_rows(rows):
                 if today in on_call:
                     print('Duplicate: ', today, row)
                 else:
-                    on_call[today] = (autocorrect(row[1]), row[2])
+                    on_call[today] = (autocorrect(row[1]), row)
         except Exception:
             print('Weird row[', i, ']:', row)
+    return on_call
+
 
+def handle_rows(rows, between=None):
+    """Store the rota information by name and job. Only the days between the
+    dates in *between* are kept - everyone else just keeps their name."""
+    on_call = on_call_days(rows)
     name_to_dates = defaultdict(list)
 
     for day in on_call:
-        name, additional = on_call[day]
-        name_to_dates[name].append((day, name, additional))
-        name_to_dates['All'].append((day, name, additional))
+        name, row = on_call[day]
+        for key in (name, 'All'):
+            dates = name_to_dates[key]
+            if in_window(day, between):
+                dates.append((day, name, row))
 
     return name_to_dates
 
 
+def shift_records(names_to_dates, between):
+    """Yields a (name, job, role, day, row) tuple for every shift between the
+    dates in *between* in the rota information returned by handle_rows - the
+    days in lieu come from the row of their on-call day"""
+    for name in names_to_dates:
+        if name == 'All':
+            continue
+        for day, _, row in names_to_dates[name]:
+            if in_window(day, between):
+                if day.weekday() == 5:  # SAT
+                    # Get a day off before
+                    yield (name, 'On-Call', 'Lieu',
+                           day - timedelta(days=1), row)
+                yield (name, 'On-Call', 'On-Call', day, row)
+                if day.weekday() < 4 or day.weekday() == 6:  # MON-THURS or SUN
+                    # Get a day off afterwards
+                    yield (name, 'On-Call', 'Lieu',
+                           day + timedelta(days=1), row)
+
+
+def handle_rows_columnar(rows, between):
+    """Store the rota information between the dates in *between* as a
+    columnar rota model, built from the columns of the on-call days, with the
+    shifts of each person in turn in the order of their rows"""
+    import numpy as np
+    from rota_model import RotaModel
+    on_call = on_call_days(rows)
+    names = np.array([name for name, _ in on_call.values()], dtype=object)
+    sources = np.empty(len(on_call), dtype=object)
+    sources[:] = [row for _, row in on_call.values()]
+    days = np.array(list(on_call), dtype='datetime64[D]')
+    working = np.array([in_window(day, between) for day in on_call],
+                       dtype=bool)
+    # 1970-01-01, day 0, was a Thursday
+    weekdays = (days.astype(np.int64) + 3) % 7
+    # (shifts, role, day offset) of the day off before a SAT, the on-call day
+    # and the day off after MON-THURS or SUN, in the order they are worked
+    parts = [(working & (weekdays == 5), 'Lieu', -1),
+             (working, 'On-Call', 0),
+             (working & ((weekdays < 4) | (weekdays == 6)), 'Lieu', 1)]
+    numbers = [np.flatnonzero(shifts) for shifts, _, _ in parts]
+    roles = np.concatenate([np.full(len(number), role, dtype=object)
+                            for number, (_, role, _) in zip(numbers, parts)])
+    offsets = np.concatenate([np.full(len(number), offset)
+                              for number, (_, _, offset)
+                              in zip(numbers, parts)])
+    # Each row's shifts follow each other in the order of the parts, and
+    # everyone's shifts follow each other in the order they are first on call
+    place = np.concatenate([number * len(parts) + k
+                            for k, number in enumerate(numbers)])
+    _, first, inverse = np.unique(names, return_index=True,
+                                  return_inverse=True)
+    numbers = np.concatenate(numbers)
+    order = np.lexsort((place, first[inverse.reshape(-1)][numbers]))
+    numbers = numbers[order]
+    return RotaModel.from_columns(names[numbers],
+                                  np.full(len(numbers), 'On-Call',
+                                          dtype=object),
+                                  roles[order],
+                                  days[numbers] + offsets[order],
+                                  sources[numbers],
+                                  HOURS,
+                                  [(name, 'On-Call') for name in names])
+
+
+def load_index(fname, sheet=0, between=BETWEEN):
+    """Returns a RotaIndex of the shifts between the dates in *between* of the
+    rota *fname* to query who works when without creating the calendars"""
+    from rota_index import RotaIndex
+    reader = read if isinstance(sheet, int) else read_sheets
+    return RotaIndex(reader(fname, handle_rows_columnar, sheet, between))
+
+
 # Check last names functions
-def check_last_names(names_to_dates, directory, between):
-    """Check from the previous run of this parser if there are new names,
-    returns a dictionary of names to number of rows"""
-    from os.path import exists, join
-    from csv import DictReader, DictWriter
-
-    last_names = {}
-    # Read the last names
-    if exists(join(directory, 'last_names.csv')):
-        with open(join(directory, 'last_names.csv')) as f:
-            r = DictReader(f)
-            for row in r:
-                last_names[row['name']] = int(row['number'])
-
-    name_to_number_of_rows = {}
-    with open(join(directory, 'last_names.csv'), 'w') as f:
-        w = DictWriter(f, ['name', 'number'])
-        w.writeheader()
-        for name in names_to_dates:
-            # number is the sum of rows for each role for this name, job pair
-            number = len([day for day, _, _ in names_to_dates[name]
-                         if day >= between[0] and day < between[1]])
-            if name not in last_names:
-                # We have a new name
-                print('New name in rota: %s with %d rows' % (name, number))
-            w.writerow({'name': name, 'number': number})
-            name_to_number_of_rows[name] = number
+def count_rows(names_to_dates, between):
+    """Returns a dictionary of names to number of rows between the dates in
+    *between*"""
+    # number is the sum of rows for each role for this name, job pair
+    return {name: len([day for day, _, _ in names_to_dates[name]
+                       if in_window(day, between)])
+            for name in names_to_dates}
+
+
+def count_rows_columnar(model):
+    """Returns a dictionary of names to number of rows"""
+    counts = model.counts('name', 'role')
+    name_to_number_of_rows = {
+        'All': sum(counts[key] for key in counts if key[1] == 'On-Call')
+    }
+    for name, role in counts:
+        if role == 'On-Call':
+            name_to_number_of_rows[name] = counts[(name, role)]
+    for name, _ in model.empty:
+        name_to_number_of_rows[name] = 0
+    return name_to_number_of_rows
+
+
+def digest_rows(names_to_dates, between):
+    """Returns a dictionary of names to a digest of their shifts between the
+    dates in *between*"""
+    from rota_state import digest_shifts
+    return digest_shifts(shift_records(names_to_dates, between),
+                         lambda record: record[0],
+                         'All')
+
+
+def digest_rows_columnar(model):
+    """Returns a dictionary of names to a digest of their shifts"""
+    from rota_state import digest_shifts
+    return digest_shifts(model.shifts(), lambda record: record[0], 'All')
+
+
+def check_last_names(name_to_number_of_rows, directory, name_to_digest=None,
+                     source=''):
+    """Check from the previous runs of this parser if there are new names,
+    recording this run in the state store. Returns a dictionary of names to
+    number of rows"""
+    from rota_state import StateStore
+    if name_to_digest is None:
+        name_to_digest = {}
+
+    with StateStore(directory) as store:
+        run = store.record_run(source,
+                               [(name, '', number, name_to_digest.get(name))
+                                for name, number
+                                in name_to_number_of_rows.items()])
+        for name, _, number in store.new_names(run):
+            # We have a new name
+            print('New name in rota: %s with %d rows' % (name, number))
 
     return name_to_number_of_rows
 
 
+# Conflict functions
+def check_conflicts(names_to_dates, between, min_rest=MIN_REST):
+    """Print any overlapping shifts, or shifts with less than *min_rest*
+    between them, in the rota information returned by handle_rows between
+    the dates in *between*"""
+    from rota_model import RotaModel
+    check_conflicts_columnar(
+        RotaModel.from_records(shift_records(names_to_dates, between), HOURS),
+        min_rest)
+
+
+def check_conflicts_columnar(model, min_rest=MIN_REST):
+    """Print any overlapping shifts, or shifts with less than *min_rest*
+    between them, in the columnar rota model"""
+    from rota_conflicts import find_conflicts, report_conflicts
+    report_conflicts(find_conflicts(model, min_rest))
+
+
+# Duplicate name functions
+def load_learned_corrections(directory):
+    """Add the spelling corrections learned in previous runs to
+    SPELLING_CORRECTIONS"""
+    from os.path import exists, join
+    from rota_state import StateStore, STATE_FILENAME
+    if exists(join(directory, STATE_FILENAME)):
+        with StateStore(directory) as store:
+            for misspelling, correction in store.corrections().items():
+                SPELLING_CORRECTIONS.setdefault(misspelling, correction)
+
+
+def check_duplicate_names(name_to_number_of_rows, directory, apply=False):
+    """Look for names that are probably misspellings of each other and print
+    them. If *apply* is True the suggested corrections are added to
+    SPELLING_CORRECTIONS and saved for later runs. Returns the list of
+    (misspelling, correction) suggestions"""
+    from name_helper import suggest_corrections
+    names = {name: number for name, number in name_to_number_of_rows.items()
+             if name != 'All'}
+
+    suggestions = []
+    for misspelling, correction, similarity in suggest_corrections(names):
+        print('Possible misspelling in rota: %s of %s (%.2f)' %
+              (misspelling, correction, similarity))
+        suggestions.append((strip_unnecessary_information(misspelling),
+                            correction))
+
+    if apply and suggestions:
+        from rota_state import StateStore
+        with StateStore(directory) as store:
+            store.add_corrections(suggestions)
+        SPELLING_CORRECTIONS.update(suggestions)
+    return suggestions
+
+
+def report_changes_since(run, directory):
+    """Print what has changed in the rota since the given previous *run*"""
+    from rota_state import StateStore, report_changes
+    with StateStore(directory) as store:
+        report_changes(store.changes_since(run))
+
+
 # Writing functions
-def create_calendars(names_to_dates, directory, between):
-    from os.path import join
-    for name in names_to_dates:
-        dates = names_to_dates[name]
-        cal = create_calendar_for(name, dates, between)
-        with open(join(directory, 'rota_%s.ics' % (name)), 'wb') as f:
-            f.write(cal.to_ical())
+def write_calendar(name, cal, writer, rrule=False, coalesce=False,
+                   compact=False):
+    """Write the calendar *cal* of name with *writer*, with the whole day
+    shifts on consecutive days merged if *coalesce*, the repeating events as
+    recurring events if *rrule* and in the compact form if *compact*, and
+    return it. The events are sorted by start so that the calendar is the
+    same however the rota was stored."""
+    from ical_coalesce import coalesce_calendar
+    from ical_compact import compact_calendar
+    from ical_helper import sort_events
+    from ical_rrule import compress_calendar
+    cal = sort_events(cal)
+    if coalesce:
+        cal = coalesce_calendar(cal)
+    if rrule:
+        cal = compress_calendar(cal)
+    if compact:
+        cal = compact_calendar(cal)
+    writer.write('rota_%s.ics' % (name), cal.to_ical())
+    return cal
+
+
+def create_calendars(names_to_dates, directory, between, delta=False,
+                     dtstamp=None, output=None, rrule=False,
+                     coalesce=False, compact=False):
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        for name in names_to_dates:
+            dates = names_to_dates[name]
+            cal = create_calendar_for(name, dates, between, dtstamp)
+            cal = write_calendar(name, cal, writer, rrule, coalesce, compact)
+            if deltas is not None:
+                deltas.write('rota_%s' % (name), cal)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+def columnar_calendars(model, dtstamp=None):
+    """Yields the (name, calendar) of everyone in the columnar rota model,
+    creating the events from its arrays"""
+    groups = [('All', range(len(model)))] if len(model) or model.empty \
+        else []
+    groups += [(name, indices) for (name,), indices in model.group_by('name')]
+    groups += [(name, []) for name, _ in model.empty]
+    names = model.name_codes.tolist()
+    roles = model.role_codes.tolist()
+    days = model.days.tolist()
+    for name, indices in groups:
+        cal = create_calendar_for(name, [], None, dtstamp)
+        for i in indices:
+            owner = model.names[names[i]]
+            role = model.roles[roles[i]]
+            # Only the on-call day has the notes of its row
+            additional = model.sources[i][2] if role == 'On-Call' else ''
+            cal.add_component(
+                create_event_for(role, days[i], additional,
+                                 owner if name == 'All' else '',
+                                 owner=owner, dtstamp=dtstamp))
+        yield name, cal
+
+
+def create_calendars_columnar(model, directory, delta=False, dtstamp=None,
+                              output=None, rrule=False, coalesce=False,
+                              compact=False):
+    """Write the calendars using slices of the columnar rota model"""
+    from output_helper import open_writer
+    from ical_helper import DeltaWriter
+    with open_writer(directory, **(output or {})) as writer:
+        deltas = DeltaWriter(writer, dtstamp) if delta else None
+        for name, cal in columnar_calendars(model, dtstamp):
+            cal = write_calendar(name, cal, writer, rrule, coalesce, compact)
+            if deltas is not None:
+                deltas.write('rota_%s' % (name), cal)
+        if deltas is not None:
+            deltas.close()
+    if output and output.get('gzip'):
+        print(writer.report())
+
+
+# Export functions
+def export_rows(names_to_dates, between, fname):
+    """Export the shifts between the dates in *between* in the rota
+    information returned by handle_rows to the SQLite database or JSON Lines
+    file *fname*"""
+    from rota_model import RotaModel
+    model = RotaModel.from_records(shift_records(names_to_dates, between),
+                                   HOURS)
+    export_rows_columnar(model, fname)
+
+
+def export_rows_columnar(model, fname):
+    """Export the shifts in the columnar rota model to the SQLite database or
+    JSON Lines file *fname*"""
+    from rota_export import export_shifts
+    number = export_shifts(model, fname, ROTA, TZ)
+    print('Exported %d shifts to %s' % (number, fname))
 
 
 # Main function
-def parse_file_and_create_calendars(fname, sheet, directory, between):
+def parse_file_and_create_calendars(fname, sheet, directory, between,
+                                    columnar=False, changes_since=None,
+                                    delta=False, output=None, cache=False,
+                                    fuzzy_names=None, min_rest=MIN_REST,
+                                    export=None, rrule=False,
+                                    coalesce=False, compact=False):
     from os.path import exists
-    rows_data = read(fname, handle_rows, sheet)
-
+    from ical_helper import source_timestamp
+    dtstamp = source_timestamp(fname)
     if not exists(directory):
         from os import makedirs
         makedirs(directory)
-    check_last_names(rows_data, directory, between)
-    create_calendars(rows_data, directory, between)
+    load_learned_corrections(directory)
+    reader = read if isinstance(sheet, int) else read_sheets
+    if cache:
+        from rota_cache import RotaCache, source_fingerprint
+        rota_cache = RotaCache(directory, fname, sheet, reader,
+                               (source_fingerprint(__file__),
+                                sorted(SPELLING_CORRECTIONS.items()),
+                                between, columnar, changes_since, delta,
+                                output, fuzzy_names, min_rest, export,
+                                rrule, coalesce, compact))
+        if rota_cache.unchanged():
+            print('Rota, configuration and calendars unchanged')
+            return
+        read_rows = rota_cache.read
+    else:
+        read_rows = reader
+    if columnar:
+        model = read_rows(fname, handle_rows_columnar, sheet, between)
+    else:
+        rows_data = read_rows(fname, handle_rows, sheet, between)
+
+    if fuzzy_names is not None:
+        apply = fuzzy_names == 'apply'
+        if columnar:
+            name_to_number_of_rows = count_rows_columnar(model)
+        else:
+            name_to_number_of_rows = count_rows(rows_data, between)
+        if check_duplicate_names(name_to_number_of_rows, directory, apply) \
+                and apply:
+            # Read the rows again with the new spelling corrections
+            if columnar:
+                model = read_rows(fname, handle_rows_columnar, sheet,
+                                  between)
+            else:
+                rows_data = read_rows(fname, handle_rows, sheet, between)
+
+    if min_rest is not None:
+        if columnar:
+            check_conflicts_columnar(model, min_rest)
+        else:
+            check_conflicts(rows_data, between, min_rest)
+
+    if columnar:
+        check_last_names(count_rows_columnar(model), directory,
+                         digest_rows_columnar(model), fname)
+        create_calendars_columnar(model, directory, delta, dtstamp, output,
+                                  rrule, coalesce, compact)
+    else:
+        check_last_names(count_rows(rows_data, between), directory,
+                         digest_rows(rows_data, between), fname)
+        create_calendars(rows_data, directory, between, delta, dtstamp,
+                         output, rrule, coalesce, compact)
+    if export is not None:
+        if columnar:
+            export_rows_columnar(model, export)
+        else:
+            export_rows(rows_data, between, export)
+    if changes_since is not None:
+        report_changes_since(changes_since, directory)
+    if cache:
+        rota_cache.save()
 
 
 # __________________________________ MAIN ____________________________________
 if __name__ == '__main__':
     from argparse import ArgumentParser
+    from xlrd_helper import sheet_spec
+    from rota_window import window_spec
     parser = ArgumentParser(description='Unusual-1 Rota reader')
     parser.add_argument('filename',
                         nargs='?',
@@ -281,13 +657,86 @@ if __name__ == '__main__':
                         default='generated')
     parser.add_argument('--sheet',
                         nargs='?',
-                        type=int,
-                        help='excel spreadsheet id',
+                        type=sheet_spec,
+                        help='excel spreadsheet id, a list or range of ids '
+                             'such as 0,2-4 or all',
                         default=0)
+    parser.add_argument('--columnar',
+                        action='store_true',
+                        help='use the columnar rota model')
+    parser.add_argument('--changes-since',
+                        type=int,
+                        help='report the changes since this previous run',
+                        default=None)
+    parser.add_argument('--delta',
+                        action='store_true',
+                        help='also write calendars of the changed events')
+    parser.add_argument('--archive',
+                        help='write the calendars into this zip or tar file',
+                        default=None)
+    parser.add_argument('--gzip',
+                        choices=['also', 'only'],
+                        help='also or only write gzip compressed calendars',
+                        default=None)
+    parser.add_argument('--gzip-level',
+                        type=int,
+                        help='gzip compression level',
+                        default=9)
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='cache the parsed rota and skip unchanged runs')
+    parser.add_argument('--fuzzy-names',
+                        choices=['suggest', 'apply'],
+                        help='suggest or apply corrections for similar names',
+                        default=None)
+    parser.add_argument('--min-rest',
+                        type=float,
+                        help='report rests between shifts shorter than this '
+                             'many hours',
+                        default=11)
+    parser.add_argument('--no-conflicts',
+                        action='store_true',
+                        help='do not check for overlapping shifts')
+    parser.add_argument('--export',
+                        help='export the shifts to this SQLite database or '
+                             '.jsonl file',
+                        default=None)
+    parser.add_argument('--rrule',
+                        action='store_true',
+                        help='write repeating shifts as recurring events')
+    parser.add_argument('--window',
+                        type=window_spec,
+                        help='only the shifts from START up to END - dates, '
+                             'today or offsets from today such as '
+                             '--window=-30d:+12m',
+                        metavar='START:END',
+                        default=BETWEEN)
+    parser.add_argument('--compact',
+                        action='store_true',
+                        help='write smaller calendars without the repeated '
+                             'text and properties')
+    parser.add_argument('--coalesce',
+                        action='store_true',
+                        help='merge whole day shifts on consecutive days '
+                             'into one event')
 
     args = parser.parse_args()
 
     parse_file_and_create_calendars(args.filename,
                                     args.sheet,
                                     args.directory,
-                                    BETWEEN)
+                                    args.window,
+                                    args.columnar,
+                                    args.changes_since,
+                                    args.delta,
+                                    {'archive': args.archive,
+                                     'gzip': args.gzip,
+                                     'compresslevel': args.gzip_level},
+                                    args.cache,
+                                    args.fuzzy_names,
+                                    None if args.no_conflicts
+                                    else timedelta(hours=args.min_rest),
+                                    args.export,
+                                    args.rrule,
+                                    args.coalesce,
+                                    args.compact)